@@ -1,7 +1,19 @@
 import streamlit as st
 import time
-from src.state import GameState
-from src.agent import game_agent # Our compiled LangGraph agent
+from bisect import bisect_left
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from typing import List, Optional
+from src.state import GameState, StorySegment, SYSTEM
+from src.client import get_game_client # In-process game or a client for the headless game server
+from src.telemetry import configure_logging
+
+configure_logging()
+
+# --- Transcript Paging ---
+# Only the most recent scenes are re-rendered on each turn; older ones sit behind "earlier chapters"
+LIVE_SCENES_KEPT = 2 # Scenes left on the live page when it rolls over
+LIVE_SCENES_MAX = 8 # Once the live page holds more scenes than this, the whole page is rebuilt once
+HISTORY_PAGE_SCENES = 5 # Older scenes loaded per click on "Show earlier chapters"
 
 # --- Streamlit Page Configuration ---
 st.set_page_config(
@@ -26,7 +38,7 @@ st.markdown("""
         text-align: center;
         margin-bottom: 1em;
     }
-    .story-text {
+    .story-text, .st-key-live_story, .st-key-story_history {
         font-family: 'Georgia', serif;
         font-size: 1.1em;
         line-height: 1.6;
@@ -87,72 +99,208 @@ st.markdown("""
 
 # --- Game Logic Functions ---
 
+@st.cache_resource
+def load_game_client():
+    """
+    One game client per server process, shared by all browser sessions. It either runs the
+    game in-process or talks to a headless game server when GAME_SERVER_URL is set.
+    The in-process graph and LLM client are built in the background on the first page load.
+    """
+    client = get_game_client()
+    client.warm_up()
+    return client
+
+game_client = load_game_client()
+
+
+def run_turn_streaming(session_id: str, choice_text: Optional[str] = None) -> GameState:
+    """
+    Plays one turn and renders the scene narrative as it streams in,
+    so the player sees the first words instead of waiting for the whole scene.
+    The returned state (with the new choices) is only available once the stream completes.
+    Only the transcript segments added by this turn are fetched; the rest is already here.
+    """
+    known_state = st.session_state.get("game_state")
+    placeholder = st.empty()
+    placeholder.markdown("_The story unfolds..._")
+    narrative = ""
+    new_state = None
+    try:
+        for kind, payload in game_client.play_turn(session_id, choice_text, known_state=known_state):
+            if kind == "token":
+                narrative += payload
+                placeholder.markdown(narrative + " ▌")
+            elif kind == "reset":
+                # The request that streamed this text was replaced by another one; start over
+                narrative = ""
+                placeholder.markdown("_The story unfolds..._")
+            else:
+                new_state = payload
+    finally:
+        placeholder.empty() # The full story is rendered from the state on the next rerun
+    if new_state is None:
+        raise RuntimeError("The game service finished the turn without a state.")
+    return new_state
+
+
 def init_game():
-    """Initializes or resets the game state."""
-    st.session_state.game_state = GameState()
-    # Set a dummy input for the initial run to trigger the 'describe_scene_step' path in the agent
-    st.session_state.game_state.user_input = "__INITIAL_RUN__"
+    """Starts a new game session and generates its opening scene."""
+    session_id, st.session_state.game_state = game_client.create_session()
+    st.session_state.session_id = session_id
+    st.session_state.pop("live_from_scene", None) # The old transcript's paging doesn't apply to the new one
+    st.query_params["session"] = session_id # Reloading the page resumes this adventure
 
     # Run the agent once to get the initial scene description
     try:
-        # Pass a higher recursion limit for debugging (optional but recommended)
-        initial_state_output = game_agent.invoke(st.session_state.game_state, config={"recursion_limit": 50})
-        if not isinstance(initial_state_output, GameState):
-            st.session_state.game_state = GameState(**initial_state_output)
-            print(f"DEBUG: init_game - Converted initial_state_output from AddableValuesDict to GameState.")
-        else:
-            st.session_state.game_state = initial_state_output # It was already GameState
-
-        # IMPORTANT: Clear the dummy input after the initial run has completed
-        # This prevents it from being processed as an actual choice in subsequent turns.
-        st.session_state.game_state.user_input = ""
+        st.session_state.game_state = run_turn_streaming(session_id)
     except Exception as e:
         st.error(f"Error initializing game: {e}")
-        st.session_state.game_state.current_story_text = "An error occurred during game initialization. Please try refreshing."
+        st.session_state.game_state.add_segment(SYSTEM, "An error occurred during game initialization. Please try refreshing.")
         st.session_state.game_state.available_choices = []
 
 
+def resume_or_init_game():
+    """Picks up the session named in the URL if the game service still has it, otherwise starts a new one."""
+    session_id = st.query_params.get("session")
+    state = game_client.get_state(session_id) if session_id else None
+    if state is None:
+        init_game()
+        return
+    st.session_state.session_id = session_id
+    st.session_state.game_state = state
+    if state.user_input == "__INITIAL_RUN__":
+        # The opening scene was never generated (e.g. the page closed mid-way); do it now
+        st.session_state.game_state = run_turn_streaming(session_id)
 
 
 def make_choice(choice_text: str):
     """Callback function when a choice button is clicked."""
-
-    # This handles cases where state was left as AddableValuesDict from previous script run
-    if not isinstance(st.session_state.game_state, GameState):
-        try:
-            st.session_state.game_state = GameState(**st.session_state.game_state)
-            print(f"DEBUG: make_choice - Converted incoming session state from AddableValuesDict to GameState.")
-        except Exception as e:
-            st.error(f"FATAL ERROR in make_choice: Could not convert game state object. Details: {e}")
-            st.stop() # Stop the app if the state is unrecoverable
-  
-
     if st.session_state.game_state.game_over:
         return # Do nothing if game is over
 
-    st.session_state.game_state.user_input = choice_text # Set the user_input for the agent
-
-    # Run the agent with the updated state
+    # Run the turn; speculation, game-over checks and persistence happen in the game service
     try:
-        with st.spinner("Thinking..."): # Show a spinner while LLM processes
-            # Pass a higher recursion limit for debugging (optional but recommended)
-            new_state = game_agent.invoke(st.session_state.game_state, config={"recursion_limit": 50})
-            if not isinstance(new_state, GameState):
-                st.session_state.game_state = GameState(**new_state)
-                print(f"DEBUG: make_choice - Converted invoked new_state from AddableValuesDict to GameState.")
-            else:
-                st.session_state.game_state = new_state # It was already GameState
-   
+        # The narrative is rendered token by token while the turn runs (no blocking spinner)
+        st.session_state.game_state = run_turn_streaming(st.session_state.session_id, choice_text)
     except Exception as e:
         st.error(f"Error processing choice: {e}")
-        st.session_state.game_state.current_story_text += "\n\nAn error occurred while processing your choice."
+        st.session_state.game_state.add_segment(SYSTEM, "An error occurred while processing your choice.")
         st.session_state.game_state.available_choices = ["Restart"] # Offer restart
 
-    # Check for game over condition
-    if st.session_state.game_state.player.health <= 0:
-        st.session_state.game_state.game_over = True
-        st.session_state.game_state.current_story_text += "\n\n**Your health has dropped to zero! The adventure ends here.**"
-        st.session_state.game_state.available_choices = ["Restart Game"]
+
+def undo_choice():
+    """Takes back the last choice (e.g. a fatal one) without restarting the adventure."""
+    state = game_client.undo(st.session_state.session_id)
+    if state is None:
+        st.toast("There is nothing to undo.")
+        return
+    st.session_state.game_state = state
+
+
+def scene_segments(state: GameState, start: int, end: Optional[int] = None) -> List[StorySegment]:
+    """The transcript segments of scenes `start` to `end` (exclusive); a slice, so its cost doesn't grow with the game."""
+    segments = state.segments
+    first = bisect_left(segments, start, key=lambda segment: segment.scene) if start > 0 else 0
+    last = len(segments) if end is None else bisect_left(segments, end, key=lambda segment: segment.scene)
+    return segments[first:last]
+
+
+def render_segments(segments: List[StorySegment]):
+    # One element per segment, so appending a scene doesn't re-send the whole transcript as one block
+    for segment in segments:
+        st.markdown(segment.text) # Use markdown to render potential bold/italics from LLM
+
+
+def update_live_page(state: GameState):
+    """
+    Decides which scenes the live page shows. Runs on full reruns only: the page keeps growing
+    through fragment reruns until it holds LIVE_SCENES_MAX scenes, then rolls over here.
+    """
+    live_from = st.session_state.get("live_from_scene")
+    if live_from is None or live_from >= state.scene_count or state.scene_count - live_from > LIVE_SCENES_MAX:
+        st.session_state.live_from_scene = max(0, state.scene_count - LIVE_SCENES_KEPT)
+        st.session_state.history_pages = 0 # Earlier chapters collapse again when the page rolls over
+
+
+def set_history_pages(pages: int):
+    """Button callback; the click then reruns only the history fragment."""
+    st.session_state.history_pages = pages
+
+
+@st.fragment
+def story_history():
+    """Scenes before the live page, collapsed; pages are loaded on demand and rerun only this fragment."""
+    live_from = st.session_state.live_from_scene
+    if live_from <= 0:
+        return
+    pages = st.session_state.get("history_pages", 0)
+    first_loaded = max(0, live_from - pages * HISTORY_PAGE_SCENES)
+    if first_loaded > 0:
+        hidden = "1 earlier chapter" if first_loaded == 1 else f"{first_loaded} earlier chapters"
+        st.button(f"📜 Show earlier chapters ({hidden})", key="show_history_button", on_click=set_history_pages, args=(pages + 1,))
+    if pages:
+        with st.container(key="story_history"):
+            render_segments(scene_segments(st.session_state.game_state, first_loaded, live_from))
+        st.button("Hide earlier chapters", key="hide_history_button", on_click=set_history_pages, args=(0,))
+
+
+def rerun_after_turn():
+    """Reruns just the turn fragment, or the whole page when the live page is full or was replaced (undo, restart)."""
+    state = st.session_state.game_state
+    live_from = st.session_state.live_from_scene
+    # A click normally reruns only its fragment; if it came in with a full run, that is all there is to rerun
+    fragment_run = bool(get_script_run_ctx().fragment_ids_this_run)
+    if not fragment_run or live_from >= state.scene_count or state.scene_count - live_from > LIVE_SCENES_MAX:
+        st.rerun()
+    st.rerun(scope="fragment")
+
+
+@st.fragment
+def game_turn():
+    """
+    The live page of the story, the player's stats and the choices. A click reruns only this
+    fragment, so a turn's render cost stays the same however long the adventure gets.
+    """
+    current_game_state = st.session_state.game_state
+
+    # --- Display Story Text ---
+    with st.container(key="live_story"):
+        render_segments(scene_segments(current_game_state, st.session_state.live_from_scene))
+
+    # --- Display Player Stats ---
+    st.markdown(
+        "<div class='player-stats'>"
+        f"<span class='player-stat-item'>❤️ Health: <b>{current_game_state.player.health}</b></span>"
+        f"<span class='player-stat-item'>🎒 Inventory: <b>{', '.join(current_game_state.player.inventory) if current_game_state.player.inventory else 'Empty'}</b></span>"
+        f"<span class='player-stat-item'>📍 Location: <b>{current_game_state.player.current_location_name}</b></span>"
+        "</div>",
+        unsafe_allow_html=True,
+    )
+
+    # --- Display Choices or Game Over Message ---
+    if current_game_state.game_over:
+        st.markdown("<p class='game-over-message'>GAME OVER</p>", unsafe_allow_html=True)
+        if st.button("Restart Game", key="restart_game_button"):
+            init_game() # Re-initialize the game
+            st.rerun() # A new transcript: rebuild the whole page
+        if st.button("↩️ Undo last choice", key="undo_game_over_button"):
+            undo_choice()
+            rerun_after_turn()
+    else:
+        st.markdown("---")
+        st.subheader("What do you do next?")
+
+        # Stacked buttons, one per choice, for robust responsiveness
+        for i, choice in enumerate(current_game_state.available_choices):
+            # Use a unique key for each button to prevent Streamlit warnings
+            if st.button(choice, key=f"choice_button_{i}", use_container_width=True):
+                make_choice(choice)
+                rerun_after_turn() # Show the new scene, stats and choices
+
+        # Every turn is checkpointed, so the last choice can be taken back
+        if st.button("↩️ Undo last choice", key="undo_button"):
+            undo_choice()
+            rerun_after_turn()
 
 
 # --- Main Streamlit App Layout ---
@@ -162,56 +310,12 @@ st.markdown("<h2 class='subheader'>A Choose Your Own Adventure</h2>", unsafe_all
 
 # Initialize game state if not already present
 if "game_state" not in st.session_state:
-    init_game()
-
-current_game_state = st.session_state.game_state
+    resume_or_init_game()
 
-# LangGraph might return AddableValuesDict even when using Pydantic state.
-# We need to ensure we're always working with our GameState Pydantic object.
-if not isinstance(current_game_state, GameState):
-    try:
-        # Attempt to re-instantiate GameState from the dict-like object
-        current_game_state = GameState(**current_game_state)
-        st.session_state.game_state = current_game_state # Update session state with the correct type
-        print(f"DEBUG: Converted state from AddableValuesDict to GameState successfully.")
-    except Exception as e:
-        st.error(f"FATAL ERROR: Could not convert game state object. Details: {e}")
-        st.stop()
-
-# --- Display Player Stats ---
-st.markdown("<div class='player-stats'>", unsafe_allow_html=True)
-st.markdown(f"<span class='player-stat-item'>❤️ Health: **{current_game_state.player.health}**</span>", unsafe_allow_html=True)
-st.markdown(f"<span class='player-stat-item'>🎒 Inventory: **{', '.join(current_game_state.player.inventory) if current_game_state.player.inventory else 'Empty'}**</span>", unsafe_allow_html=True)
-st.markdown(f"<span class='player-stat-item'>📍 Location: **{current_game_state.player.current_location_name}**</span>", unsafe_allow_html=True)
-st.markdown("</div>", unsafe_allow_html=True)
-
-# --- Display Story Text ---
-st.markdown("<div class='story-text'>", unsafe_allow_html=True)
-st.markdown(current_game_state.current_story_text) # Use markdown to render potential bold/italics from LLM
-st.markdown("</div>", unsafe_allow_html=True)
-
-# --- Display Choices or Game Over Message ---
-if current_game_state.game_over:
-    st.markdown("<p class='game-over-message'>GAME OVER</p>", unsafe_allow_html=True)
-    if st.button("Restart Game", key="restart_game_button"):
-        init_game() # Re-initialize the game
-        st.rerun() # Rerun the app to show the new initial state
-else:
-    st.markdown("---")
-    st.subheader("What do you do next?")
-    
-    # Create buttons for each choice
-    # Using st.columns to put buttons side-by-side if there are many choices
-    # cols = st.columns(len(current_game_state.available_choices)) # This can be too many columns
-    
-    # Better to just stack them or use a fixed number of columns for better layout control
-    # For now, let's just stack them for simplicity and robust responsiveness.
-    for i, choice in enumerate(current_game_state.available_choices):
-        # Use a unique key for each button to prevent Streamlit warnings
-        if st.button(choice, key=f"choice_button_{i}", use_container_width=True):
-            make_choice(choice)
-            st.rerun() # Rerun the app to process the choice and update the display
+update_live_page(st.session_state.game_state)
+story_history()
+game_turn()
 
 # Optional: Add a debug section to view the full state
 # with st.expander("Debug Game State"):
-#    st.json(st.session_state.game_state.model_dump_json())
\ No newline at end of file
+#    st.json(st.session_state.game_state.model_dump_json())
@@ -0,0 +1 @@
+# Offline benchmarks and load tests for the game graph (see run_benchmark.py).
@@ -0,0 +1,110 @@
+"""
+Cold-start benchmark: how long a fresh worker takes (and how much memory it needs) to get
+from `import` to a usable game.
+
+Each stage runs in a new interpreter, several times, so nothing is warm from a previous run:
+
+    python -m benchmarks.import_benchmark
+    python -m benchmarks.import_benchmark --output benchmarks/import_baseline.json
+    python -m benchmarks.import_benchmark --compare benchmarks/import_baseline.json   # exits 1 on regressions
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+# Code run in the child interpreter before the timed statement
+SETUP = "import time, resource, json, sys\n"
+# Reports the timed statement's wall time, the peak RSS and how many modules ended up loaded
+MEASURE = """
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb, "modules": len(sys.modules)}}))
+"""
+
+# Stage name -> (untimed setup, timed statement). Each stage is what that kind of process pays on boot.
+STAGES = {
+    # What app.py pulls in at the top of every cold Streamlit worker
+    "import_client": ("", "import src.client"),
+    "import_agent": ("", "import src.agent"),
+    # First turn: compile the graph
+    "build_graph": ("import src.agent", "src.agent.get_game_agent()"),
+    # First LLM call: import the provider SDK and construct its client
+    "build_llm": ("import src.agent", "src.agent.get_llm()"),
+    # Everything a fresh worker does before it can serve its first turn
+    "cold_start_total": ("", "import src.agent; src.agent.get_game_agent(); src.agent.get_llm()"),
+}
+# Regressions beyond this fraction of the baseline (and MIN_ABSOLUTE_REGRESSION_SECONDS) fail --compare
+DEFAULT_TOLERANCE = 0.25
+MIN_ABSOLUTE_REGRESSION_SECONDS = 0.05
+
+
+def measure(setup: str, statement: str) -> Dict[str, float]:
+    env = dict(os.environ)
+    # A placeholder key lets build_llm construct the client; nothing is sent to the provider
+    env.setdefault("GEMINI_API_KEY", "import-benchmark")
+    env.setdefault("LLM_CACHE_PATH", "")
+    code = SETUP + setup + "\n" + MEASURE.format(statement=statement)
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, (setup, statement) in STAGES.items():
+        samples: List[Dict[str, float]] = [measure(setup, statement) for _ in range(repeat)]
+        seconds = [s["seconds"] for s in samples]
+        results[name] = {
+            "median_seconds": round(statistics.median(seconds), 4),
+            "max_seconds": round(max(seconds), 4),
+            "peak_rss_mb": round(max(s["rss_mb"] for s in samples), 1),
+            "modules": samples[-1]["modules"],
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    problems = []
+    for name, before in baseline.items():
+        now = results.get(name)
+        if now is None:
+            continue
+        delta = now["median_seconds"] - before["median_seconds"]
+        if now["median_seconds"] > before["median_seconds"] * (1 + tolerance) and delta > MIN_ABSOLUTE_REGRESSION_SECONDS:
+            problems.append(f"{name}: {now['median_seconds']:.3f}s vs baseline {before['median_seconds']:.3f}s")
+        if now["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            problems.append(f"{name} peak RSS: {now['peak_rss_mb']:.1f} MB vs baseline {before['peak_rss_mb']:.1f} MB")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start time and memory of the game modules.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per stage.")
+    parser.add_argument("--output", help="Write the JSON results here.")
+    parser.add_argument("--compare", help="Baseline JSON to compare against; exits 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
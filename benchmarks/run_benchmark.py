@@ -0,0 +1,307 @@
+"""
+Offline benchmark and load test for the game graph.
+
+Drives the compiled graph through scripted or random playthroughs (including invalid input)
+against FakeChatModel, so it needs no API key and no network:
+
+    python -m benchmarks.run_benchmark --sessions 20 --turns 12 --concurrency 8
+    python -m benchmarks.run_benchmark --output benchmarks/baseline.json       # record a baseline
+    python -m benchmarks.run_benchmark --compare benchmarks/baseline.json      # fail on regressions
+
+Reports per-node latency percentiles, turns/sec, scene prompt tokens per turn and peak RSS.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# The benchmark never talks to Gemini; these keep src.agent from needing a key or a disk cache.
+os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+os.environ.setdefault("LLM_CACHE_PATH", "")
+os.environ.setdefault("SPECULATION_MAX_CONCURRENT", "0")
+
+from src.fake_llm import FakeChatModel, call_tag
+from src.scheduler import INITIAL, INTERACTIVE, SCHEDULERS, request_class
+from src.state import GameState, as_game_state, to_graph_input
+
+SCRIPTED_CHOICES = [
+    "Go deeper into the forest", "Try to climb a tall tree", "Rest and recover health",
+    "Follow the sound of running water", "Continue forward", "Turn back",
+]
+INVALID_INPUTS = ["dance with the trees", "open my map", "shout for help", "eat the moss"]
+# Regressions beyond this fraction of the baseline fail --compare (latency is noisy; tokens are not).
+DEFAULT_TOLERANCE = 0.25
+# ...and must also exceed it by this much in absolute terms, so sub-millisecond nodes don't flap.
+MIN_ABSOLUTE_REGRESSION = 5.0
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": round(pick(0.50), 2),
+        "p90": round(pick(0.90), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def pick_input(state: GameState, rng: random.Random, mode: str, turn: int, invalid_rate: float) -> str:
+    if rng.random() < invalid_rate:
+        return rng.choice(INVALID_INPUTS)
+    if mode == "scripted":
+        # Prefer the scripted path, falling back to the first offered choice
+        for choice in SCRIPTED_CHOICES[turn % len(SCRIPTED_CHOICES):] + SCRIPTED_CHOICES:
+            if choice in state.available_choices:
+                return choice
+        return state.available_choices[0]
+    return rng.choice(state.available_choices)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.node_latency = defaultdict(list)
+        self.turn_latency: List[float] = []
+        self.turns = 0
+        self.errors = 0
+
+    def add(self, node_times: Dict[str, float], turn_time: float) -> None:
+        with self.lock:
+            for node, seconds in node_times.items():
+                self.node_latency[node].append(seconds * 1000)
+            self.turn_latency.append(turn_time * 1000)
+            self.turns += 1
+
+
+def timed_turn(agent, state: GameState):
+    """Runs one graph step, timing each node from the gaps between streamed updates."""
+    node_times = {}
+    final = None
+    last = time.perf_counter()
+    for mode, chunk in agent.get_game_agent().stream(to_graph_input(state), stream_mode=["updates", "values"]):
+        now = time.perf_counter()
+        if mode == "updates":
+            for node in chunk:
+                node_times[node] = now - last
+            last = now
+        else:
+            final = chunk
+    return as_game_state(final), node_times
+
+
+async def atimed_turn(agent, state: GameState):
+    node_times = {}
+    final = None
+    last = time.perf_counter()
+    async for mode, chunk in agent.get_game_agent().astream(to_graph_input(state), stream_mode=["updates", "values"]):
+        now = time.perf_counter()
+        if mode == "updates":
+            for node in chunk:
+                node_times[node] = now - last
+            last = now
+        else:
+            final = chunk
+    return as_game_state(final), node_times
+
+
+def play_session(agent, session: int, args, recorder: Recorder) -> None:
+    rng = random.Random(args.seed * 100003 + session)
+    state = GameState(user_input="__INITIAL_RUN__")
+    for turn in range(args.turns + 1):
+        if turn > 0:
+            if state.game_over or not state.available_choices:
+                break
+            state.user_input = pick_input(state, rng, args.mode, turn, args.invalid_rate)
+        token = call_tag.set((session, turn))
+        started = time.perf_counter()
+        try:
+            with request_class(INTERACTIVE if turn > 0 else INITIAL, f"bench-{session}"):
+                state, node_times = timed_turn(agent, state)
+        except Exception:
+            with recorder.lock:
+                recorder.errors += 1
+            break
+        finally:
+            call_tag.reset(token)
+        recorder.add(node_times, time.perf_counter() - started)
+        state.user_input = ""
+
+
+async def aplay_session(agent, session: int, args, recorder: Recorder, limit: asyncio.Semaphore) -> None:
+    async with limit:
+        rng = random.Random(args.seed * 100003 + session)
+        state = GameState(user_input="__INITIAL_RUN__")
+        for turn in range(args.turns + 1):
+            if turn > 0:
+                if state.game_over or not state.available_choices:
+                    break
+                state.user_input = pick_input(state, rng, args.mode, turn, args.invalid_rate)
+            call_tag.set((session, turn))
+            started = time.perf_counter()
+            try:
+                with request_class(INTERACTIVE if turn > 0 else INITIAL, f"bench-{session}"):
+                    state, node_times = await atimed_turn(agent, state)
+            except Exception:
+                recorder.errors += 1
+                break
+            recorder.add(node_times, time.perf_counter() - started)
+            state.user_input = ""
+
+
+def run(args) -> dict:
+    from src import agent
+    from src.telemetry import tracer
+
+    fake = FakeChatModel(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate,
+        stall_rate=args.stall_rate,
+        stall_ms=args.stall_ms,
+        seed=args.seed,
+    )
+    # The fast-tier stand-in answers like the quality tier, just without stalls or failures
+    fast = FakeChatModel(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, seed=args.seed + 1, model="fake-gemini-lite") if args.fallback else None
+    agent.set_llm(fake, fast=fast)
+    for scheduler in SCHEDULERS:
+        scheduler.set_limits(args.rpm, args.tpm)
+    agent.get_game_agent() # Compile the graph up front, as the server does, so it isn't timed as part of a turn
+    recorder = Recorder()
+
+    started = time.perf_counter()
+    if args.use_async:
+        async def main():
+            limit = asyncio.Semaphore(args.concurrency)
+            await asyncio.gather(*[aplay_session(agent, s, args, recorder, limit) for s in range(args.sessions)])
+        asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda s: play_session(agent, s, args, recorder), range(args.sessions)))
+    elapsed = time.perf_counter() - started
+
+    # Scene prompt size per turn index, averaged over sessions: should flatten out, not keep growing
+    prompt_tokens = defaultdict(list)
+    calls_by_kind = defaultdict(int)
+    for call in fake.calls:
+        calls_by_kind[call["kind"]] += 1
+        if call["kind"] == "scene" and call["tag"] is not None:
+            prompt_tokens[call["tag"][1]].append(call["prompt_tokens"])
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": {
+            "elapsed_seconds": elapsed,
+            "turns": recorder.turns,
+            "turns_per_second": recorder.turns / elapsed if elapsed else 0.0,
+            "errors": recorder.errors,
+            "turn_latency_ms": percentiles(recorder.turn_latency),
+            "node_latency_ms": {node: percentiles(samples) for node, samples in sorted(recorder.node_latency.items())},
+            "scene_prompt_tokens_by_turn": [
+                round(sum(v) / len(v), 1) for _, v in sorted(prompt_tokens.items())
+            ],
+            "llm_calls": dict(calls_by_kind),
+            "llm_failures": sum(1 for call in fake.calls if call["failed"]),
+            # Timeouts, retries, hedges and fallbacks of the resilience policy (src/resilience.py)
+            "llm_resilience": agent.resilient_llm.report(),
+            # Which model tier each kind of prompt was routed to, and why (src/router.py)
+            "llm_router": agent.router.report(),
+            # Queue waits and admission rejections per priority class (src/scheduler.py)
+            "llm_scheduler": {scheduler.name: scheduler.report() for scheduler in SCHEDULERS},
+            # Mean wall / LLM / local time per node, from the graph's own tracer (src/telemetry.py)
+            "node_time_breakdown": tracer.report(),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Returns human-readable regressions of `report` against `baseline`."""
+    problems = []
+    current, previous = report["results"], baseline["results"]
+
+    def check(name: str, now: float, before: float):
+        if before and now > before * (1 + tolerance) and now - before > MIN_ABSOLUTE_REGRESSION:
+            problems.append(f"{name}: {now:.1f} vs baseline {before:.1f} (+{(now / before - 1) * 100:.0f}%)")
+
+    check("turn p95 ms", current["turn_latency_ms"].get("p95", 0), previous["turn_latency_ms"].get("p95", 0))
+    for node, stats in previous["node_latency_ms"].items():
+        check(f"{node} p95 ms", current["node_latency_ms"].get(node, {}).get("p95", 0), stats.get("p95", 0))
+    if current["scene_prompt_tokens_by_turn"] and previous["scene_prompt_tokens_by_turn"]:
+        check("last-turn scene prompt tokens", current["scene_prompt_tokens_by_turn"][-1], previous["scene_prompt_tokens_by_turn"][-1])
+    check("peak RSS MB", current["peak_rss_mb"], previous["peak_rss_mb"])
+    if previous["turns_per_second"] and current["turns_per_second"] < previous["turns_per_second"] * (1 - tolerance):
+        problems.append(f"turns/sec: {current['turns_per_second']:.2f} vs baseline {previous['turns_per_second']:.2f}")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the adventure game graph.")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=12, help="Choices per session after the opening scene.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["scripted", "random"], default="random")
+    parser.add_argument("--invalid-rate", type=float, default=0.15, help="Share of turns with invalid free-form input.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Median fake LLM time to first token.")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="Log-normal spread of the fake latency.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Fake streaming rate (0 = instant).")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of fake LLM calls that hang for --stall-ms.")
+    parser.add_argument("--stall-ms", type=float, default=0.0)
+    parser.add_argument("--fallback", action="store_true", help="Serve the fast tier (and so scene fallbacks) with a separate fake model that never stalls or fails.")
+    parser.add_argument("--rpm", type=float, default=0.0, help="Requests/min budget per model tier (0 = unlimited).")
+    parser.add_argument("--tpm", type=float, default=0.0, help="Tokens/min budget per model tier (0 = unlimited).")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Drive the graph with astream.")
+    parser.add_argument("--output", help="Write the JSON report here (e.g. benchmarks/baseline.json).")
+    parser.add_argument("--compare", help="Baseline JSON to compare against; exits 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    print(json.dumps(report["results"], indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Options added after the baseline was recorded count as their defaults
+        defaults = vars(parse_args([]))
+        baseline_config = baseline.get("config", {})
+        differing = sorted(k for k, v in report["config"].items() if k != "tolerance" and baseline_config.get(k, defaults.get(k)) != v)
+        if differing:
+            print(f"WARNING: run configuration differs from the baseline ({', '.join(differing)}); results may not be comparable.")
+        problems = compare(report, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
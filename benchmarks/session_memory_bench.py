@@ -0,0 +1,77 @@
+"""
+Memory per resident session: GameState as Pydantic models against its compact form.
+
+Builds `--sessions` mid-adventure sessions per transcript length and measures (with
+tracemalloc) what keeping them in memory costs as GameStates and as CompactSessions
+(src/session_memory.py), next to the size estimate SessionMemory budgets with, the spilled
+JSON size and the time to pack and unpack one session:
+
+    python -m benchmarks.session_memory_bench
+    python -m benchmarks.session_memory_bench --scenes 10 100 --sessions 500
+
+Bytes are per session; times are medians in milliseconds.
+"""
+import gc
+import sys
+import json
+import argparse
+import tracemalloc
+from typing import Callable, Dict
+
+from benchmarks.state_bench import build_state, median_ms
+from src.session_memory import CompactSession
+
+
+def traced_bytes(build: Callable[[], object]) -> int:
+    """Bytes still allocated by `build` once it has returned (its result is kept alive)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def measure(scenes: int, sessions: int, repeat: int) -> Dict[str, float]:
+    states = [build_state(scenes) for _ in range(sessions)]
+    compact = CompactSession.from_state(states[0]) # Also loads the flag table, outside the traced region
+    # The texts are created outside the traced region in both cases, so both measure the same data:
+    # what a resident session costs on top of its transcript strings
+    texts = sum(sys.getsizeof(segment.text) for segment in states[0].segments)
+    pydantic_bytes = traced_bytes(lambda: [state.model_copy(update={"segments": [s.model_copy() for s in state.segments]}) for state in states])
+    compact_bytes = traced_bytes(lambda: [CompactSession.from_state(state) for state in states])
+    return {
+        "segments": len(states[0].segments),
+        "text_bytes": texts,
+        "pydantic_overhead_bytes": round(pydantic_bytes / sessions),
+        "compact_overhead_bytes": round(compact_bytes / sessions),
+        "pydantic_bytes": texts + round(pydantic_bytes / sessions),
+        "compact_bytes": texts + round(compact_bytes / sessions),
+        "budgeted_bytes": compact.nbytes,
+        "spilled_json_bytes": len(states[0].model_dump_json()),
+        "pack_ms": median_ms(lambda: CompactSession.from_state(states[0]), repeat),
+        "unpack_ms": median_ms(compact.to_state, repeat),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Memory per resident session, Pydantic against compact.")
+    parser.add_argument("--scenes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--sessions", type=int, default=200, help="Sessions built per transcript length.")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed runs per measurement (median is reported).")
+    parser.add_argument("--output", help="Write the JSON results here.")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, float]] = {str(scenes): measure(scenes, args.sessions, args.repeat) for scenes in args.scenes}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Microbenchmark of the state handling a turn pays for, as the transcript grows.
+
+A turn with an instant FakeChatModel is almost all state handling, so its time is measured for
+transcripts of different lengths, next to the pieces it is made of (building the graph input,
+validating each node's update, rebuilding the GameState) and to what re-validating the whole
+state after every node would cost instead:
+
+    python -m benchmarks.state_bench
+    python -m benchmarks.state_bench --scenes 10 100 1000 5000 --repeat 100
+
+Times are medians in milliseconds. Delta handling should stay flat as `scenes` grows; full
+validation grows with the transcript.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+# No API key, disk cache or background speculation needed (same as run_benchmark.py)
+os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+os.environ.setdefault("LLM_CACHE_PATH", "")
+os.environ.setdefault("SPECULATION_MAX_CONCURRENT", "0")
+
+from src.fake_llm import FakeChatModel
+from src.state import (
+    GameState, Player, SCENE, OUTCOME,
+    as_game_state, to_graph_input, validate_update
+)
+
+# Nodes run on a choice turn: game_start_node, handle_user_choice, update_location_name, describe_scene
+NODES_PER_TURN = 4
+
+
+def build_state(scenes: int) -> GameState:
+    """A mid-adventure state with `scenes` scenes (each followed by a choice outcome) in its transcript."""
+    state = GameState(player=Player(current_location_id="start_forest", current_location_name="Mysterious Whispering Forest"))
+    paragraph = "The moss glimmers under an ancient lantern while a distant river whispers. " * 6
+    for scene in range(scenes):
+        state.add_segment(SCENE, f"Scene {scene}. {paragraph}")
+        state.add_segment(OUTCOME, f"_Your journey drains your energy._ Outcome {scene}.")
+    state.available_choices = ["Go deeper into the forest", "Look for a path to the village", "Examine the strange glowing mushroom"]
+    state.plot_flags = {"tower_seen": True}
+    return state
+
+
+def median_ms(func: Callable[[], object], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 4)
+
+
+def measure(scenes: int, repeat: int) -> Dict[str, float]:
+    from src import agent
+
+    state = build_state(scenes)
+    state.user_input = "Examine the strange glowing mushroom"
+    # The updates a choice turn's nodes return (handle_user_choice, update_location_name, describe_scene)
+    player = state.player.model_copy(update={"health": 45})
+    updates = [
+        {"player": player, "plot_flags": {}, "available_choices": [], "user_input": "",
+         "segments": state.new_segments((OUTCOME, "You approach the mushroom."))},
+        {"player": player.model_copy(update={"current_location_name": "Mysterious Whispering Forest"})},
+        {"story_summary": "", "summarized_scene_count": 0, "available_choices": list(state.available_choices),
+         "user_input": "", "segments": state.new_segments((SCENE, "A new scene."))},
+    ]
+    values = to_graph_input(state)
+
+    def delta_handling():
+        graph_input = to_graph_input(state)
+        for update in updates:
+            validate_update(update)
+        return as_game_state(graph_input)
+
+    def full_validation():
+        # A graph over the Pydantic model validates the complete state again after every node
+        for _ in range(NODES_PER_TURN):
+            GameState.model_validate(state.model_dump())
+
+    return {
+        "segments": len(state.segments),
+        "graph_turn_ms": median_ms(lambda: agent.run_game_turn(state), repeat),
+        "graph_input_ms": median_ms(lambda: to_graph_input(state), repeat),
+        "validate_updates_ms": median_ms(lambda: [validate_update(u) for u in updates], repeat),
+        "as_game_state_ms": median_ms(lambda: as_game_state(values), repeat),
+        "delta_handling_ms": median_ms(delta_handling, repeat),
+        "full_validation_per_node_ms": median_ms(full_validation, max(3, repeat // 10)),
+    }
+
+
+def run(scene_counts: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    from src import agent
+
+    agent.set_llm(FakeChatModel(latency_ms=0.0, latency_sigma=0.0, response_words=120))
+    agent.get_game_agent() # Compile up front so it isn't timed as part of the first turn
+    return {str(scenes): measure(scenes, repeat) for scenes in scene_counts}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Per-turn state handling cost against transcript length.")
+    parser.add_argument("--scenes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50, help="Timed runs per measurement (median is reported).")
+    parser.add_argument("--output", help="Write the JSON results here.")
+    args = parser.parse_args(argv)
+
+    results = run(args.scenes, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
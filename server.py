@@ -0,0 +1,186 @@
+"""
+Headless HTTP/WebSocket game server.
+
+Run a single process:
+    uvicorn server:app --port 8000
+or several workers; the default session store (SESSION_STORE=checkpoint) keeps every session
+in one SQLite file, so sessions survive restarts and any worker can serve any turn:
+    uvicorn server:app --port 8000 --workers 4
+(SESSION_STORE=sqlite shares sessions the same way without keeping earlier turns for undo;
+SESSION_STORE=memory keeps them per worker, so it needs a single worker or sticky sessions.)
+
+Point the Streamlit app at it with GAME_SERVER_URL=http://localhost:8000.
+Prometheus can scrape per-node and LLM metrics from /metrics.
+"""
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from src.service import GameService, SessionNotFound
+from src.telemetry import configure_logging, tracer
+
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile the graph before taking traffic, so a new worker's first turn doesn't pay for it
+    from src.agent import get_game_agent
+    await asyncio.to_thread(get_game_agent)
+    yield
+
+
+app = FastAPI(title="The Whispering Wilds - Game Server", lifespan=lifespan)
+service = GameService()
+
+
+class RewindRequest(BaseModel):
+    turn: int # As listed by GET /sessions/{session_id}/history
+
+
+class TurnRequest(BaseModel):
+    choice: Optional[str] = None # None generates the pending opening scene
+    # Id of the newest transcript segment the client already has; only later segments are sent back
+    after: Optional[int] = None
+
+
+def _state_json(state, after: Optional[int] = None) -> dict:
+    if after is None:
+        return json.loads(state.model_dump_json())
+    # Everything but the transcript, plus just the segments the client hasn't seen
+    payload = json.loads(state.model_dump_json(exclude={"segments"}))
+    payload["segments"] = [json.loads(segment.model_dump_json()) for segment in state.segments_after(after)]
+    return payload
+
+
+async def _get_state_or_404(session_id: str):
+    try:
+        return await asyncio.to_thread(service.get_state, session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session.")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats():
+    return await asyncio.to_thread(service.report)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Node and LLM timings, sizes and cache outcomes in the Prometheus text format."""
+    return tracer.metrics.render()
+
+
+@app.post("/sessions")
+async def start_game():
+    """Creates a session. Its opening scene is produced by the first turn request with no choice."""
+    session_id, state = await asyncio.to_thread(service.create_session)
+    return {"session_id": session_id, "state": _state_json(state)}
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    return {"session_id": session_id, "state": _state_json(await _get_state_or_404(session_id))}
+
+
+@app.get("/sessions/{session_id}/segments")
+async def get_segments(session_id: str, after: int = -1):
+    """Transcript segments with an id greater than `after`, so clients only download what is new."""
+    try:
+        segments = await asyncio.to_thread(service.get_segments, session_id, after)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session.")
+    return {"session_id": session_id, "segments": [json.loads(segment.model_dump_json()) for segment in segments]}
+
+
+@app.get("/sessions/{session_id}/history")
+async def get_history(session_id: str):
+    """The turns this session can be rewound to."""
+    try:
+        return {"session_id": session_id, "turns": await asyncio.to_thread(service.history, session_id)}
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session.")
+
+
+@app.post("/sessions/{session_id}/rewind")
+async def rewind(session_id: str, request: RewindRequest):
+    """Returns the session to an earlier turn; later turns are discarded."""
+    await _get_state_or_404(session_id)
+    state = await service.rewind(session_id, request.turn)
+    if state is None:
+        raise HTTPException(status_code=409, detail="That turn can't be restored.")
+    return {"session_id": session_id, "state": _state_json(state)}
+
+
+@app.post("/sessions/{session_id}/undo")
+async def undo(session_id: str):
+    """Takes back the last choice."""
+    await _get_state_or_404(session_id)
+    state = await service.undo(session_id)
+    if state is None:
+        raise HTTPException(status_code=409, detail="Nothing to undo.")
+    return {"session_id": session_id, "state": _state_json(state)}
+
+
+@app.delete("/sessions/{session_id}")
+async def end_game(session_id: str):
+    await asyncio.to_thread(service.delete_session, session_id)
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.post("/sessions/{session_id}/turns")
+async def choose(session_id: str, request: TurnRequest):
+    """Plays one turn and returns the resulting state."""
+    await _get_state_or_404(session_id)
+    state = await service.run_turn(session_id, request.choice)
+    return {"session_id": session_id, "state": _state_json(state, request.after)}
+
+
+@app.post("/sessions/{session_id}/turns/stream")
+async def stream_scene(session_id: str, request: TurnRequest):
+    """
+    Plays one turn as Server-Sent Events: `token` events carry narrative text as it is
+    generated (a `reset` event discards the text sent so far), and a final `state` event carries
+    the GameState (with only the segments after `after`, if given).
+    """
+    await _get_state_or_404(session_id)
+
+    async def events():
+        async for kind, payload in service.play_turn(session_id, request.choice):
+            data = _state_json(payload, request.after) if kind == "state" else {"text": payload}
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.websocket("/sessions/{session_id}/ws")
+async def play_over_websocket(websocket: WebSocket, session_id: str):
+    """
+    Bidirectional play: the client sends {"choice": ..., "after": ...} (or {"choice": null} for
+    the opening scene) and receives {"type": "token", "text": ...} messages (and {"type": "reset", "text": ""}
+    to discard them) followed by {"type": "state", "state": ...}.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            request = TurnRequest(**await websocket.receive_json())
+            try:
+                async for kind, payload in service.play_turn(session_id, request.choice):
+                    if kind == "state":
+                        await websocket.send_json({"type": "state", "state": _state_json(payload, request.after)})
+                    else:
+                        await websocket.send_json({"type": kind, "text": payload})
+            except SessionNotFound:
+                await websocket.send_json({"type": "error", "detail": "Unknown or expired session."})
+    except WebSocketDisconnect:
+        pass
@@ -1,246 +1,514 @@
 import os
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple, Union
 from dotenv import load_dotenv
 
-# Langchain/LangGraph specific imports
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
+# Langchain specific imports. LangGraph and the Gemini SDK are slow to import, so they are
+# imported on first use (get_game_agent / get_llm) rather than when this module loads.
+from langchain_core.messages import AIMessage, HumanMessage
 
 # Local imports from our project structure
-from src.state import GameState 
+from src.state import (
+    GameState, GameGraphState, Player, SCENE, OUTCOME, SYSTEM,
+    as_game_state, to_graph_input, validate_update
+)
 from src.prompts import ( 
     SYSTEM_PROMPT,
     SCENE_PROMPT,
     CHOICE_INTERPRETATION_PROMPT,
-    INVALID_CHOICE_PROMPT
+    INVALID_CHOICE_PROMPT,
+    SUMMARY_PROMPT,
+    STRUCTURED_SYSTEM_PROMPT,
+    STRUCTURED_SCENE_PROMPT
+)
+from src.context import StoryContextManager
+from src.speculation import SpeculativeTurnCache
+from src.llm_cache import TieredResponseCache
+from src.choice_interpreter import ChoiceInterpreter, ChoiceMatch
+from src.story import get_story, normalize_choice
+from src.scene_store import get_scene_store, scene_key
+from src.router import LatencyAwareRouter, QUALITY, FAST
+from src.resilience import ResilientLLM, LLMUnavailableError
+from src.scheduler import BACKGROUND, current_request_class
+from src.structured_scene import (
+    GENERATED_HEALTH_MAX, GENERATED_HEALTH_MIN, MAX_GENERATED_CHOICES, NarrativeStreamParser,
+    SceneFormatError, check_effects, offered_choices, parse_scene, salvage_narrative
 )
+from src.telemetry import tracer
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 load_dotenv() # Load environment variables from .env file
 
-# --- Google Gemini API Key ---
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in .env file. Please set it.")
+# "prose": the model writes the scene and choices come from the story file. "structured": one
+# call returns the scene, extra choices and their effects as JSON (see src/structured_scene.py).
+SCENE_OUTPUT = os.getenv("SCENE_OUTPUT", "prose")
+STRUCTURED = "structured"
+
+# Identical prompts (e.g. every new game's opening scene) are answered from a response cache
+# shared across sessions and processes instead of calling Gemini again (see src/llm_cache.py).
+response_cache = TieredResponseCache()
+
+# The chat models and the compiled graph are built on first use and then shared by the whole
+# process, so importing this module stays cheap and doesn't need an API key.
+_game_agent = None
+_build_lock = threading.Lock()
+
+def _build_model(model_name: str, temperature: float, max_tokens: int, json_output: bool = False):
+    """Creates one Gemini chat model for the router. Raises ValueError if no API key is set."""
+    # --- Google Gemini API Key ---
+    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        raise ValueError("GEMINI_API_KEY not found in .env file. Please set it.")
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=model_name, temperature=temperature, max_output_tokens=max_tokens,
+        google_api_key=gemini_api_key, cache=response_cache,
+        response_mime_type="application/json" if json_output else None,
+    )
 
-# Initialize the Gemini Model
-# We'll use a specific model here, e.g., 'gemini-pro' or 'gemini-1.5-flash'
-# 'gemini-1.5-flash' is often a good balance of speed and capability for this kind of application.
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7, google_api_key=GEMINI_API_KEY)
+# Picks the model tier, temperature and output limit for each kind of prompt and shifts traffic
+# to the fast tier when the quality tier runs over its latency or error budget (src/router.py).
+router = LatencyAwareRouter(build_model=_build_model)
 
-# --- LangGraph Agent Definition ---
+def get_llm():
+    """The quality tier's chat model (used for scenes), created on first use. Raises ValueError if no API key is set."""
+    return router.model(QUALITY)
+
+def set_llm(model, fast=None) -> None:
+    """
+    Swaps the chat models used by every node, e.g. for FakeChatModel (src/fake_llm.py) in
+    benchmarks and offline runs. Takes effect for the next LLM call. `model` serves the quality
+    tier and `fast` the fast tier (default: `model` too), so a fake model never reaches the
+    real provider.
+    """
+    router.set_models({QUALITY: model, FAST: fast if fast is not None else model})
+
+# --- LLM Calls ---
 
-# Let's define the nodes of our graph. Each node is a function that takes the current GameState
-# and returns an updated GameState
+# Every request to Gemini goes through these two helpers. The router picks the tier for the prompt
+# kind, and the resilience policy behind them (deadlines, retries, hedging, falling back to the
+# route's next tier; see src/resilience.py) sends it. Each request holds a slot of its tier's
+# concurrency limit (src/runtime.py), whichever node, thread or event loop made it. `kind` names
+# the prompt ("scene" or "structured_scene", "choice_interpretation", "invalid_choice", "summary")
+# for the router, the policy and the metrics and spans recorded by src/telemetry.py.
+# When no tier answers in time they raise LLMUnavailableError.
 
-def describe_scene(state: GameState) -> GameState:
+def _reset_stream(call) -> None:
+    # An attempt that streamed lost (see ResilientLLM): tell stream_game_turn to drop what it sent
+    from langgraph.config import get_stream_writer
+    try:
+        get_stream_writer()(STREAM_RESET)
+    except RuntimeError:
+        pass # Not inside a graph run (e.g. a background summary), so nothing was streamed
+
+resilient_llm = ResilientLLM(observer=router.record, on_stream_reset=_reset_stream)
+
+def invoke_llm(messages: list, kind: str) -> AIMessage:
+    with tracer.llm_call(kind, messages) as call:
+        decision = router.route(kind)
+        call.response = resilient_llm.invoke(messages, call, decision.primary, decision.fallback)
+    return call.response
+
+async def ainvoke_llm(messages: list, kind: str) -> AIMessage:
+    with tracer.llm_call(kind, messages) as call:
+        decision = router.route(kind)
+        call.response = await resilient_llm.ainvoke(messages, call, decision.primary, decision.fallback)
+    return call.response
+
+# Served when no model answered in time, so the adventure goes on instead of ending in an error
+CANNED_SCENE = (
+    "You pause to take in your surroundings at {location_name} and gather your thoughts. "
+    "The way forward is still open. What will you do?"
+)
+CANNED_INVALID_CHOICE = "That isn't one of the paths open to you right now. Please choose one of the available options."
+
+def canned_response(kind: str, text: str) -> str:
     """
-    Generates the narrative description for the current scene based on the GameState.
+    Counts a canned stand-in for an LLM answer (llm_fallbacks_total{target="canned"}) and returns it.
+    Background work (e.g. a speculative turn) gets LLMUnavailableError instead, since nobody is
+    waiting and a canned turn shouldn't be kept for later.
     """
-    print(f"--- Node: describe_scene ({state.player.current_location_id}) ---")
+    if current_request_class(kind).priority == BACKGROUND:
+        raise LLMUnavailableError(f"No usable {kind} response for a background request; not serving a canned one.")
+    logger.warning("Serving a canned %s response: no model answered in time", kind)
+    tracer.metrics.inc("llm_fallbacks_total", (kind, "canned"))
+    return text
+
+# --- Story Context ---
+
+SUMMARY_MAX_WORDS = 150 # Keeps the rolling summary (and so the scene prompt) small
+
+def summarize_story(previous_summary: str, new_events: list) -> str:
+    """
+    Folds scenes that dropped out of the verbatim context window into the rolling summary.
+    Runs on the context manager's background threads, never on the turn's critical path.
+    """
+    prompt = SUMMARY_PROMPT.format(
+        previous_summary=previous_summary or "(nothing yet)",
+        new_events="\n\n".join(new_events),
+        max_words=SUMMARY_MAX_WORDS
+    )
+    return invoke_llm([HumanMessage(content=prompt)], "summary").content
+
+# Shared by every session in this process; it only holds background summary jobs, not game state.
+story_context = StoryContextManager(summarizer=summarize_story)
+
+# --- Choice Interpretation ---
+
+def _choice_interpretation_messages(available_choices: list, user_input: str) -> list:
+    prompt = CHOICE_INTERPRETATION_PROMPT.format(
+        available_choices=available_choices,
+        user_input=user_input
+    )
+    return [HumanMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)]
+
+def interpret_choice_with_llm(available_choices: list, user_input: str) -> str:
+    """Last-resort interpreter tier: asks Gemini which choice (if any) the player meant."""
+    return invoke_llm(_choice_interpretation_messages(available_choices, user_input), "choice_interpretation").content
+
+async def ainterpret_choice_with_llm(available_choices: list, user_input: str) -> str:
+    return (await ainvoke_llm(_choice_interpretation_messages(available_choices, user_input), "choice_interpretation")).content
+
+# Resolves near-miss input locally and only falls back to the LLM when unsure (see src/choice_interpreter.py)
+choice_interpreter = ChoiceInterpreter(llm_resolver=interpret_choice_with_llm, allm_resolver=ainterpret_choice_with_llm)
+
+# --- LangGraph Agent Definition ---
+
+# Let's define the nodes of our graph. Each node receives the graph state (a GameGraphState dict)
+# and returns only the fields it changed; LangGraph merges those updates with the reducers declared
+# in src/state.py (segments are appended, plot flags merged). Nodes never modify what they were
+# given, and the full GameState is only rebuilt once, when the turn returns.
+# The two nodes that talk to Gemini come in a sync and an async flavour sharing the same
+# prompt-building and update-building helpers; the graph picks one depending on whether it
+# is run with invoke/stream or ainvoke/astream.
+
+def _scene_messages(state: GameState) -> list:
+    # Only a bounded tail of the story (plus a rolling summary) goes into the prompt,
+    # so its size stays flat no matter how long the adventure runs.
+    story_context.apply_ready_summary(state)
 
     # Construct the prompt for Gemini to describe the scene
-    prompt = SCENE_PROMPT.format(
+    fields = dict(
         location_name=state.player.current_location_name,
-        current_story_text=state.current_story_text, # Pass previous text for context if needed
+        current_story_text=story_context.build_context(state),
         player_inventory=", ".join(state.player.inventory) if state.player.inventory else "nothing",
         player_health=state.player.health
     )
+    if SCENE_OUTPUT != STRUCTURED:
+        return [HumanMessage(content=SYSTEM_PROMPT), HumanMessage(content=SCENE_PROMPT.format(**fields))]
+    prompt = STRUCTURED_SCENE_PROMPT.format(
+        **fields,
+        fixed_choices=", ".join(get_story().authored_choices(state.player.current_location_id)) or "none",
+        max_choices=MAX_GENERATED_CHOICES,
+        health_min=GENERATED_HEALTH_MIN,
+        health_max=GENERATED_HEALTH_MAX,
+    )
+    return [HumanMessage(content=STRUCTURED_SYSTEM_PROMPT), HumanMessage(content=prompt)]
+
+def _scene_kind() -> str:
+    # Structured scenes are routed (and measured) as their own prompt kind
+    return "structured_scene" if SCENE_OUTPUT == STRUCTURED else "scene"
+
+def _pregenerated_scene(state: GameState) -> Optional[str]:
+    # Scenes generated ahead of time by `python -m src.pregenerate` (see src/scene_store.py)
+    store = get_scene_store()
+    if not len(store):
+        return None
+    player = state.player
+    narrative = store.pick(scene_key(player.current_location_id, player.health, player.inventory, state.plot_flags), get_story().digest)
+    tracer.metrics.inc("pregenerated_scene_lookups_total", ("hit" if narrative is not None else "miss",))
+    return narrative
+
+def _summary_update(state: GameState) -> Dict[str, Any]:
+    # apply_ready_summary may have moved a finished summary into the (throwaway) view
+    return {"story_summary": state.story_summary, "summarized_scene_count": state.summarized_scene_count}
+
+def _scene_update(state: GameState, narrative_description: str, choices: Optional[list] = None, generated: Optional[dict] = None) -> Dict[str, Any]:
+    # The new scene is appended to the transcript by the segment reducer, so a turn costs
+    # the same no matter how long the story already is.
+    segments = state.new_segments((SCENE, narrative_description))
+
+    # Choices come from the compiled story definition (data/story.json), one dict lookup per scene,
+    # unless a structured scene added its own
+    if choices is None:
+        choices = list(get_story().choices(state.player.current_location_id))
+
+    # Build the matcher index now, while the player is reading, rather than on their click
+    choice_interpreter.prepare(choices)
+
+    # Fold scenes that just left the verbatim window into the summary, in the background
+    story_context.schedule_summary(state, scene_count=state.scene_count + 1)
+    update = {
+        **_summary_update(state),
+        "segments": segments,
+        "available_choices": choices, # Pass the choices to the frontend
+        "user_input": "",
+    }
+    if generated or state.generated_choices:
+        update["generated_choices"] = generated or {} # The last scene's made-up choices are no longer on offer
+    return validate_update(update)
+
+def _llm_scene_update(state: GameState, text: str) -> Dict[str, Any]:
+    """The update for a scene the model wrote: prose as it is, or a structured scene's narrative and choices."""
+    if SCENE_OUTPUT != STRUCTURED:
+        return _scene_update(state, text)
+    try:
+        scene = parse_scene(text)
+    except SceneFormatError as e:
+        # Keep whatever narrative made it (e.g. the response was cut off) with the story's own choices
+        narrative = salvage_narrative(text)
+        logger.warning("Structured scene unusable (%s); %s", e, "keeping its narrative" if narrative else "serving a canned scene")
+        tracer.metrics.inc("structured_scenes_total", ("salvaged" if narrative else "failed",))
+        return _scene_update(state, narrative or _canned_scene(state))
+    tracer.metrics.inc("structured_scenes_total", ("parsed",))
+    choices, generated = offered_choices(get_story(), state.player.current_location_id, scene)
+    return _scene_update(state, scene.narrative, choices, generated)
+
+def _canned_scene(state: GameState) -> str:
+    location_name = state.player.current_location_name or "this place"
+    return canned_response("scene", CANNED_SCENE.format(location_name=location_name))
+
+def _scene_error_update(state: GameState, e: Exception) -> Dict[str, Any]:
+    logger.error("Error in describe_scene: %s", e)
+    return validate_update({
+        **_summary_update(state),
+        "segments": state.new_segments((SYSTEM, "An error occurred while generating the scene: " + str(e))),
+        "available_choices": ["Restart"],
+        "user_input": "",
+    })
+
+def describe_scene(values: GameGraphState) -> Dict[str, Any]:
+    """
+    Generates the narrative description for the current scene based on the GameState.
+    """
+    state = as_game_state(values)
+    logger.debug("Node: describe_scene (%s)", state.player.current_location_id)
+    # A pre-generated scene for this state, if there is one, saves the LLM round-trip entirely
+    narrative = _pregenerated_scene(state)
+    if narrative is not None:
+        return _scene_update(state, narrative)
+    messages = _scene_messages(state)
 
     # Use Gemini to generate the scene description
     try:
-        response_content = llm.invoke([
-            HumanMessage(content=SYSTEM_PROMPT),
-            HumanMessage(content=prompt)
-        ]).content
-
-        # The response should ideally include choices structured in a specific way,
-        # but for now, let's assume it's just raw text that we'll parse later or
-        # generate choices separately.
-        # For a true "Choose Your Own Adventure", the choices are often fixed per scene.
-        # We'll adjust this to explicitly generate choices.
-        # For simplicity in this first pass, let's have Gemini describe the scene,
-        # and then a separate function will generate/handle choices.
-
-        # For now, let's assume the narrative is just the direct response.
-        # We will refine this to extract choices dynamically or load them from data.
-        narrative_description = response_content
-
-        # Update the state with the new story text.
-        # We append to ensure a history, or overwrite if we only want the current scene.
-        # Let's append for now to build a story history.
-        new_story_text = state.current_story_text + "\n\n" + narrative_description
-
-        # IMPORTANT: For this first iteration, we'll need to manually define choices
-        # or load them from a data structure associated with `current_location_id`.
-        # Gemini is good for narrative, but for explicit CYOA choices, we often need structure.
-        # Let's mock some choices based on location for now.
-        if state.player.current_location_id == "start_forest":
-            choices = ["Go deeper into the forest", "Look for a path to the village", "Examine the strange glowing mushroom"]
-        elif state.player.current_location_id == "deep_forest":
-             choices = ["Follow the sound of running water", "Try to climb a tall tree", "Rest and recover health"]
-        else: # Default choices for unhandled locations
-            choices = ["Continue forward", "Turn back"]
-
-        return GameState(
-            player=state.player,
-            current_story_text=new_story_text,
-            available_choices=choices # Pass the choices to the frontend
-        )
+        return _llm_scene_update(state, invoke_llm(messages, _scene_kind()).content)
+    except LLMUnavailableError:
+        return _scene_update(state, _canned_scene(state))
+    except Exception as e:
+        return _scene_error_update(state, e)
 
+async def adescribe_scene(values: GameGraphState) -> Dict[str, Any]:
+    """
+    Async version of `describe_scene`; awaits Gemini instead of blocking a thread on it.
+    """
+    state = as_game_state(values)
+    logger.debug("Node: describe_scene/async (%s)", state.player.current_location_id)
+    narrative = _pregenerated_scene(state)
+    if narrative is not None:
+        return _scene_update(state, narrative)
+    messages = _scene_messages(state)
+    try:
+        return _llm_scene_update(state, (await ainvoke_llm(messages, _scene_kind())).content)
+    except LLMUnavailableError:
+        return _scene_update(state, _canned_scene(state))
     except Exception as e:
-        print(f"Error in describe_scene: {e}")
-        return GameState(
-            player=state.player,
-            current_story_text=state.current_story_text + "\n\nAn error occurred while generating the scene: " + str(e),
-            available_choices=["Restart"]
-        )
+        return _scene_error_update(state, e)
+
+
+HEALTH_DECREASE_PER_TURN = 10 # You can adjust this value
+
+def _start_choice(state: GameState) -> Tuple[Player, str]:
+    """
+    Applies the per-turn health drain to a copy of the player (the graph's own Player is never
+    modified). Returns that copy and the opening outcome text.
+    """
+    logger.debug("Node: handle_user_choice, user chose %r with health %d", state.user_input, state.player.health)
+
+    player = state.player.model_copy()
+    player.health -= HEALTH_DECREASE_PER_TURN
+    return player, f"\n\n_Your journey drains your energy. (-{HEALTH_DECREASE_PER_TURN} health. Current health: {player.health})_"
+
+def _apply_choice(player: Player, choice: str, response_text: str, generated: Optional[dict] = None) -> Tuple[str, str, Dict[str, bool]]:
+    """
+    Applies the story transition for a resolved choice to `player`; for a choice a structured
+    scene made up (`generated`), its proposed transition once checked against the game rules.
+    Returns (response_text, next_location_id, plot flags set by the transition).
+    """
+    next_location_id = player.current_location_id # Default to current, or an error state
+    flags: Dict[str, bool] = {}
+    # (location, choice) -> transition is a single lookup in the compiled story (see src/story.py)
+    story = get_story()
+    transition = story.transition(player.current_location_id, choice)
+    if transition is None and generated:
+        transition = generated.get(normalize_choice(choice))
+        if transition is not None:
+            transition = check_effects(transition, player.health, player.inventory, story)
+    if transition is not None:
+        response_text = "\n" + transition.text
+        if transition.next_location is not None:
+            next_location_id = transition.next_location
+        player.health += transition.health
+        flags = dict(transition.flags)
+        player.inventory = [item for item in player.inventory if item not in transition.remove_items]
+        player.inventory += [item for item in transition.add_items if item not in player.inventory]
+    return response_text, next_location_id, flags
+
+def _invalid_choice_messages(state: GameState) -> list:
+    # User entered an invalid choice, or free-form text
+    # Use Gemini to generate a response explaining the invalid choice
+    logger.debug("Invalid choice detected. Using Gemini for response.")
+    prompt = INVALID_CHOICE_PROMPT.format(
+        user_input=state.user_input,
+        available_choices=", ".join(state.available_choices)
+    )
+    return [HumanMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)]
+
+def _interpreted_invalid_choice(match: ChoiceMatch) -> str:
+    # The interpretation call already answered for input that matches no choice (its nudge, or the
+    # canned one if it gave none or failed), so a turn never makes a second LLM call for it
+    return "\n" + (match.reply or CANNED_INVALID_CHOICE)
+
+def _finish_choice(state: GameState, player: Player, response_text: str, next_location_id: str, flags: Dict[str, bool]) -> Dict[str, Any]:
+    # --- The health cap and game over check also come only once, at the end of the turn ---
+    if player.health < 0:
+        player.health = 0
+    # Update the player's location ID based on the choice logic
+    player.current_location_id = next_location_id
+    # Append the choice outcome; it belongs to the scene the player just reacted to
+    entries = [(OUTCOME, response_text)]
+
+    update: Dict[str, Any] = {
+        "player": player,
+        "plot_flags": flags, # Merged into the existing flags by the reducer
+        # Clear previous choices as new ones will be generated by describe_scene
+        "available_choices": [],
+        "user_input": "", # Clear user input after processing
+    }
+    if player.health <= 0:
+        update["game_over"] = True
+        entries.append((SYSTEM, "**Your health has dropped to zero! The adventure ends here.**"))
+        logger.info("Game over: health dropped to zero")
 
+    update["segments"] = state.new_segments(*entries)
+    return validate_update(update)
 
-def handle_user_choice(state: GameState) -> GameState:
+def handle_user_choice(values: GameGraphState) -> Dict[str, Any]:
     """
     Processes the user's choice and determines the next location or story branch.
     This node primarily sets up the next_location_id based on the choice.
     """
-    print(f"\n===== HANDLE_USER_CHOICE NODE START =====")
-    print(f"HANDLE_USER_CHOICE: User chose: '{state.user_input}'")
-    print(f"HANDLE_USER_CHOICE: Current health BEFORE turn processing: {state.player.health}") # for debugging
-
-
-    user_choice = state.user_input.strip().lower()
-    next_location_id = state.player.current_location_id # Default to current, or an error state
-
-    # This is a critical point for decision logic.
-    # For a real game, you'd have a mapping from current_location_id + choice -> next_location_id
-    # You could load this from a JSON file (e.g., in data/story_config.json)
-    # For now, let's use simple if/elif for our example locations.
-
-    response_text = ""
-    is_valid_choice = False
-
-    HEALTH_DECREASE_PER_TURN = 10 # You can adjust this value
-    state.player.health -= HEALTH_DECREASE_PER_TURN
-    response_text += f"\n\n_Your journey drains your energy. (-{HEALTH_DECREASE_PER_TURN} health. Current health: {state.player.health})_"
-    
-    # Check if the user's choice is one of the available choices
-    if user_choice in [c.lower() for c in state.available_choices]:
-        is_valid_choice = True
-        if state.player.current_location_id == "start_forest":
-            if "go deeper into the forest" in user_choice:
-                next_location_id = "deep_forest"
-                response_text = "\nYou venture deeper into the tangled woods."
-            elif "look for a path to the village" in user_choice:
-                next_location_id = "village_outskirts"
-                response_text = "\nYou search for a path and soon find a faint trail."
-            elif "examine the strange glowing mushroom" in user_choice:
-                response_text = "\nYou cautiously approach the mushroom. It pulses with a soft, ethereal light. Touching it gives you a strange tingling sensation, and you feel slightly more robust (+5 health)."
-                state.player.health += 5 # Example of state change based on choice
-                # Stay in the same location for a minor interaction
-                next_location_id = "start_forest"
-        elif state.player.current_location_id == "deep_forest":
-            if "follow the sound of running water" in user_choice:
-                next_location_id = "forest_stream"
-                response_text = "\nYou follow the gentle gurgle of a hidden stream."
-            elif "try to climb a tall tree" in user_choice:
-                response_text = "\nAfter a strenuous climb, you reach the canopy. You see vast stretches of forest, but no clear path. You spot a distant ruined tower."
-                next_location_id = "deep_forest" # Stay, but maybe add a 'tower_seen' flag
-                state.plot_flags["tower_seen"] = True
-            elif "rest and recover health" in user_choice:
-                response_text = "\nYou find a hidden clearing and rest for a while, regaining some strength. (+10 health)"
-                state.player.health += 10
-                next_location_id = "deep_forest" # Stay
-        # ... add more location-specific logic here
-
-        else: # For locations not yet explicitly handled for choices
-            response_text = "\nYou proceed, but the path ahead is still uncertain."
-            next_location_id = "unknown_path" # A placeholder for generic progression
+    state = as_game_state(values)
+    player, response_text = _start_choice(state)
+    next_location_id = player.current_location_id # Stay in current location unless the choice moves us
+    flags: Dict[str, bool] = {}
+
+    # Resolve the input to one of the available choices: exact match, then local fuzzy/embedding
+    # matching, and only if those aren't confident, an LLM call with CHOICE_INTERPRETATION_PROMPT.
+    match = choice_interpreter.interpret(state.user_input, state.available_choices)
+    if match.choice is not None:
+        response_text, next_location_id, flags = _apply_choice(player, match.choice, response_text, state.generated_choices)
+    elif match.tier == "llm":
+        response_text = _interpreted_invalid_choice(match)
     else:
-        # User entered an invalid choice, or free-form text
-        # Use Gemini to generate a response explaining the invalid choice
-        print("Invalid choice detected. Using Gemini for response.")
-        prompt = INVALID_CHOICE_PROMPT.format(
-            user_input=state.user_input,
-            available_choices=", ".join(state.available_choices)
-        )
         try:
-            gemini_response = llm.invoke([
-                HumanMessage(content=SYSTEM_PROMPT),
-                HumanMessage(content=prompt)
-            ]).content
-            response_text = "\n" + gemini_response
-            next_location_id = state.player.current_location_id # Stay in current location
+            response_text = "\n" + invoke_llm(_invalid_choice_messages(state), "invalid_choice").content
+        except LLMUnavailableError:
+            response_text = "\n" + canned_response("invalid_choice", CANNED_INVALID_CHOICE)
         except Exception as e:
             response_text = f"\nInvalid choice. Please choose from the available options. Error: {e}"
-            next_location_id = state.player.current_location_id # Stay in current location
-
-    # --- The health cap and game over check also come only once, at the end of the function ---
-    if state.player.health < 0:
-        state.player.health = 0
-    if state.player.health <= 0:
-        state.game_over = True
-        response_text += "\n\n**Your health has dropped to zero! The adventure ends here.**"
-        state.available_choices = ["Restart Game"]
-        print("HANDLE_USER_CHOICE: Game Over triggered!")
-
-        
-    # Update the player's location ID based on the choice logic
-    state.player.current_location_id = next_location_id
-    state.current_story_text += response_text # Append choice outcome
 
-    # Clear previous choices as new ones will be generated by describe_scene
-    state.available_choices = []
-    state.user_input = "" # Clear user input after processing
+    return _finish_choice(state, player, response_text, next_location_id, flags)
 
-    return state
+async def ahandle_user_choice(values: GameGraphState) -> Dict[str, Any]:
+    """
+    Async version of `handle_user_choice`; any LLM round-trip (interpretation or the
+    invalid-choice nudge) is awaited instead of blocking a thread.
+    """
+    state = as_game_state(values)
+    player, response_text = _start_choice(state)
+    next_location_id = player.current_location_id
+    flags: Dict[str, bool] = {}
+
+    match = await choice_interpreter.ainterpret(state.user_input, state.available_choices)
+    if match.choice is not None:
+        response_text, next_location_id, flags = _apply_choice(player, match.choice, response_text, state.generated_choices)
+    elif match.tier == "llm":
+        response_text = _interpreted_invalid_choice(match)
+    else:
+        try:
+            response_text = "\n" + (await ainvoke_llm(_invalid_choice_messages(state), "invalid_choice")).content
+        except LLMUnavailableError:
+            response_text = "\n" + canned_response("invalid_choice", CANNED_INVALID_CHOICE)
+        except Exception as e:
+            response_text = f"\nInvalid choice. Please choose from the available options. Error: {e}"
 
+    return _finish_choice(state, player, response_text, next_location_id, flags)
 
-def update_location_name(state: GameState) -> GameState:
+
+def update_location_name(values: GameGraphState) -> Dict[str, Any]:
     """
-    Updates the human-readable location name based on the current_location_id.
-    This could be expanded to load from a data file.
+    Updates the human-readable location name based on the current_location_id,
+    as defined in the story file.
     """
-    print(f"--- Node: update_location_name ({state.player.current_location_id}) ---")
-    location_names = {
-        "start_forest": "Mysterious Whispering Forest",
-        "deep_forest": "Dense Tangled Woods",
-        "village_outskirts": "Dusty Village Outskirts",
-        "forest_stream": "Glistening Forest Stream",
-        "unknown_path": "An Uncharted Path",
-    }
-    state.player.current_location_name = location_names.get(state.player.current_location_id, "An Unknown Place")
-    return state
+    player = values["player"]
+    logger.debug("Node: update_location_name (%s)", player.current_location_id)
+    name = get_story().location_name(player.current_location_id)
+    if name == player.current_location_name:
+        return {} # Unchanged (e.g. an invalid choice kept the player in place)
+    return validate_update({"player": player.model_copy(update={"current_location_name": name})})
 
 
 # --- NEW: Game Start Node ---
-def game_start_node(state: GameState) -> GameState:
+def game_start_node(values: GameGraphState) -> Dict[str, Any]:
     """
     The actual entry point node for the graph.
     It simply passes the state along, allowing the router to then decide the flow.
     """
-    print(f"\n===== GAME_START_NODE EXECUTION =====")
-    print(f"GAME_START_NODE: Initial state received by entry point.")
-    return state # No state modification needed here, just a pass-through
+    logger.debug("Node: game_start_node")
+    return {} # No state modification needed here, just a pass-through
 
-def route_game_step(state: GameState) -> str:
+def route_game_step(values: GameGraphState) -> str:
     """
     Routes the graph based on whether user input needs processing
     or a new scene needs to be described.
     """
+    user_input = values["user_input"]
     # We use "__INITIAL_RUN__" as a specific marker for the very first scene generation.
-    if state.user_input and state.user_input != "__INITIAL_RUN__":
+    if user_input and user_input != "__INITIAL_RUN__":
         return "process_choice"
     else:
         return "describe_scene_step"
 
 # --- Define the LangGraph StateGraph ---
 def create_game_agent():
-    workflow = StateGraph(GameState)
-
-    # Add all your node functions to the workflow
-    workflow.add_node("game_start_node", game_start_node)
-    workflow.add_node("update_location_name", update_location_name)
-    workflow.add_node("describe_scene", describe_scene)
-    workflow.add_node("handle_user_choice", handle_user_choice)
+    from langchain_core.runnables import RunnableLambda
+    from langgraph.graph import StateGraph, END
+
+    # Load and validate the story definition up front, so a broken story file fails before the first turn
+    get_story()
+
+    # Nodes exchange partial updates over plain-dict channels (see GameGraphState)
+    workflow = StateGraph(GameGraphState)
+
+    # Add all your node functions to the workflow.
+    # Each one is wrapped by the tracer, which times it and splits its time into LLM and local work.
+    workflow.add_node("game_start_node", tracer.trace_node("game_start_node", game_start_node))
+    workflow.add_node("update_location_name", tracer.trace_node("update_location_name", update_location_name))
+    # LLM-bound nodes carry both implementations: invoke/stream run the sync one,
+    # ainvoke/astream the async one
+    workflow.add_node("describe_scene", RunnableLambda(
+        tracer.trace_node("describe_scene", describe_scene),
+        afunc=tracer.trace_node("describe_scene", adescribe_scene),
+    ))
+    workflow.add_node("handle_user_choice", RunnableLambda(
+        tracer.trace_node("handle_user_choice", handle_user_choice),
+        afunc=tracer.trace_node("handle_user_choice", ahandle_user_choice),
+    ))
 
     # 1. Set the ACTUAL entry point to the 'game_start_node'
     workflow.set_entry_point("game_start_node")
@@ -271,5 +539,126 @@ def create_game_agent():
 
     return workflow.compile()
 
-# Instantiate the agent globally (at the bottom of src/agent.py)
-game_agent = create_game_agent()
\ No newline at end of file
+def get_game_agent():
+    """The process-wide compiled graph, built on first use."""
+    global _game_agent
+    if _game_agent is None:
+        with _build_lock:
+            if _game_agent is None:
+                _game_agent = create_game_agent()
+    return _game_agent
+
+def __getattr__(name: str) -> Any:
+    # `src.agent.llm` and `src.agent.game_agent` keep working for existing callers, built lazily
+    if name == "llm":
+        return get_llm()
+    if name == "game_agent":
+        return get_game_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def run_game_turn(state: GameState, config: Optional[dict] = None) -> GameState:
+    """
+    Runs one graph step and returns the result as a new GameState; `state` itself is left as it was.
+    The graph works on plain-dict channels, so this is the only place the turn builds a GameState.
+    """
+    with tracer.turn():
+        result = get_game_agent().invoke(to_graph_input(state), config=config or {"recursion_limit": 50})
+    return as_game_state(result)
+
+async def arun_game_turn(state: GameState, config: Optional[dict] = None) -> GameState:
+    """Async version of `run_game_turn`, for servers running on an event loop."""
+    with tracer.turn():
+        result = await get_game_agent().ainvoke(to_graph_input(state), config=config or {"recursion_limit": 50})
+    return as_game_state(result)
+
+# Background pre-generation of the next turn for every available choice (see src/speculation.py)
+speculative_turns = SpeculativeTurnCache(run_turn=run_game_turn)
+
+
+# --- Streaming ---
+
+# Only tokens produced inside this node are narrative; others (e.g. invalid-choice nudges) are not streamed.
+STREAMED_NODE = "describe_scene"
+STREAM_RESET = "stream_reset" # Written to the graph's custom stream by _reset_stream
+
+def _narrative_filter():
+    """Maps the scene's streamed chunks to narrative text: prose as it is, structured scenes decoded out of the partial JSON."""
+    if SCENE_OUTPUT != STRUCTURED:
+        return lambda text: text
+    return NarrativeStreamParser().feed
+
+class _NarrativeStream:
+    """Turns the graph's "messages" and "custom" chunks into ("token", text) and ("reset", "") events."""
+
+    def __init__(self):
+        self._narrative = _narrative_filter()
+        self._runs = set() # Ids of the messages streamed since the last reset
+        self._dropped = set() # ...and of the ones before it, which abandoned attempts may still be streaming
+        self._sent = False
+
+    def message(self, message, metadata) -> Optional[Tuple[str, str]]:
+        if metadata.get("langgraph_node") != STREAMED_NODE or not isinstance(message.content, str) or not message.content:
+            return None
+        if message.id is not None:
+            if message.id in self._dropped:
+                return None
+            self._runs.add(message.id)
+        text = self._narrative(message.content)
+        if not text:
+            return None
+        self._sent = True
+        return "token", text
+
+    def custom(self, chunk) -> Optional[Tuple[str, str]]:
+        if chunk != STREAM_RESET:
+            return None
+        self._dropped |= self._runs
+        self._runs = set()
+        self._narrative = _narrative_filter()
+        if not self._sent:
+            return None # Nothing to take back (e.g. an interpretation retried before the scene)
+        self._sent = False
+        return "reset", ""
+
+def stream_game_turn(state: GameState, config: Optional[dict] = None) -> Iterator[Tuple[str, Union[str, GameState]]]:
+    """
+    Runs one graph step like `game_agent.invoke`, but yields the scene narrative as it is generated.
+
+    Yields ("token", text) for every narrative chunk, then exactly one ("state", GameState) once the
+    graph has finished. Choices and the rest of the state are only final in that last event. A
+    ("reset", "") event means the request that streamed the tokens so far lost to a retry, hedge
+    or fallback: the consumer discards them, and the narrative starts over (or arrives with the state).
+    """
+    final_values = None
+    narrative = _NarrativeStream()
+    with tracer.turn(streamed=True):
+        for mode, chunk in get_game_agent().stream(to_graph_input(state), config=config, stream_mode=["messages", "custom", "values"]):
+            if mode == "values":
+                final_values = chunk
+                continue
+            event = narrative.message(*chunk) if mode == "messages" else narrative.custom(chunk)
+            if event is not None:
+                yield event
+
+    if final_values is None:
+        raise RuntimeError("The game graph finished without producing a state.")
+    yield "state", as_game_state(final_values)
+
+
+async def astream_game_turn(state: GameState, config: Optional[dict] = None) -> AsyncIterator[Tuple[str, Union[str, GameState]]]:
+    """Async version of `stream_game_turn` (same events), driving the graph with `astream`."""
+    final_values = None
+    narrative = _NarrativeStream()
+    with tracer.turn(streamed=True):
+        async for mode, chunk in get_game_agent().astream(to_graph_input(state), config=config, stream_mode=["messages", "custom", "values"]):
+            if mode == "values":
+                final_values = chunk
+                continue
+            event = narrative.message(*chunk) if mode == "messages" else narrative.custom(chunk)
+            if event is not None:
+                yield event
+
+    if final_values is None:
+        raise RuntimeError("The game graph finished without producing a state.")
+    yield "state", as_game_state(final_values)
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.state import GameState, StorySegment
+from src.session_store import SessionStore, SESSION_IDLE_SECONDS, SESSION_SWEEP_SECONDS
+from src.session_memory import SessionMemory, SESSION_MEMORY_BUDGET_BYTES, SESSION_SPILL_AFTER_SECONDS
+
+# --- Configuration ---
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", ".cache/checkpoints.sqlite")
+# Every Nth turn stores the full (non-transcript) state instead of a delta, bounding how many
+# deltas a rewind has to replay.
+CHECKPOINT_SNAPSHOT_EVERY = int(os.getenv("CHECKPOINT_SNAPSHOT_EVERY", "10"))
+# How many turns back a session can be rewound; older checkpoints are compacted into one.
+CHECKPOINT_REWIND_TURNS = int(os.getenv("CHECKPOINT_REWIND_TURNS", "50"))
+# Total size of stored checkpoints; the least recently played sessions are dropped beyond it.
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+# Recently used sessions kept in memory (compact, see src/session_memory.py), so a worker's own
+# sessions don't hit the database. Bounded by count and by SESSION_MEMORY_BUDGET_BYTES.
+CHECKPOINT_CACHED_SESSIONS = int(os.getenv("CHECKPOINT_CACHED_SESSIONS", "1000"))
+
+
+# --- Deltas ---
+# A checkpoint holds the state's small fields (everything but the transcript) either in full
+# (snapshot) or as the fields that changed since the previous turn, plus the transcript segments
+# appended during the turn. Player fields are diffed one level down, so a turn that only drains
+# health stores {"player": {"health": 40}}.
+
+def scalar_fields(state: GameState) -> Dict[str, Any]:
+    """Everything but the transcript, as JSON-compatible data."""
+    return state.model_dump(mode="json", exclude={"segments"})
+
+def diff_fields(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    delta = {key: value for key, value in new.items() if old.get(key) != value and key != "player"}
+    player = {key: value for key, value in new["player"].items() if old.get("player", {}).get(key) != value}
+    if player:
+        delta["player"] = player
+    return delta
+
+def apply_fields(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in delta.items():
+        if key == "player":
+            merged["player"] = {**merged.get("player", {}), **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+class CheckpointSessionStore(SessionStore):
+    """
+    Durable session store that keeps every turn of a session as a compact checkpoint in SQLite,
+    so a session can be resumed on any worker after a crash and rewound to an earlier turn.
+
+    Each `put` appends one checkpoint: the changed fields plus the new transcript segments (a
+    full snapshot of the small fields every `snapshot_every` turns). Rewinding from the current
+    state replays at most `snapshot_every` small deltas and slices the transcript, instead of
+    rebuilding the whole session. Checkpoints older than `rewind_turns` are compacted into a
+    single base checkpoint, and total disk use is capped at `max_bytes`. Sessions this worker
+    played recently stay in memory within `memory_budget`; idle ones are simply dropped from it,
+    since everything is on disk already.
+    """
+
+    supports_rewind = True
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        snapshot_every: int = CHECKPOINT_SNAPSHOT_EVERY,
+        rewind_turns: int = CHECKPOINT_REWIND_TURNS,
+        max_bytes: int = CHECKPOINT_MAX_BYTES,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        cached_sessions: int = CHECKPOINT_CACHED_SESSIONS,
+        memory_budget: int = SESSION_MEMORY_BUDGET_BYTES,
+        spill_after: float = SESSION_SPILL_AFTER_SECONDS,
+    ):
+        self.snapshot_every = max(1, snapshot_every)
+        self.rewind_turns = max(1, rewind_turns)
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.cached_sessions = cached_sessions
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Sessions this worker played recently, each with the turn it holds
+        self._memory = SessionMemory(budget_bytes=memory_budget, max_sessions=cached_sessions, spill_after=spill_after)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL") # Any worker on the host can resume any session
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " session_id TEXT NOT NULL, turn INTEGER NOT NULL, snapshot INTEGER NOT NULL,"
+            " fields TEXT NOT NULL, segments TEXT NOT NULL, first_segment INTEGER NOT NULL,"
+            " segment_count INTEGER NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (session_id, turn))"
+        )
+        # The newest turn of each session, with its fields, so a delta can be computed without loading the session.
+        # `version` goes up with every put and rewind: a rewind reuses turn numbers, so a turn number alone
+        # doesn't tell whether a cached state is still the session's current branch.
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS heads ("
+            " session_id TEXT PRIMARY KEY, turn INTEGER NOT NULL, fields TEXT NOT NULL,"
+            " segment_count INTEGER NOT NULL, updated_at REAL NOT NULL, version INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "version" not in {row[1] for row in self._db.execute("PRAGMA table_info(heads)")}:
+            self._db.execute("ALTER TABLE heads ADD COLUMN version INTEGER NOT NULL DEFAULT 0") # Databases from before versions
+        self._db.execute("CREATE INDEX IF NOT EXISTS heads_updated ON heads (updated_at)")
+        self._last_sweep = 0.0
+        self.stats: Dict[str, int] = {"snapshots": 0, "deltas": 0, "rewinds": 0, "compactions": 0, "evictions": 0, "loads": 0}
+
+    # --- Helpers (all must be called with the lock held) ---
+
+    def _head(self, session_id: str) -> Optional[tuple]:
+        return self._db.execute(
+            "SELECT turn, fields, segment_count, updated_at, version FROM heads WHERE session_id = ?", (session_id,)
+        ).fetchone()
+
+    def _remember(self, session_id: str, version: int, state: GameState) -> None:
+        self._memory.put(session_id, state, meta=version)
+
+    def _cached(self, session_id: str, version: int) -> Optional[GameState]:
+        """The in-memory state of a session if it is still at head `version` (no other worker wrote or rewound it since)."""
+        return self._memory.get(session_id) if self._memory.meta(session_id) == version else None
+
+    def _fields_at(self, session_id: str, turn: int) -> Tuple[Dict[str, Any], int]:
+        """The small fields and transcript length at `turn`: its latest snapshot plus the deltas after it."""
+        rows = self._db.execute(
+            "SELECT snapshot, fields, segment_count FROM checkpoints WHERE session_id = ? AND turn <= ?"
+            " AND turn >= (SELECT MAX(turn) FROM checkpoints WHERE session_id = ? AND turn <= ? AND snapshot = 1)"
+            " ORDER BY turn",
+            (session_id, turn, session_id, turn),
+        ).fetchall()
+        fields: Dict[str, Any] = {}
+        segment_count = 0
+        for snapshot, payload, count in rows:
+            fields = json.loads(payload) if snapshot else apply_fields(fields, json.loads(payload))
+            segment_count = count
+        return fields, segment_count
+
+    def _load(self, session_id: str, turn: int) -> Optional[GameState]:
+        """Rebuilds the state at `turn` from the database (the whole transcript has to be read)."""
+        fields, _ = self._fields_at(session_id, turn)
+        if not fields:
+            return None
+        segments: List[StorySegment] = []
+        for payload, first in self._db.execute(
+            "SELECT segments, first_segment FROM checkpoints WHERE session_id = ? AND turn <= ? ORDER BY turn",
+            (session_id, turn),
+        ):
+            segments = segments[:first] + [StorySegment(**s) for s in json.loads(payload)]
+        self.stats["loads"] += 1
+        return GameState(**fields, segments=segments)
+
+    def _stored_segment(self, session_id: str, index: int) -> Optional[StorySegment]:
+        """Segment `index` of the session's current transcript, from the newest checkpoint that wrote it."""
+        row = self._db.execute(
+            "SELECT segments, first_segment FROM checkpoints WHERE session_id = ? AND first_segment <= ?"
+            " AND segment_count > ? ORDER BY turn DESC LIMIT 1",
+            (session_id, index, index),
+        ).fetchone()
+        if row is None:
+            return None
+        return StorySegment(**json.loads(row[0])[index - row[1]])
+
+    def _extends(self, session_id: str, segment_count: int, state: GameState) -> bool:
+        """Whether `state`'s transcript continues the stored one, rather than one written since it was loaded."""
+        if len(state.segments) < segment_count:
+            return False
+        if segment_count == 0:
+            return True
+        stored = self._stored_segment(session_id, segment_count - 1)
+        ours = state.segments[segment_count - 1]
+        return stored is not None and stored.id == ours.id and stored.text == ours.text
+
+    def _compact(self, session_id: str, head_turn: int) -> None:
+        """Folds checkpoints older than the rewind window into one base snapshot."""
+        base = head_turn - self.rewind_turns
+        oldest = self._db.execute("SELECT MIN(turn) FROM checkpoints WHERE session_id = ?", (session_id,)).fetchone()[0]
+        if oldest is None or base <= oldest:
+            return
+        state = self._load(session_id, base)
+        if state is None:
+            return
+        fields = json.dumps(scalar_fields(state))
+        segments = json.dumps([s.model_dump(mode="json") for s in state.segments])
+        self._db.execute("DELETE FROM checkpoints WHERE session_id = ? AND turn <= ?", (session_id, base))
+        self._db.execute(
+            "INSERT INTO checkpoints VALUES (?, ?, 1, ?, ?, 0, ?, ?, ?)",
+            (session_id, base, fields, segments, len(state.segments), len(fields) + len(segments), time.time()),
+        )
+        self.stats["compactions"] += 1
+
+    def _delete(self, session_id: str) -> None:
+        self._db.execute("DELETE FROM checkpoints WHERE session_id = ?", (session_id,))
+        self._db.execute("DELETE FROM heads WHERE session_id = ?", (session_id,))
+        self._memory.discard(session_id)
+
+    def _enforce_limits(self, now: float) -> None:
+        """Drops idle sessions, then the least recently played ones while over `max_bytes`."""
+        if now - self._last_sweep < SESSION_SWEEP_SECONDS:
+            return
+        self._last_sweep = now
+        for (session_id,) in self._db.execute(
+            "SELECT session_id FROM heads WHERE updated_at < ?", (now - self.idle_seconds,)
+        ).fetchall():
+            self._delete(session_id)
+            self.stats["evictions"] += 1
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM checkpoints").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for session_id, size in self._db.execute(
+            "SELECT h.session_id, COALESCE(SUM(c.size), 0) FROM heads h LEFT JOIN checkpoints c"
+            " ON c.session_id = h.session_id GROUP BY h.session_id ORDER BY h.updated_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._delete(session_id)
+            total -= size
+            self.stats["evictions"] += 1
+
+    # --- SessionStore interface ---
+
+    def get(self, session_id: str) -> Optional[GameState]:
+        with self._lock:
+            head = self._head(session_id)
+            if head is None or head[3] < time.time() - self.idle_seconds:
+                return None
+            cached = self._cached(session_id, head[4])
+            if cached is not None:
+                return cached
+            # Written or rewound by another worker (or this one restarted): rebuild it from the checkpoints
+            state = self._load(session_id, head[0])
+            if state is not None:
+                self._remember(session_id, head[4], state)
+            return state
+
+    def put(self, session_id: str, state: GameState) -> None:
+        fields = scalar_fields(state)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                head = self._head(session_id)
+                turn = head[0] + 1 if head is not None else 0
+                version = head[4] + 1 if head is not None else 0
+                segment_count = head[2] if head is not None else 0
+                if self._extends(session_id, segment_count, state):
+                    first, new_segments = segment_count, state.segments[segment_count:]
+                else:
+                    # The transcript was replaced, or branched from an older turn than the head (a
+                    # stale writer): store it whole rather than splice its tail onto another branch
+                    first, new_segments = 0, state.segments
+
+                snapshot = head is None or turn % self.snapshot_every == 0
+                payload = json.dumps(fields if snapshot else diff_fields(json.loads(head[1]), fields))
+                segments = json.dumps([s.model_dump(mode="json") for s in new_segments])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, turn, int(snapshot), payload, segments, first, len(state.segments),
+                     len(payload) + len(segments), now),
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO heads (session_id, turn, fields, segment_count, updated_at, version)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (session_id, turn, json.dumps(fields), len(state.segments), now, version),
+                )
+                if snapshot:
+                    self._compact(session_id, turn)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.stats["snapshots" if snapshot else "deltas"] += 1
+            self._remember(session_id, version, state)
+            self._enforce_limits(now)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._delete(session_id)
+
+    # --- Rewind ---
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        """The turns a session can be rewound to, oldest first: turn number, transcript length and time."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT turn, segment_count, created_at FROM checkpoints WHERE session_id = ? ORDER BY turn",
+                (session_id,),
+            ).fetchall()
+        return [{"turn": turn, "segments": count, "created_at": created_at} for turn, count, created_at in rows]
+
+    def current_turn(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            head = self._head(session_id)
+        return head[0] if head is not None else None
+
+    def rewind(self, session_id: str, turn: int) -> Optional[GameState]:
+        """
+        Makes `turn` the session's current turn again, discarding the turns after it. Returns the
+        state at that turn, or None if the session or turn doesn't exist (e.g. compacted away).
+        """
+        with self._lock:
+            head = self._head(session_id)
+            if head is None or turn > head[0]:
+                return None
+            if not self._db.execute(
+                "SELECT 1 FROM checkpoints WHERE session_id = ? AND turn = ?", (session_id, turn)
+            ).fetchone():
+                return None
+
+            cached = self._cached(session_id, head[4])
+            if cached is not None:
+                # Only the small fields are replayed (from the nearest snapshot); the transcript is a slice
+                fields, segment_count = self._fields_at(session_id, turn)
+                state = GameState(**fields, segments=cached.segments[:segment_count])
+            else:
+                state = self._load(session_id, turn)
+
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM checkpoints WHERE session_id = ? AND turn > ?", (session_id, turn))
+                self._db.execute(
+                    "UPDATE heads SET turn = ?, fields = ?, segment_count = ?, updated_at = ?, version = version + 1"
+                    " WHERE session_id = ?",
+                    (turn, json.dumps(scalar_fields(state)), len(state.segments), time.time(), session_id),
+                )
+                version = self._head(session_id)[4]
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._remember(session_id, version, state)
+            self.stats["rewinds"] += 1
+            return state
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            sessions = self._db.execute("SELECT COUNT(*) FROM heads").fetchone()[0]
+            checkpoints, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM checkpoints").fetchone()
+            return {"sessions": sessions, "checkpoints": checkpoints, "bytes": size, **self.stats, "memory": self._memory.report()}
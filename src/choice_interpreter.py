@@ -0,0 +1,252 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+from typing import Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Minimum local score needed to accept a match without asking the LLM.
+CHOICE_MATCH_THRESHOLD = float(os.getenv("CHOICE_MATCH_THRESHOLD", "0.75"))
+# The best choice must beat the runner-up by this much, otherwise the input is ambiguous.
+CHOICE_MATCH_MARGIN = float(os.getenv("CHOICE_MATCH_MARGIN", "0.1"))
+# Set to 0 to skip the embedding tier (fuzzy matching and the LLM still apply).
+CHOICE_EMBEDDINGS_ENABLED = os.getenv("CHOICE_EMBEDDINGS_ENABLED", "1") != "0"
+EMBEDDING_DIMENSIONS = 512
+# Similarity at which an input word counts as a typo of a choice word. Below 0.85 a word matches
+# longer words that merely contain it ("rest" scores 0.8 against "forest").
+TYPO_SIMILARITY = 0.85
+MAX_CACHED_INDEXES = 256
+
+STOPWORDS = frozenset({"a", "an", "the", "to", "for", "of", "into", "in", "on", "at", "and", "i", "let", "lets", "me", "my", "please", "will", "want", "go"})
+INVALID_CHOICE = "INVALID_CHOICE"
+
+
+class ChoiceMatch(NamedTuple):
+    choice: Optional[str] # The resolved choice exactly as offered, or None if invalid
+    tier: str # "exact", "fuzzy", "embedding", "llm" or "unresolved"
+    confidence: float
+    # For input the LLM tier found invalid: what it said to the player (CHOICE_INTERPRETATION_PROMPT
+    # asks for a short nudge after INVALID_CHOICE), so the turn needs no second LLM call
+    reply: str = ""
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^a-z0-9\s]", " ", text.lower()).split())
+
+
+def token_set(text: str) -> FrozenSet[str]:
+    tokens = normalize(text).split()
+    meaningful = [t for t in tokens if t not in STOPWORDS]
+    return frozenset(meaningful or tokens)
+
+
+def _fuzzy_overlap(tokens: FrozenSet[str], choice_tokens: FrozenSet[str]) -> int:
+    """Number of input tokens that match a choice token exactly or up to a small typo."""
+    matched = 0
+    for token in tokens:
+        if token in choice_tokens or any(
+            SequenceMatcher(None, token, candidate).ratio() >= TYPO_SIMILARITY for candidate in choice_tokens
+        ):
+            matched += 1
+    return matched
+
+
+def hashed_ngram_embedding(texts: Sequence[str], dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Tiny local embedding: character trigrams of the normalized text hashed into a fixed-size,
+    L2-normalized vector. No model download and no network, but robust to typos and word order.
+    """
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f"  {normalize(text)}  "
+        for i in range(len(padded) - 2):
+            bucket = int.from_bytes(hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=4).digest(), "little")
+            vectors[row, bucket % dimensions] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+class ChoiceIndex:
+    """Everything derived from one set of choices, built once when the choices are offered."""
+
+    def __init__(self, choices: Sequence[str], embedder: Optional[Callable[[Sequence[str]], np.ndarray]]):
+        self.choices = list(choices)
+        self.exact: Dict[str, str] = {}
+        for choice in self.choices:
+            self.exact.setdefault(choice.strip().lower(), choice)
+            self.exact.setdefault(normalize(choice), choice)
+        self.normalized = [normalize(c) for c in self.choices]
+        self.tokens = [token_set(c) for c in self.choices]
+        self.embedder = embedder
+        self.vectors = embedder(self.choices) if embedder is not None and self.choices else None
+
+
+def _best_two(scores: List[float]) -> Tuple[int, float, float]:
+    order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+    best = order[0]
+    runner_up = scores[order[1]] if len(order) > 1 else 0.0
+    return best, scores[best], runner_up
+
+
+class ChoiceInterpreter:
+    """
+    Maps free-form player input onto one of the available choices, cheapest method first:
+
+    1. exact (case-insensitive) match,
+    2. token-set overlap and edit-distance similarity,
+    3. similarity in a small local embedding space,
+    4. the LLM (CHOICE_INTERPRETATION_PROMPT), only when the local tiers aren't confident.
+
+    `stats` counts which tier resolved each input, so we can see how many LLM round-trips were saved.
+    """
+
+    def __init__(
+        self,
+        llm_resolver: Optional[Callable[[List[str], str], str]] = None,
+        allm_resolver: Optional[Callable[[List[str], str], Awaitable[str]]] = None,
+        threshold: float = CHOICE_MATCH_THRESHOLD,
+        margin: float = CHOICE_MATCH_MARGIN,
+        embedder: Optional[Callable[[Sequence[str]], np.ndarray]] = hashed_ngram_embedding if CHOICE_EMBEDDINGS_ENABLED else None,
+    ):
+        self.llm_resolver = llm_resolver
+        self.allm_resolver = allm_resolver
+        self.threshold = threshold
+        self.margin = margin
+        self.embedder = embedder
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[Tuple[str, ...], ChoiceIndex]" = OrderedDict()
+
+    def prepare(self, choices: Sequence[str]) -> ChoiceIndex:
+        """Builds (or returns the cached) index for a set of choices. Call it when choices are offered."""
+        key = tuple(choices)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = ChoiceIndex(key, self.embedder)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > MAX_CACHED_INDEXES:
+                self._indexes.popitem(last=False)
+        return index
+
+    # --- Tiers ---
+
+    def _fuzzy(self, index: ChoiceIndex, user_input: str) -> Tuple[Optional[str], float]:
+        text = normalize(user_input)
+        tokens = token_set(user_input)
+        scores = []
+        for normalized, choice_tokens in zip(index.normalized, index.tokens):
+            overlap = _fuzzy_overlap(tokens, choice_tokens)
+            union = len(tokens) + len(choice_tokens) - overlap
+            jaccard = overlap / union if union else 0.0
+            # Short inputs that only name a distinctive part of a choice ("mushroom", "climb tree")
+            containment = overlap / len(tokens) if tokens else 0.0
+            edit_similarity = SequenceMatcher(None, text, normalized).ratio()
+            scores.append(max(jaccard, 0.9 * containment, edit_similarity))
+        best, score, runner_up = _best_two(scores)
+        if score - runner_up < self.margin:
+            return None, score
+        return index.choices[best], score
+
+    def _embedding(self, index: ChoiceIndex, user_input: str) -> Tuple[Optional[str], float]:
+        if index.vectors is None:
+            return None, 0.0
+        query = index.embedder([user_input])[0]
+        scores = (index.vectors @ query).tolist()
+        best, score, runner_up = _best_two(scores)
+        if score - runner_up < self.margin:
+            return None, score
+        return index.choices[best], score
+
+    def _resolve_llm_answer(self, index: ChoiceIndex, answer: str) -> ChoiceMatch:
+        answer = answer.strip().strip('"\'').strip()
+        if answer.upper().startswith(INVALID_CHOICE):
+            return ChoiceMatch(None, "llm", 1.0, answer[len(INVALID_CHOICE):].lstrip(" \n\t:-\"'"))
+        answer = answer.strip('"\'.').strip()
+        if not answer:
+            return ChoiceMatch(None, "llm", 1.0)
+        # The LLM was asked to repeat the choice verbatim; tolerate small deviations
+        resolved = index.exact.get(answer.lower()) or index.exact.get(normalize(answer))
+        if resolved is None:
+            resolved, score = self._fuzzy(index, answer)
+            if score < self.threshold:
+                resolved = None
+        return ChoiceMatch(resolved, "llm", 1.0)
+
+    # --- Entry point ---
+
+    def interpret(self, user_input: str, choices: Sequence[str]) -> ChoiceMatch:
+        match, index = self._interpret_locally(user_input, choices)
+        if match is None:
+            try:
+                match = self._resolve_llm_answer(index, self.llm_resolver(index.choices, user_input))
+            except Exception as e:
+                logger.warning("Error while interpreting choice with the LLM: %s", e)
+                match = ChoiceMatch(None, "llm", 0.0) # The call was made (and failed); don't make another
+        return self._record(user_input, match)
+
+    async def ainterpret(self, user_input: str, choices: Sequence[str]) -> ChoiceMatch:
+        """Same as `interpret`, but awaits `allm_resolver` for the LLM tier instead of blocking."""
+        match, index = self._interpret_locally(user_input, choices)
+        if match is None:
+            try:
+                if self.allm_resolver is not None:
+                    answer = await self.allm_resolver(index.choices, user_input)
+                else:
+                    answer = await asyncio.to_thread(self.llm_resolver, index.choices, user_input)
+                match = self._resolve_llm_answer(index, answer)
+            except Exception as e:
+                logger.warning("Error while interpreting choice with the LLM: %s", e)
+                match = ChoiceMatch(None, "llm", 0.0) # The call was made (and failed); don't make another
+        return self._record(user_input, match)
+
+    def _record(self, user_input: str, match: ChoiceMatch) -> ChoiceMatch:
+        with self._lock:
+            self.stats[match.tier] += 1
+        logger.debug("Choice %r -> %r (tier=%s, confidence=%.2f)", user_input, match.choice, match.tier, match.confidence)
+        return match
+
+    def _interpret_locally(self, user_input: str, choices: Sequence[str]) -> Tuple[Optional[ChoiceMatch], Optional[ChoiceIndex]]:
+        """Runs the local tiers. Returns (None, index) when only the LLM can decide."""
+        if not choices or not user_input.strip():
+            return ChoiceMatch(None, "unresolved", 0.0), None
+        index = self.prepare(choices)
+
+        exact = index.exact.get(user_input.strip().lower())
+        if exact is not None:
+            return ChoiceMatch(exact, "exact", 1.0), index
+
+        choice, score = self._fuzzy(index, user_input)
+        if choice is not None and score >= self.threshold:
+            return ChoiceMatch(choice, "fuzzy", score), index
+
+        choice, score = self._embedding(index, user_input)
+        if choice is not None and score >= self.threshold:
+            return ChoiceMatch(choice, "embedding", score), index
+
+        if self.llm_resolver is None:
+            return ChoiceMatch(None, "unresolved", 0.0), index
+        return None, index
+
+    def report(self) -> Dict[str, int]:
+        """
+        Per-tier counts plus how many LLM calls were avoided: inputs the fuzzy and embedding tiers
+        resolved, each of which would otherwise have cost one. Exact matches never needed a call,
+        and unresolved input still gets an LLM-written nudge.
+        """
+        with self._lock:
+            counts = dict(self.stats)
+        total = sum(counts.values())
+        return {**counts, "total": total, "llm_calls_avoided": counts.get("fuzzy", 0) + counts.get("embedding", 0)}
@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from typing import Iterator, Optional, Tuple
+
+from src.state import GameState, StorySegment
+from src.service import GameService, TurnEvent, SessionNotFound
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# When set, the UI talks to a headless game server (server.py) instead of running the graph itself.
+GAME_SERVER_URL = os.getenv("GAME_SERVER_URL", "")
+GAME_SERVER_TIMEOUT_SECONDS = float(os.getenv("GAME_SERVER_TIMEOUT_SECONDS", "120"))
+
+
+class LocalGameClient:
+    """Runs the game in this process (through GameService on the shared event loop)."""
+
+    def __init__(self, service: Optional[GameService] = None):
+        self.service = service or GameService()
+
+    def warm_up(self) -> None:
+        """
+        Builds the graph and the LLM client on a background thread, so the page can render
+        while they load and the first turn usually finds them ready.
+        """
+        def build():
+            from src.agent import get_game_agent, get_llm
+            try:
+                get_game_agent()
+                get_llm()
+            except Exception as e:
+                # Surfaces again (as an in-game error) on the first turn that needs it
+                logger.warning("Warm-up failed: %s", e)
+        threading.Thread(target=build, name="game-warm-up", daemon=True).start()
+
+    def create_session(self) -> Tuple[str, GameState]:
+        return self.service.create_session()
+
+    def get_state(self, session_id: str) -> Optional[GameState]:
+        try:
+            return self.service.get_state(session_id)
+        except SessionNotFound:
+            return None
+
+    def undo(self, session_id: str) -> Optional[GameState]:
+        """Takes back the last choice; None if there is nothing to undo."""
+        from src.runtime import run_coroutine
+        try:
+            return run_coroutine(self.service.undo(session_id))
+        except SessionNotFound:
+            return None
+
+    def play_turn(self, session_id: str, choice: Optional[str] = None, known_state: Optional[GameState] = None) -> Iterator[TurnEvent]:
+        # In-process states share their transcript segments, so there is nothing to save by using `known_state`
+        from src.runtime import iterate_async
+        return iterate_async(self.service.play_turn(session_id, choice))
+
+
+class RemoteGameClient:
+    """Talks to server.py over HTTP; scene tokens arrive as Server-Sent Events."""
+
+    def __init__(self, base_url: str = GAME_SERVER_URL, timeout: float = GAME_SERVER_TIMEOUT_SECONDS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def warm_up(self) -> None:
+        """Nothing to build locally; the server owns the graph and the LLM client."""
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method, headers={"Content-Type": "application/json"}
+        )
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def create_session(self) -> Tuple[str, GameState]:
+        with self._request("POST", "/sessions") as response:
+            payload = json.load(response)
+        return payload["session_id"], GameState(**payload["state"])
+
+    def get_state(self, session_id: str) -> Optional[GameState]:
+        try:
+            with self._request("GET", f"/sessions/{session_id}") as response:
+                return GameState(**json.load(response)["state"])
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def undo(self, session_id: str) -> Optional[GameState]:
+        try:
+            with self._request("POST", f"/sessions/{session_id}/undo") as response:
+                return GameState(**json.load(response)["state"])
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 409):
+                return None
+            raise
+
+    def play_turn(self, session_id: str, choice: Optional[str] = None, known_state: Optional[GameState] = None) -> Iterator[TurnEvent]:
+        """
+        Streams one turn. With `known_state` (the client's copy of the session) the server only
+        sends the new transcript segments, which are appended to the ones already known.
+        """
+        after = known_state.last_segment_id if known_state is not None else None
+        with self._request("POST", f"/sessions/{session_id}/turns/stream", {"choice": choice, "after": after}) as response:
+            event = None
+            for raw_line in response:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event in ("token", "reset"):
+                        yield event, data["text"]
+                    elif event == "state":
+                        if known_state is not None:
+                            data["segments"] = known_state.segments + [StorySegment(**s) for s in data["segments"]]
+                        yield "state", GameState(**data)
+
+
+def get_game_client():
+    """The client selected by GAME_SERVER_URL: remote if set, otherwise in-process."""
+    if GAME_SERVER_URL:
+        return RemoteGameClient(GAME_SERVER_URL)
+    return LocalGameClient()
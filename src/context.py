@@ -0,0 +1,184 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List, Optional, Tuple
+
+from src.state import GameState
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# How many of the most recent scenes are sent to the LLM word-for-word.
+CONTEXT_RECENT_SCENES = int(os.getenv("STORY_CONTEXT_RECENT_SCENES", "3"))
+# Upper bound (in estimated tokens) for the "Previous events" part of SCENE_PROMPT.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("STORY_CONTEXT_TOKEN_BUDGET", "1200"))
+# Rough characters-per-token ratio; good enough for budgeting English prose.
+CHARS_PER_TOKEN = 4
+# How many finished/pending summary jobs we remember before dropping the oldest ones.
+MAX_TRACKED_SUMMARIES = 256
+# End of a sentence (with any closing quotes or brackets) and the space after it.
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for prompt budgeting (no tokenizer round-trip)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def trim_to_sentences(text: str, max_chars: int) -> str:
+    """The end of `text` in at most `max_chars`, starting at a sentence boundary (a word boundary if none fits)."""
+    if len(text) <= max_chars:
+        return text
+    tail = text[len(text) - max(max_chars, 0):]
+    match = SENTENCE_END.search(tail)
+    if match is not None and match.end() < len(tail):
+        return tail[match.end():]
+    words = tail.split(None, 1)
+    return words[1] if len(words) > 1 else ""
+
+
+def _fingerprint(*parts: str) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class StoryContextManager:
+    """
+    Builds the bounded "Previous events" context for SCENE_PROMPT.
+
+    The last `recent_scenes` scenes of the transcript are sent verbatim; everything older is
+    folded into `GameState.story_summary` by a background summarizer, so the prompt stops
+    growing after the first few turns. Only the needed scenes are read from `GameState.segments`;
+    the transcript itself is never touched, it stays available for display.
+    """
+
+    def __init__(
+        self,
+        summarizer: Callable[[str, List[str]], str],
+        recent_scenes: int = CONTEXT_RECENT_SCENES,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        max_workers: int = 2,
+    ):
+        self.summarizer = summarizer
+        self.recent_scenes = max(1, recent_scenes)
+        self.token_budget = token_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="story-summary")
+        self._lock = threading.Lock()
+        # job key -> (end scene index, fingerprint of folded scenes, future)
+        self._jobs: "OrderedDict[str, Tuple[int, str, Future]]" = OrderedDict()
+
+    # --- Background summary handling ---
+
+    def _job_key(self, state: GameState) -> Optional[str]:
+        start = state.summarized_scene_count
+        if start >= state.scene_count:
+            return None
+        # The first scene still to be folded makes the key unique per adventure, so sessions
+        # sharing the same (empty) summary don't pick up each other's jobs.
+        return _fingerprint(state.story_summary, str(start), state.scene_texts(start, start + 1)[0])
+
+    def schedule_summary(self, state: GameState, scene_count: Optional[int] = None, condense: bool = False) -> None:
+        """
+        Starts folding the scenes that just left the verbatim window into the rolling summary.
+        Returns immediately; the result is picked up by `apply_ready_summary` on a later turn.
+        `scene_count` overrides the state's when a node is adding a scene it hasn't applied yet.
+        With `condense`, the summary is rewritten (shorter) even if there are no scenes to fold in.
+        """
+        start = state.summarized_scene_count
+        end = (state.scene_count if scene_count is None else scene_count) - self.recent_scenes
+        if end <= start:
+            if not condense or not state.story_summary or start >= state.scene_count:
+                return
+            end = start
+
+        key = self._job_key(state)
+        scenes = state.scene_texts(start, end)
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None and existing[0] >= end:
+                return # Already summarizing (at least) this far
+            future = self._executor.submit(self.summarizer, state.story_summary, scenes)
+            self._jobs[key] = (end, _fingerprint(*scenes), future)
+            self._jobs.move_to_end(key)
+            while len(self._jobs) > MAX_TRACKED_SUMMARIES:
+                self._jobs.popitem(last=False)
+
+    def apply_ready_summary(self, state: GameState) -> bool:
+        """
+        Moves a finished background summary into the state. Never blocks on a running job;
+        until it completes, the unsummarized scenes are simply budget-trimmed in `build_context`.
+        """
+        key = self._job_key(state)
+        if key is None:
+            return False
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is None:
+            return False
+
+        end, scenes_fingerprint, future = job
+        if not future.done():
+            return False
+        with self._lock:
+            self._jobs.pop(key, None)
+
+        start = state.summarized_scene_count
+        if end > state.scene_count or _fingerprint(*state.scene_texts(start, end)) != scenes_fingerprint:
+            return False # The history diverged (e.g. a restarted game); drop the stale result
+        try:
+            summary = future.result()
+        except Exception as e:
+            logger.warning("Error while summarizing story: %s", e)
+            return False
+
+        state.story_summary = summary.strip()
+        state.summarized_scene_count = end
+        return True
+
+    # --- Prompt context ---
+
+    def build_context(self, state: GameState) -> str:
+        """
+        Returns the "Previous events" text for SCENE_PROMPT: the rolling summary followed by
+        the scenes not yet covered by it, trimmed oldest-first to fit the token budget. A summary
+        that doesn't fit what is left loses its oldest sentences, and is rewritten shorter in the
+        background for the next turns.
+        """
+        scenes = state.scene_texts(state.summarized_scene_count)
+        summary = state.story_summary
+
+        # Walk backwards from the newest scene, keeping as many as fit in the budget.
+        # The newest scene is always kept (truncated from the front if it alone is too big).
+        kept: List[str] = []
+        used = 0
+        for scene in reversed(scenes):
+            cost = estimate_tokens(scene)
+            if kept and used + cost > self.token_budget:
+                break
+            if not kept and cost > self.token_budget:
+                scene = "..." + scene[-self.token_budget * CHARS_PER_TOKEN:]
+                cost = self.token_budget
+            kept.append(scene)
+            used += cost
+        kept.reverse()
+
+        remaining = self.token_budget - used
+        parts: List[str] = []
+        if summary and remaining > 0 and estimate_tokens(summary) > remaining:
+            # Keep its newest whole sentences for now, and have it rewritten to fit the next prompts
+            self.schedule_summary(state, condense=True)
+            summary = trim_to_sentences(summary, remaining * CHARS_PER_TOKEN - len("... "))
+            summary = "... " + summary if summary else ""
+        if summary and remaining > 0:
+            parts.append(f"Summary of earlier events: {summary}")
+        if len(kept) < len(scenes):
+            parts.append("(Some earlier events are omitted.)")
+        parts.extend(kept)
+        return "\n\n".join(parts)
@@ -0,0 +1,172 @@
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+# Set by a benchmark driver around each turn so recorded calls can be attributed to (session, turn).
+call_tag: contextvars.ContextVar = contextvars.ContextVar("fake_llm_call_tag", default=None)
+
+NARRATIVE_WORDS = (
+    "moss", "lantern", "whisper", "ancient", "shadow", "river", "stone", "ember", "mist", "path",
+    "crow", "silver", "root", "hollow", "breeze", "glimmer", "thorn", "echo", "dusk", "fern",
+)
+
+
+class FakeLLMError(RuntimeError):
+    """Injected failure, standing in for a provider error (timeout, 503, ...)."""
+
+
+def classify_prompt(text: str) -> str:
+    """Which of our prompts a request is, judging by its text (see src/prompts.py)."""
+    if "Answer with a single JSON object" in text:
+        return "structured_scene"
+    if "describe the current scene" in text:
+        return "scene"
+    if "most likely intent of the user" in text:
+        return "choice_interpretation"
+    if "not among the available options" in text:
+        return "invalid_choice"
+    if "Rewrite the summary" in text:
+        return "summary"
+    return "other"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic, offline stand-in for ChatGoogleGenerativeAI, for benchmarks and load tests.
+
+    Latency before the first token is log-normally distributed around `latency_ms` (spread set by
+    `latency_sigma`), tokens then arrive at `tokens_per_second`, and `failure_rate` of the calls
+    raise FakeLLMError. `stall_rate` of the calls hang for an extra `stall_ms` before answering,
+    like a stuck connection (for exercising deadlines and hedging in src/resilience.py). Every call is recorded in `calls` (prompt type, prompt/response size, timing).
+    """
+
+    latency_ms: float = 300.0
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 0.0 # 0 = the whole response at once
+    failure_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_ms: float = 0.0
+    response_words: int = 120
+    seed: int = 0
+    model: str = "fake-gemini"
+
+    calls: List[Dict[str, Any]] = []
+
+    _rng: random.Random = PrivateAttr()
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.calls = []
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "seed": self.seed}
+
+    # --- Simulation ---
+
+    def _plan(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """Decides latency, failure and response text for one call (thread-safe, seeded)."""
+        prompt = "\n".join(str(m.content) for m in messages)
+        kind = classify_prompt(prompt)
+        with self._lock:
+            first_token_delay = self.latency_ms / 1000.0 * math.exp(self._rng.gauss(0.0, self.latency_sigma))
+            fails = self._rng.random() < self.failure_rate
+            stalls = self._rng.random() < self.stall_rate
+            if stalls:
+                first_token_delay += self.stall_ms / 1000.0
+            words = [self._rng.choice(NARRATIVE_WORDS) for _ in range(self.response_words)]
+            # Proposed effects for structured scenes, now and then outside the game rules
+            effects = [(self._rng.randint(-25, 15), self._rng.choice(NARRATIVE_WORDS)) for _ in range(2)] if kind == "structured_scene" else []
+        if kind == "choice_interpretation":
+            text = "INVALID_CHOICE: That action isn't possible here. Please choose one of the available paths."
+        elif kind == "invalid_choice":
+            text = "That action isn't possible here. Please choose one of the available paths."
+        elif kind == "summary":
+            text = "Summary: " + " ".join(words[:40]) + "."
+        elif kind == "structured_scene":
+            text = json.dumps({
+                "narrative": " ".join(words).capitalize() + ".",
+                "choices": [
+                    {"label": f"Search for the {item}", "text": f"You search for the {item}.",
+                     "effects": {"health": health, "add_items": [f"{item.capitalize()} Charm"], "remove_items": [], "flags": {f"found_{item}": True}}}
+                    for health, item in effects
+                ],
+            })
+        else:
+            text = " ".join(words).capitalize() + "."
+        record = {
+            "kind": kind,
+            "tag": call_tag.get(),
+            "prompt_chars": len(prompt),
+            "prompt_tokens": len(prompt) // 4,
+            "response_chars": len(text),
+            "first_token_delay": first_token_delay,
+            "failed": fails,
+            "stalled": stalls,
+        }
+        with self._lock:
+            self.calls.append(record)
+        return {"text": text, "delay": first_token_delay, "fails": fails}
+
+    def _pieces(self, text: str) -> List[str]:
+        words = text.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    # --- BaseChatModel interface ---
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        time.sleep(plan["delay"] + self._token_delay() * len(plan["text"].split(" ")))
+        if plan["fails"]:
+            raise FakeLLMError("Injected failure from FakeChatModel.")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=plan["text"]))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        await asyncio.sleep(plan["delay"] + self._token_delay() * len(plan["text"].split(" ")))
+        if plan["fails"]:
+            raise FakeLLMError("Injected failure from FakeChatModel.")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=plan["text"]))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        time.sleep(plan["delay"])
+        if plan["fails"]:
+            raise FakeLLMError("Injected failure from FakeChatModel.")
+        for piece in self._pieces(plan["text"]):
+            time.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        plan = self._plan(messages)
+        await asyncio.sleep(plan["delay"])
+        if plan["fails"]:
+            raise FakeLLMError("Injected failure from FakeChatModel.")
+        for piece in self._pieces(plan["text"]):
+            await asyncio.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
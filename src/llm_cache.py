@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from src.telemetry import record_cache_outcome
+
+# --- Configuration ---
+# On-disk tier; set LLM_CACHE_PATH to an empty string for a memory-only cache.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Collect this many different responses per prompt before serving from the cache, then pick one
+# at random, so replayed scenes don't read exactly the same every time. 1 = plain cache.
+LLM_CACHE_VARIANTS = int(os.getenv("LLM_CACHE_VARIANTS", "1"))
+# The on-disk size is tracked per write and re-read from the file (which other processes write
+# too) at least every this many writes, instead of summing the table on each one.
+SIZE_CHECK_EVERY = 64
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Content address of one LLM request. `llm_string` is LangChain's serialization of the model
+    parameters (model name, temperature, ...) and `prompt` the serialized messages.
+    """
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+class TieredResponseCache(BaseCache):
+    """
+    LangChain response cache with an in-memory LRU tier in front of a SQLite tier.
+
+    Plugged into a chat model with `ChatGoogleGenerativeAI(..., cache=TieredResponseCache())`.
+    The SQLite file is shared by every session and process pointing at the same path, and
+    entries expire after `ttl_seconds`. The least recently used entries are evicted once the
+    stored responses exceed `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = LLM_CACHE_PATH,
+        memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+        ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        variants: int = LLM_CACHE_VARIANTS,
+    ):
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.variants = max(1, variants)
+        self._lock = threading.Lock()
+        # key -> (stored_at, list of response texts)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL") # Lets several worker processes share the file
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, texts TEXT NOT NULL, size INTEGER NOT NULL,"
+                " stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        # Estimated bytes on disk: exact after each size check, plus what this process wrote since
+        self._disk_bytes = self._stored_bytes() if self._db is not None else 0
+        self._writes_since_check = 0
+
+    # --- Tier helpers ---
+
+    def _remember(self, key: str, stored_at: float, texts: List[str]) -> None:
+        # Must be called with the lock held
+        self._memory[key] = (stored_at, texts)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Tuple[Optional[List[str]], str]:
+        """The stored responses for `key` and the tier they came from ("memory" or "disk"). Records no stats."""
+        # Must be called with the lock held
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[0] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                return entry[1], "memory"
+            del self._memory[key]
+
+        if self._db is None:
+            return None, ""
+        row = self._db.execute("SELECT texts, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, ""
+        if now - row[1] > self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None, ""
+        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        texts = json.loads(row[0])
+        self._remember(key, row[1], texts)
+        return texts, "disk"
+
+    def _stored_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict_to_size(self) -> None:
+        """Drops expired entries, then the least recently used ones, while the file exceeds `max_bytes`."""
+        # Must be called with the lock held
+        self._writes_since_check = 0
+        total = self._disk_bytes = self._stored_bytes()
+        if total <= self.max_bytes:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        expired, expired_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE stored_at < ?", (cutoff,)
+        ).fetchone()
+        if expired:
+            self._db.execute("DELETE FROM responses WHERE stored_at < ?", (cutoff,))
+            self.stats["evictions"] += expired
+            total -= expired_bytes
+        if total > self.max_bytes:
+            for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                total -= size
+                self.stats["evictions"] += 1
+        self._disk_bytes = total
+
+    # --- BaseCache interface ---
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        with self._lock:
+            texts, tier = self._load(key, time.time())
+            if texts is None or len(texts) < self.variants:
+                # Not cached yet, or still collecting variants: let the model generate a fresh one
+                self.stats["misses"] += 1
+                record_cache_outcome("miss")
+                return None
+            # Only a lookup that serves a response is a hit
+            self.stats[f"{tier}_hits"] += 1
+            record_cache_outcome(f"{tier}_hit")
+        text = random.choice(texts) if self.variants > 1 else texts[0]
+        return [ChatGeneration(message=AIMessage(content=text))]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        text = "".join(generation.text for generation in return_val)
+        if not text:
+            return # Never cache empty (usually failed or filtered) responses
+        key = cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            texts = list(self._load(key, now)[0] or [])
+            if text in texts:
+                return
+            texts = (texts + [text])[-self.variants:]
+            self._remember(key, now, texts)
+            self.stats["writes"] += 1
+            if self._db is not None:
+                payload = json.dumps(texts)
+                size = len(payload.encode("utf-8"))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, texts, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now),
+                )
+                # Over-estimates replaced entries, so the exact check runs no later than needed
+                self._disk_bytes += size
+                self._writes_since_check += 1
+                if self._disk_bytes > self.max_bytes or self._writes_since_check >= SIZE_CHECK_EVERY:
+                    self._evict_to_size()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._disk_bytes = 0
+
+    # --- Reporting ---
+
+    def report(self) -> Dict[str, Any]:
+        """Hit ratio and storage usage, e.g. for logging or a debug panel."""
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            memory_bytes = sum(len(t.encode("utf-8")) for _, texts in self._memory.values() for t in texts)
+            disk_bytes = 0
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries, disk_bytes = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            return {
+                **self.stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": memory_bytes,
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+            }
@@ -0,0 +1,196 @@
+"""
+Offline batch job: pre-generates scene narratives for every game state a player can reach, so
+describe_scene can serve them from the scene store (src/scene_store.py) instead of waiting on
+the LLM during play.
+
+States are enumerated from the story definition by replaying the same rules as
+handle_user_choice (health drain, choice effects, invalid input), keyed by location, health
+range, inventory and plot flags. Each state gets `--variants` narratives, requested with at
+most `--concurrency` in flight and at most `--rpm` started per minute:
+
+    python -m src.pregenerate --variants 3 --concurrency 4 --rpm 60
+    python -m src.pregenerate --dry-run     # only count the reachable states
+    python -m src.pregenerate --fake        # offline, against FakeChatModel
+
+Responses go through the usual response cache, so re-running an interrupted job only pays for
+what is missing.
+"""
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+
+from src.state import Player
+from src.story import CompiledStory, get_story
+from src.prompts import SYSTEM_PROMPT, PREGENERATED_SCENE_PROMPT
+from src.scene_store import HEALTH_BUCKET_SIZE, SCENE_STORE_PATH, health_bucket, scene_key, write_scene_store
+from src.telemetry import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Exploration stops raising health here, so stories with healing loops still have finitely many states
+MAX_EXPLORED_HEALTH = 100
+# What each variant dwells on, so the variants of one state read differently (and are cached separately)
+VARIANT_FOCUS = (
+    "the sounds around the player",
+    "light, shadow and colour",
+    "smells and the feel of the air",
+    "what lies underfoot and close at hand",
+    "the sense of distance and what lies ahead",
+)
+
+
+class SceneState(NamedTuple):
+    """One pre-generated scene's inputs (health is the lowest value of its range)."""
+    location_id: str
+    health: int
+    inventory: Tuple[str, ...]
+    flags: Tuple[str, ...] # Plot flags that are set
+
+    @property
+    def key(self) -> str:
+        return scene_key(self.location_id, self.health, self.inventory, {flag: True for flag in self.flags})
+
+
+def enumerate_scene_states(story: CompiledStory, max_states: int = 10000) -> List[SceneState]:
+    """
+    Every scene state reachable from a new game, nearest first. Walks the story with the
+    node's own transition code (handle_user_choice's helpers), so the two can't disagree.
+    """
+    from src.agent import HEALTH_DECREASE_PER_TURN, _apply_choice
+
+    start = Player(current_location_id=story.start_location)
+    # Exact (location, health, inventory, flags) states, so health thresholds are followed precisely
+    initial = (start.current_location_id, start.health, tuple(start.inventory), frozenset())
+    seen = {initial}
+    queue = deque([initial])
+    scenes: Dict[str, SceneState] = {}
+
+    while queue and len(scenes) < max_states:
+        location_id, health, inventory, flags = queue.popleft()
+        scene = SceneState(location_id, health_bucket(health) * HEALTH_BUCKET_SIZE, tuple(sorted(set(inventory))), tuple(sorted(flags)))
+        scenes.setdefault(scene.key, scene)
+        if health <= 0:
+            continue # Game over: this scene is the last one
+
+        # Every offered choice, plus input that matches none of them (None: drain only, stay put)
+        for choice in [*story.choices(location_id), None]:
+            player = Player(current_location_id=location_id, health=health - HEALTH_DECREASE_PER_TURN, inventory=list(inventory))
+            next_location_id, new_flags = location_id, {}
+            if choice is not None:
+                _, next_location_id, new_flags = _apply_choice(player, choice, "")
+            next_flags = frozenset({*flags, *(name for name, value in new_flags.items() if value)} - {name for name, value in new_flags.items() if not value})
+            state = (next_location_id, min(max(player.health, 0), MAX_EXPLORED_HEALTH), tuple(player.inventory), next_flags)
+            if state not in seen:
+                seen.add(state)
+                queue.append(state)
+    return list(scenes.values())
+
+
+def scene_messages(story: CompiledStory, scene: SceneState, variant: int) -> list:
+    prompt = PREGENERATED_SCENE_PROMPT.format(
+        location_name=story.location_name(scene.location_id),
+        player_health=f"{scene.health}-{scene.health + HEALTH_BUCKET_SIZE - 1}",
+        player_inventory=", ".join(scene.inventory) if scene.inventory else "nothing",
+        discoveries=", ".join(flag.replace("_", " ") for flag in scene.flags) or "none yet",
+        focus=VARIANT_FOCUS[variant % len(VARIANT_FOCUS)],
+    )
+    return [HumanMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)]
+
+
+class RequestPacer:
+    """Spaces request starts at least 60/rpm seconds apart (rpm <= 0: no limit)."""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        await asyncio.sleep(start - now)
+
+
+async def generate_scenes(story: CompiledStory, scenes: List[SceneState], variants: int, concurrency: int, rpm: float) -> Dict[str, List[str]]:
+    """Generates `variants` narratives per scene state. Failed requests are logged and left out."""
+    from src.agent import ainvoke_llm
+
+    limit = asyncio.Semaphore(max(1, concurrency))
+    pacer = RequestPacer(rpm)
+    total = len(scenes) * variants
+    done = 0
+
+    async def generate(scene: SceneState, variant: int) -> Optional[str]:
+        nonlocal done
+        async with limit:
+            await pacer.wait()
+            try:
+                text = (await ainvoke_llm(scene_messages(story, scene, variant), "pregenerated_scene")).content.strip()
+            except Exception as e:
+                logger.warning("Could not generate %s (variant %d): %s", scene.key, variant, e)
+                text = None
+            done += 1
+            if done % 50 == 0 or done == total:
+                logger.info("Generated %d/%d scene variants", done, total)
+            return text or None
+
+    results = await asyncio.gather(*[generate(scene, v) for scene in scenes for v in range(variants)])
+    generated: Dict[str, List[str]] = {}
+    for index, text in enumerate(results):
+        scene = scenes[index // variants]
+        if text is not None and text not in generated.setdefault(scene.key, []):
+            generated[scene.key].append(text)
+    return generated
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate scene narratives for every reachable game state.")
+    parser.add_argument("--variants", type=int, default=3, help="Narratives per state (one is picked at random in play).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+    parser.add_argument("--rpm", type=float, default=60.0, help="Requests started per minute (0 = unlimited).")
+    parser.add_argument("--max-states", type=int, default=10000, help="Stop enumerating after this many states.")
+    parser.add_argument("--output", default=SCENE_STORE_PATH, help="Scene store file to write.")
+    parser.add_argument("--dry-run", action="store_true", help="Only enumerate and count the states.")
+    parser.add_argument("--fake", action="store_true", help="Use FakeChatModel instead of Gemini (offline).")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    story = get_story()
+    scenes = enumerate_scene_states(story, args.max_states)
+    summary = {"states": len(scenes), "requests": len(scenes) * args.variants}
+    if args.dry_run:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    if args.fake:
+        from src import agent
+        from src.fake_llm import FakeChatModel
+        agent.set_llm(FakeChatModel(latency_ms=20.0))
+
+    started = time.perf_counter()
+    generated = asyncio.run(generate_scenes(story, scenes, args.variants, args.concurrency, args.rpm))
+    size = write_scene_store(args.output, generated, story.digest)
+    summary.update({
+        "covered_states": len(generated),
+        "variants_written": sum(len(v) for v in generated.values()),
+        "bytes": size,
+        "seconds": round(time.perf_counter() - started, 1),
+        "output": args.output,
+    })
+    print(json.dumps(summary, indent=2))
+    return 0 if generated or not scenes else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
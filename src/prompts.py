@@ -21,7 +21,7 @@ The user has provided the following input: "{user_input}".
 Based on the available choices, what is the most likely intent of the user?
 If the user's input clearly matches one of the choices, state that choice.
 If it's a synonym or closely related, identify the closest available choice.
-If it does not match any available choice, state "INVALID_CHOICE".
+If it does not match any available choice, state "INVALID_CHOICE:" followed by one or two sentences to the player, as the Dungeon Master, gently explaining that the action isn't possible right now and reminding them of the available options. Do not make up new options.
 Example:
 Choices: ["Attack the goblin", "Flee the scene", "Talk to the guard"]
 User Input: "fight goblin"
@@ -29,9 +29,9 @@ Output: "Attack the goblin"
 
 Choices: ["Go left", "Go right"]
 User Input: "walk straight ahead"
-Output: "INVALID_CHOICE"
+Output: "INVALID_CHOICE: A wall of thorns blocks the way ahead. You can go left or go right."
 
-Your output should only be the identified choice or "INVALID_CHOICE".
+Your output should only be the identified choice, or "INVALID_CHOICE:" and your reply to the player.
 """
 
 INVALID_CHOICE_PROMPT = """The player attempted to perform an action that was not among the available options.
@@ -40,3 +40,52 @@ The player's input was: "{user_input}"
 As the Dungeon Master, respond briefly and helpfully to the player, explaining that their action isn't possible right now and reminding them of the available options. Do not make up new options, just gently guide them back.
 Example: "That action isn't possible here. Please choose one of the available paths: [list options]."
 """
+
+SUMMARY_PROMPT = """You are keeping notes for an ongoing choose-your-own-adventure story.
+Summary so far: {previous_summary}
+
+New events:
+{new_events}
+
+Rewrite the summary so it also covers the new events. Keep names, items, injuries, discoveries and places visited.
+Write at most {max_words} words of plain prose. Output only the summary.
+"""
+
+# Used by the offline pre-generation job (src/pregenerate.py). There is no "previous events" part:
+# a stored scene has to fit every playthrough that reaches the same state.
+PREGENERATED_SCENE_PROMPT = """The player is currently in **{location_name}**.
+
+Player's current status:
+- Health: {player_health}
+- Inventory: {player_inventory}
+- Discoveries so far: {discoveries}
+
+Please describe the current scene vividly. Focus on the environment and the immediate atmosphere, especially {focus}. Do not refer to specific earlier events, offer choices or ask questions. Just the narrative description of the scene.
+"""
+
+# Structured scenes (SCENE_OUTPUT=structured, see src/structured_scene.py): one call writes the
+# scene and proposes the choices, instead of the game system supplying them.
+STRUCTURED_SYSTEM_PROMPT = """You are a seasoned Dungeon Master and narrative guide for a text-based choose-your-own-adventure game.
+Your responses should be immersive, descriptive, and engaging, always drawing the player deeper into the story.
+Maintain a consistent fantasy tone.
+When generating a scene, focus on sensory details (sights, sounds, smells) and the general atmosphere.
+Keep your narrative concise, typically 2-4 paragraphs per scene.
+"""
+
+STRUCTURED_SCENE_PROMPT = """The player is currently in **{location_name}**.
+Previous events: {current_story_text}
+
+Player's current status:
+- Health: {player_health}
+- Inventory: {player_inventory}
+
+The story already offers these choices here: {fixed_choices}
+
+Write the scene and propose up to {max_choices} further things the player could do right here, with what happens if they do.
+Choices can't take the player elsewhere. Keep effects small: health changes between {health_min} and {health_max}, at most one new item, and flags in snake_case.
+Answer with a single JSON object and nothing else, in exactly this form (the narrative first):
+{{"narrative": "the scene, vividly described, without offering choices or asking questions",
+  "choices": [{{"label": "a short action, under 10 words",
+               "text": "one or two sentences on what happens when the player does it",
+               "effects": {{"health": 0, "add_items": [], "remove_items": [], "flags": {{}}}}}}]}}
+"""
@@ -0,0 +1,384 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from src.runtime import LLM_FAST_MAX_CONCURRENCY, LLM_MAX_CONCURRENCY
+from src.router import Target
+from src.scheduler import AdmissionRejected, estimate_tokens
+from src.telemetry import LLMCall, tracer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Total time one LLM call may take, retries, hedges and the fallback model included.
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))
+# Tighter budget for the short prompts that stand between the player's click and the next scene.
+LLM_QUICK_DEADLINE_SECONDS = float(os.getenv("LLM_QUICK_DEADLINE_SECONDS", "8"))
+QUICK_KINDS = ("choice_interpretation", "invalid_choice")
+# Share of that budget held back for the fallback target (only when the route has one).
+LLM_FALLBACK_SHARE = float(os.getenv("LLM_FALLBACK_SHARE", "0.25"))
+# Retries of the primary target on transient errors, with full-jitter exponential backoff.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.25"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "4"))
+# A duplicate ("hedged") request is fired once a request has taken longer than this latency
+# percentile of recent requests of the same kind on the same tier; the first to finish wins. 0 disables hedging.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")) # No hedging until the percentile is meaningful
+LATENCY_WINDOW = 200 # Recent latencies kept per prompt kind and tier
+
+# Provider and transport errors worth retrying, by class name so the SDKs needn't be imported here
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+    "GatewayTimeout", "BadGateway", "Aborted", "RemoteProtocolError", "ReadTimeout", "ConnectTimeout",
+    "FakeLLMError", # src/fake_llm.py's injected provider failure
+}
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Config for hedged duplicates: no callbacks, so a hedge doesn't stream a second copy of the
+# narrative into the turn next to the request it duplicates.
+QUIET_CONFIG = {"callbacks": []}
+
+
+class LLMUnavailableError(RuntimeError):
+    """Neither the primary model nor the fallback answered within the call's deadline."""
+
+
+class LLMTimeoutError(TimeoutError):
+    """An attempt was still running when its share of the deadline ran out."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed request is worth retrying (timeouts, rate limits, 5xx, dropped connections)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+class LatencyTracker:
+    """Rolling window of successful request latencies per key ("kind/tier"), for the hedging threshold."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[kind].append(seconds)
+
+    def kinds(self) -> List[str]:
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, kind: str, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(kind, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ResilientLLM:
+    """
+    Deadline, retry, hedging and fallback policy around every LLM request.
+
+    Each call is sent to a primary Target (model + concurrency pool, chosen by src/router.py) with
+    an optional fallback Target. One call gets `deadline` seconds in total (`quick_deadline` for
+    QUICK_KINDS). The primary has all of it but the fallback's share: each attempt is abandoned
+    when that runs out, transient errors are retried with jittered exponential backoff, and a
+    request slower than the recent p95 gets a hedged duplicate. If the primary still hasn't
+    answered, the fallback gets one attempt with what is left, and after that the call raises
+    LLMUnavailableError (the caller decides on a canned response).
+
+    Every request is first admitted by its target's scheduler (rate budget and priority; a
+    rejection is not retried) and then holds a slot of its target's limiter, so hedges and
+    retries count against both like any other request. Each outcome is reported to
+    `observer(kind, tier, seconds, ok)`. Sync attempts run on a private thread pool so they can be abandoned at
+    the deadline (a blocking request can't be cancelled; its slot is freed when it returns);
+    async attempts are cancelled.
+
+    Retries and the fallback stream their tokens like the first attempt; hedges don't. Whenever
+    an attempt that streamed doesn't win (it failed, timed out or lost to its hedge),
+    `on_stream_reset(call)` is called so the stream's consumer can drop the text it received
+    from it. An abandoned sync attempt runs to completion on its worker thread and keeps
+    streaming until it does, so consumers have to ignore that attempt's tokens after a reset,
+    not just the ones before it (src/agent.py tells them apart by message id).
+    """
+
+    def __init__(
+        self,
+        observer: Optional[Callable[[str, str, float, bool], None]] = None,
+        on_stream_reset: Optional[Callable[[LLMCall], None]] = None,
+        deadline: float = LLM_DEADLINE_SECONDS,
+        quick_deadline: float = LLM_QUICK_DEADLINE_SECONDS,
+        fallback_share: float = LLM_FALLBACK_SHARE,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base: float = LLM_RETRY_BASE_SECONDS,
+        retry_max: float = LLM_RETRY_MAX_SECONDS,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+    ):
+        self.observer = observer
+        self.on_stream_reset = on_stream_reset
+        self.deadline = deadline
+        self.quick_deadline = quick_deadline
+        self.fallback_share = min(max(fallback_share, 0.0), 0.9)
+        self.max_retries = max(0, max_retries)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=2 * (LLM_MAX_CONCURRENCY + LLM_FAST_MAX_CONCURRENCY), thread_name_prefix="llm-call")
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"calls": 0, "timeouts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "unavailable": 0}
+
+    # --- Bookkeeping ---
+
+    def _count(self, stat: str, metric: Optional[str] = None, labels: tuple = ()) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+        if metric is not None:
+            tracer.metrics.inc(metric, labels)
+
+    def _hedge_delay(self, call: LLMCall, target: Target) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        return self.latency.percentile(f"{call.kind}/{target.tier}", self.hedge_percentile, self.hedge_min_samples)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": anywhere between 0 and the exponential cap, so retrying sessions don't stampede
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    def _budgets(self, kind: str, started: float) -> tuple:
+        """(primary model's deadline, overall deadline), as time.monotonic() values."""
+        deadline = self.quick_deadline if kind in QUICK_KINDS else self.deadline
+        end = started + deadline
+        return end - deadline * self.fallback_share, end
+
+    def _record(self, call: LLMCall, target: Target, seconds: float, ok: bool) -> None:
+        # Cache hits say nothing about the provider's latency
+        if call.cache in ("memory_hit", "disk_hit"):
+            return
+        if ok:
+            self.latency.record(f"{call.kind}/{target.tier}", seconds)
+        if self.observer is not None:
+            self.observer(call.kind, target.tier, seconds, ok)
+
+    def _reset_stream(self, call: LLMCall) -> None:
+        if self.on_stream_reset is not None:
+            self.on_stream_reset(call)
+
+    def _timed_out(self, call: LLMCall, target: Target, started: float) -> LLMTimeoutError:
+        self._count("timeouts", "llm_timeouts_total", (call.kind,))
+        self._record(call, target, time.monotonic() - started, False)
+        return LLMTimeoutError(f"{call.kind} request to the {target.tier} tier exceeded its deadline")
+
+    def _give_up(self, call: LLMCall, error: BaseException) -> LLMUnavailableError:
+        self._count("unavailable")
+        if isinstance(error, AdmissionRejected):
+            logger.warning("LLM call (%s) turned away by admission control: %s", call.kind, error)
+        else:
+            logger.error("LLM call (%s) failed after retries and fallback: %r", call.kind, error)
+        return LLMUnavailableError(f"The model did not answer the {call.kind} request in time ({error!r}).")
+
+    # --- Sync ---
+
+    def _send(self, target: Target, messages: list, call: LLMCall, until: float, hedge: bool = False) -> Any:
+        # A hedge never queues for rate budget: while requests wait for it, a duplicate only adds load
+        charged = target.scheduler.acquire(call.kind, estimate_tokens(messages, target.max_tokens), until, wait=not hedge)
+        if hedge:
+            self._count("hedges", "llm_hedges_total", (call.kind,)) # Only duplicates actually sent
+        with target.limiter.slot():
+            call.slot_acquired()
+            started = time.perf_counter()
+            try:
+                response = target.model.invoke(messages, config=QUIET_CONFIG if hedge else None)
+            except Exception:
+                self._record(call, target, time.perf_counter() - started, False)
+                raise
+        self._record(call, target, time.perf_counter() - started, True)
+        target.scheduler.settle(charged, response, cached=call.cache in ("memory_hit", "disk_hit"))
+        return response
+
+    def _submit(self, target: Target, messages: list, call: LLMCall, until: float, hedge: bool = False) -> Future:
+        # The worker inherits this context: the node's LangChain config (for token streaming) and its span
+        context = contextvars.copy_context()
+        try:
+            return self._executor.submit(context.run, self._send, target, messages, call, until, hedge)
+        except RuntimeError:
+            # The interpreter is shutting down and won't start workers (e.g. a late background
+            # summary); send the request on this thread instead, without a deadline
+            future: Future = Future()
+            try:
+                future.set_result(context.run(self._send, target, messages, call, until, hedge))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+    def _hedged(self, target: Target, messages: list, call: LLMCall, until: float) -> Any:
+        """One attempt: a streamed request, plus a quiet hedged duplicate if it outlives the recent p95."""
+        started = time.monotonic()
+        first = self._submit(target, messages, call, until)
+        futures: List[Future] = [first]
+        hedge_delay = self._hedge_delay(call, target)
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        error: Optional[BaseException] = None
+        while futures:
+            now = time.monotonic()
+            if now >= until:
+                for future in futures:
+                    future.cancel()
+                raise self._timed_out(call, target, started)
+            wake = min(until, hedge_at) if hedge_at is not None else until
+            done, _ = wait(futures, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    if future is not first:
+                        self._count("hedge_wins", "llm_hedge_wins_total", (call.kind,))
+                        self._reset_stream(call)
+                    for other in futures:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and time.monotonic() >= hedge_at and futures:
+                hedge_at = None # At most one hedge per attempt
+                futures.append(self._submit(target, messages, call, until, hedge=True))
+        raise error
+
+    def invoke(self, messages: list, call: LLMCall, primary: Target, fallback: Optional[Target] = None) -> Any:
+        """Runs one LLM request under the policy; returns the winning response message."""
+        with self._lock:
+            self.stats["calls"] += 1
+        primary_until, until = self._budgets(call.kind, time.monotonic())
+        if fallback is None:
+            primary_until = until
+
+        error: BaseException
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._hedged(primary, messages, call, primary_until)
+            except Exception as e:
+                error = e
+            self._reset_stream(call)
+            delay = self._backoff(attempt)
+            if not is_transient(error) or attempt == self.max_retries or time.monotonic() + delay >= primary_until:
+                break
+            self._count("retries", "llm_retries_total", (call.kind,))
+            logger.warning("LLM call (%s) failed, retrying in %.2fs: %r", call.kind, delay, error)
+            time.sleep(delay)
+
+        if fallback is None:
+            raise self._give_up(call, error)
+        self._count("fallbacks", "llm_fallbacks_total", (call.kind, "model"))
+        logger.warning("LLM call (%s) falling back from the %s to the %s tier after: %r", call.kind, primary.tier, fallback.tier, error)
+        try:
+            return self._hedged(fallback, messages, call, until)
+        except Exception as e:
+            self._reset_stream(call)
+            raise self._give_up(call, e) from e
+
+    # --- Async ---
+
+    async def _asend(self, target: Target, messages: list, call: LLMCall, until: float, hedge: bool = False) -> Any:
+        charged = await target.scheduler.aacquire(call.kind, estimate_tokens(messages, target.max_tokens), until, wait=not hedge)
+        if hedge:
+            self._count("hedges", "llm_hedges_total", (call.kind,)) # Only duplicates actually sent
+        async with target.limiter.aslot():
+            call.slot_acquired()
+            started = time.perf_counter()
+            try:
+                response = await target.model.ainvoke(messages, config=QUIET_CONFIG if hedge else None)
+            except Exception:
+                self._record(call, target, time.perf_counter() - started, False)
+                raise
+        self._record(call, target, time.perf_counter() - started, True)
+        target.scheduler.settle(charged, response, cached=call.cache in ("memory_hit", "disk_hit"))
+        return response
+
+    async def _ahedged(self, target: Target, messages: list, call: LLMCall, until: float) -> Any:
+        started = time.monotonic()
+        first = asyncio.ensure_future(self._asend(target, messages, call, until))
+        tasks = {first}
+        hedge_delay = self._hedge_delay(call, target)
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                now = time.monotonic()
+                if now >= until:
+                    raise self._timed_out(call, target, started)
+                wake = min(until, hedge_at) if hedge_at is not None else until
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not first:
+                            self._count("hedge_wins", "llm_hedge_wins_total", (call.kind,))
+                            self._reset_stream(call)
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and time.monotonic() >= hedge_at and tasks:
+                    hedge_at = None
+                    tasks.add(asyncio.ensure_future(self._asend(target, messages, call, until, hedge=True)))
+            raise error
+        finally:
+            # Losers, and everything still running at the deadline, are cancelled (which frees their slots)
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, messages: list, call: LLMCall, primary: Target, fallback: Optional[Target] = None) -> Any:
+        """Async version of `invoke`."""
+        with self._lock:
+            self.stats["calls"] += 1
+        primary_until, until = self._budgets(call.kind, time.monotonic())
+        if fallback is None:
+            primary_until = until
+
+        error: BaseException
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._ahedged(primary, messages, call, primary_until)
+            except Exception as e:
+                error = e
+            self._reset_stream(call)
+            delay = self._backoff(attempt)
+            if not is_transient(error) or attempt == self.max_retries or time.monotonic() + delay >= primary_until:
+                break
+            self._count("retries", "llm_retries_total", (call.kind,))
+            logger.warning("LLM call (%s) failed, retrying in %.2fs: %r", call.kind, delay, error)
+            await asyncio.sleep(delay)
+
+        if fallback is None:
+            raise self._give_up(call, error)
+        self._count("fallbacks", "llm_fallbacks_total", (call.kind, "model"))
+        logger.warning("LLM call (%s) falling back from the %s to the %s tier after: %r", call.kind, primary.tier, fallback.tier, error)
+        try:
+            return await self._ahedged(fallback, messages, call, until)
+        except Exception as e:
+            self._reset_stream(call)
+            raise self._give_up(call, e) from e
+
+    # --- Reporting ---
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["p95_ms"] = {
+            kind: round(p * 1000, 1)
+            for kind in self.latency.kinds()
+            if (p := self.latency.percentile(kind, 0.95)) is not None
+        }
+        return stats
@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import Counter, defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from src.runtime import ConcurrencyLimiter, llm_limiter, fast_llm_limiter
+from src.scheduler import RequestScheduler, llm_scheduler, fast_llm_scheduler
+from src.telemetry import JsonlWriter, tracer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Model tiers, slowest (best) first. Each tier has its own concurrency pool (src/runtime.py),
+# so short prompts on the fast tier never queue behind scenes on the quality tier.
+QUALITY = "quality"
+FAST = "fast"
+TIER_MODELS = {
+    QUALITY: os.getenv("LLM_QUALITY_MODEL", "gemini-1.5-flash"),
+    FAST: os.getenv("LLM_FAST_MODEL", "gemini-1.5-flash-8b"),
+}
+TIER_LIMITERS = {QUALITY: llm_limiter, FAST: fast_llm_limiter}
+TIER_SCHEDULERS = {QUALITY: llm_scheduler, FAST: fast_llm_scheduler} # Rate budgets per tier
+# Recent outcomes kept per (tier, prompt kind); a tier's p95 and error rate are computed over these
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "100"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "20")) # Fewer than this: assume the tier is healthy
+# Share of calls still sent to a tier that is over budget, so its recovery is noticed
+ROUTER_PROBE_RATE = float(os.getenv("ROUTER_PROBE_RATE", "0.05"))
+# Every routing decision is appended here as JSON lines for later analysis; empty disables the file
+ROUTER_DECISION_LOG = os.getenv("ROUTER_DECISION_LOG", "")
+RECENT_DECISIONS = 1000 # Kept in memory for /stats
+
+
+class RouteSpec(NamedTuple):
+    """How one kind of prompt is served."""
+    tiers: Tuple[str, ...] # Preferred tier first; traffic shifts right when a tier is over budget
+    temperature: float
+    max_tokens: int
+    p95_budget: float # Seconds
+    error_budget: float # Share of failed requests
+    json_output: bool = False # Ask the model for a JSON response (structured scenes)
+
+# Prompt kind -> route. Short guidance and classification only ever use the fast tier.
+ROUTES: Dict[str, RouteSpec] = {
+    "scene": RouteSpec((QUALITY, FAST), temperature=0.7, max_tokens=700, p95_budget=8.0, error_budget=0.2),
+    "structured_scene": RouteSpec((QUALITY, FAST), temperature=0.7, max_tokens=1000, p95_budget=9.0, error_budget=0.2, json_output=True),
+    "pregenerated_scene": RouteSpec((QUALITY,), temperature=0.9, max_tokens=700, p95_budget=60.0, error_budget=0.5),
+    "summary": RouteSpec((FAST,), temperature=0.2, max_tokens=300, p95_budget=15.0, error_budget=0.3),
+    "choice_interpretation": RouteSpec((FAST,), temperature=0.0, max_tokens=150, p95_budget=2.0, error_budget=0.2),
+    "invalid_choice": RouteSpec((FAST,), temperature=0.5, max_tokens=150, p95_budget=3.0, error_budget=0.2),
+}
+DEFAULT_ROUTE = ROUTES["scene"]
+
+
+class Target(NamedTuple):
+    """Where one LLM request goes: a tier's model (configured for the prompt kind), its concurrency pool and rate budget."""
+    tier: str
+    model: Any
+    limiter: ConcurrencyLimiter
+    scheduler: RequestScheduler
+    max_tokens: int # Output limit of the prompt kind, for the token budget estimate
+
+
+class RouteDecision(NamedTuple):
+    kind: str
+    tier: str
+    reason: str # "preferred", "shifted" (earlier tiers over budget), "probe" or "last_resort"
+    primary: Target
+    fallback: Optional[Target] # The next faster tier of the route, if any
+
+
+class LatencyAwareRouter:
+    """
+    Picks a model tier, temperature and output limit for each LLM call by prompt kind (ROUTES).
+
+    Every request's latency and outcome is recorded per (tier, kind). When a tier's recent p95 or
+    error rate exceeds the route's budget, calls move to the next faster tier of the route; a
+    small share of probes keeps measuring the slow tier so traffic moves back once it recovers.
+
+    `build_model(model_name, temperature, max_tokens, json_output)` creates chat models; they are
+    built on first use and shared. `set_models` overrides whole tiers (e.g. with FakeChatModel).
+    """
+
+    def __init__(
+        self,
+        build_model: Callable[[str, float, int, bool], Any],
+        routes: Dict[str, RouteSpec] = ROUTES,
+        window: int = ROUTER_WINDOW,
+        min_samples: int = ROUTER_MIN_SAMPLES,
+        probe_rate: float = ROUTER_PROBE_RATE,
+        decision_log: str = ROUTER_DECISION_LOG,
+    ):
+        self.build_model = build_model
+        self.routes = routes
+        self.window = window
+        self.min_samples = min_samples
+        self.probe_rate = probe_rate
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[str, float, int, bool], Any] = {}
+        self._overrides: Dict[str, Any] = {}
+        # (tier, kind) -> recent (seconds, ok) outcomes
+        self._outcomes: Dict[Tuple[str, str], Deque[Tuple[float, bool]]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._decisions: Deque[Tuple[str, str, str]] = deque(maxlen=RECENT_DECISIONS)
+        self._log = JsonlWriter(decision_log, name="route-log") if decision_log else None
+
+    # --- Models ---
+
+    def model(self, tier: str, spec: RouteSpec = DEFAULT_ROUTE) -> Any:
+        """The chat model for `tier` with `spec`'s settings, built on first use."""
+        override = self._overrides.get(tier)
+        if override is not None:
+            return override
+        key = (tier, spec.temperature, spec.max_tokens, spec.json_output)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._models[key] = self.build_model(TIER_MODELS[tier], spec.temperature, spec.max_tokens, spec.json_output)
+        return model
+
+    def set_models(self, models: Dict[str, Any]) -> None:
+        """Serves the given tiers with these models regardless of prompt settings; takes effect on the next call."""
+        self._overrides = dict(models)
+
+    def _target(self, tier: str, spec: RouteSpec) -> Target:
+        return Target(tier, self.model(tier, spec), TIER_LIMITERS[tier], TIER_SCHEDULERS[tier], spec.max_tokens)
+
+    # --- Health ---
+
+    def record(self, kind: str, tier: str, seconds: float, ok: bool) -> None:
+        """Feeds one request's outcome back (called by src/resilience.py for every request it sends)."""
+        with self._lock:
+            self._outcomes[(tier, kind)].append((seconds, ok))
+
+    def health(self, tier: str, kind: str) -> Tuple[Optional[float], float, int]:
+        """(p95 seconds of successful requests, error rate, sample count) of a tier for a prompt kind."""
+        with self._lock:
+            outcomes = list(self._outcomes.get((tier, kind), ()))
+        if not outcomes:
+            return None, 0.0, 0
+        latencies = sorted(seconds for seconds, ok in outcomes if ok)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None
+        error_rate = sum(1 for _, ok in outcomes if not ok) / len(outcomes)
+        return p95, error_rate, len(outcomes)
+
+    def _over_budget(self, tier: str, kind: str, spec: RouteSpec) -> bool:
+        p95, error_rate, samples = self.health(tier, kind)
+        if samples < self.min_samples:
+            return False
+        return error_rate > spec.error_budget or (p95 is not None and p95 > spec.p95_budget)
+
+    # --- Routing ---
+
+    def route(self, kind: str) -> RouteDecision:
+        spec = self.routes.get(kind, DEFAULT_ROUTE)
+        index, reason = len(spec.tiers) - 1, "last_resort"
+        for i, tier in enumerate(spec.tiers):
+            if not self._over_budget(tier, kind, spec):
+                index, reason = i, "preferred" if i == 0 else "shifted"
+                break
+            if i < len(spec.tiers) - 1 and random.random() < self.probe_rate:
+                index, reason = i, "probe"
+                break
+
+        tier = spec.tiers[index]
+        fallback = self._target(spec.tiers[index + 1], spec) if index + 1 < len(spec.tiers) else None
+        decision = RouteDecision(kind, tier, reason, self._target(tier, spec), fallback)
+        self._note(decision)
+        return decision
+
+    def _note(self, decision: RouteDecision) -> None:
+        with self._lock:
+            self._decisions.append((decision.kind, decision.tier, decision.reason))
+        tracer.metrics.inc("llm_route_decisions_total", (decision.kind, decision.tier, decision.reason))
+        if decision.reason != "preferred":
+            logger.debug("Routing %s to %s tier (%s)", decision.kind, decision.tier, decision.reason)
+        if self._log is not None:
+            p95, error_rate, samples = self.health(decision.tier, decision.kind)
+            self._log.write({
+                "time": time.time(),
+                "kind": decision.kind,
+                "tier": decision.tier,
+                "reason": decision.reason,
+                "fallback": decision.fallback.tier if decision.fallback else None,
+                "tier_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "tier_error_rate": round(error_rate, 3),
+                "tier_samples": samples,
+            })
+
+    # --- Reporting ---
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = Counter(self._decisions)
+            pairs = list(self._outcomes)
+        health: Dict[str, Dict[str, Any]] = {}
+        for tier, kind in pairs:
+            p95, error_rate, samples = self.health(tier, kind)
+            health[f"{tier}/{kind}"] = {
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "error_rate": round(error_rate, 3),
+                "samples": samples,
+            }
+        recent: List[Dict[str, Any]] = [
+            {"kind": kind, "tier": tier, "reason": reason, "count": count}
+            for (kind, tier, reason), count in sorted(decisions.items())
+        ]
+        return {"recent_decisions": recent, "tier_health": health}
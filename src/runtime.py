@@ -0,0 +1,177 @@
+import os
+import queue
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# --- Configuration ---
+# Maximum number of LLM requests in flight across the whole process (sync and async callers combined).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# Separate pool for the fast model tier (short prompts; see src/router.py), so they never wait for scene slots.
+LLM_FAST_MAX_CONCURRENCY = int(os.getenv("LLM_FAST_MAX_CONCURRENCY", "16"))
+
+
+class ConcurrencyLimiter:
+    """
+    A FIFO semaphore shared by threads and event loops alike.
+
+    Sync callers use `with limiter.slot():`, async callers `async with limiter.aslot():`; both draw
+    from the same pool, so the cap holds no matter how a request was made. `queue_depth` is
+    the number of callers currently waiting for a slot.
+    """
+
+    def __init__(self, limit: int = LLM_MAX_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        # Each waiter is either a threading.Event (sync) or an (event loop, asyncio.Future) pair (async)
+        self._waiters: deque = deque()
+        self.stats: Dict[str, int] = {"acquired": 0, "waited": 0, "max_queue_depth": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def _try_acquire(self, waiter: Any) -> bool:
+        # Must be called with the lock held. Queues the waiter if no slot is free.
+        self.stats["acquired"] += 1
+        if self._in_use < self.limit and not self._waiters:
+            self._in_use += 1
+            return True
+        self._waiters.append(waiter)
+        self.stats["waited"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._waiters))
+        return False
+
+    def _release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                # The slot passes directly to the next waiter, so _in_use stays the same
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                if not loop.is_closed() and not future.done():
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+            self._in_use -= 1
+
+    def _grant(self, future: asyncio.Future) -> None:
+        # Runs on the waiter's loop. If the waiter was cancelled after the slot was handed to it,
+        # pass the slot on instead of leaking it.
+        if future.cancelled():
+            self._release()
+        elif not future.done():
+            future.set_result(None)
+
+    def _abandon(self, waiter: Any) -> bool:
+        """Removes a waiter that gave up; returns False if it had already been granted a slot."""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    @contextmanager
+    def slot(self):
+        event = threading.Event()
+        with self._lock:
+            acquired = self._try_acquire(event)
+        if not acquired:
+            event.wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            acquired = self._try_acquire(waiter)
+        if not acquired:
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Cancelled while waiting: leave the queue. If the slot was already granted, give it
+                # back; if the grant is still in flight, _grant sees the cancellation and passes it on.
+                if not self._abandon(waiter) and future.done() and not future.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "in_use": self._in_use, "queue_depth": len(self._waiters), "limit": self.limit}
+
+
+# Every LLM request in the process goes through one of these limiters: the quality tier's or the fast
+# tier's (see src/router.py and src/resilience.py, used by invoke_llm/ainvoke_llm in src/agent.py).
+llm_limiter = ConcurrencyLimiter()
+fast_llm_limiter = ConcurrencyLimiter(LLM_FAST_MAX_CONCURRENCY)
+
+
+# --- Shared event loop ---
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    The process-wide event loop, running on a daemon thread. Sync code (e.g. Streamlit script
+    threads) hands coroutines to it with `run_coroutine`, so all sessions multiplex their
+    network I/O on one loop instead of each parking a thread on it.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="game-event-loop", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+def run_coroutine(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Runs a coroutine on the shared loop and waits for its result from a regular thread."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+def iterate_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Consumes an async generator on the shared loop and yields its items to a regular thread
+    as they arrive (e.g. streamed scene tokens into a Streamlit script).
+    """
+    items: "queue.Queue" = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((False, item))
+        except BaseException as e:
+            items.put((True, e))
+        finally:
+            items.put((False, done))
+
+    asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    while True:
+        failed, item = items.get()
+        if failed:
+            raise item
+        if item is done:
+            return
+        yield item
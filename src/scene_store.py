@@ -0,0 +1,175 @@
+import os
+import mmap
+import random
+import struct
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Pre-generated scene narratives, written by `python -m src.pregenerate`. A missing file simply
+# means every scene is generated live.
+SCENE_STORE_PATH = os.getenv("SCENE_STORE_PATH", ".cache/scenes.bin")
+# Scenes are pre-generated per health range, not per exact value
+HEALTH_BUCKET_SIZE = 10
+
+# File layout (little-endian):
+#   header:  magic, entry count, story digest (hex sha1 of the story it was generated from)
+#   index:   one (key hash, data offset, data length) per entry, sorted by key hash
+#   data:    per entry: u16 key length + key, u16 variant count, then u32 length + text per variant
+MAGIC = b"SCN1"
+HEADER = struct.Struct("<4sI40s")
+INDEX_ENTRY = struct.Struct("<QQI")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+
+
+def health_bucket(health: int) -> int:
+    return max(0, health) // HEALTH_BUCKET_SIZE
+
+def scene_key(location_id: str, health: int, inventory: Iterable[str], flags: Dict[str, bool]) -> str:
+    """
+    What a pre-generated scene depends on: location, health range, inventory and the plot flags
+    that are set. Order doesn't matter for items and flags, so both are sorted.
+    """
+    items = ",".join(sorted(set(inventory)))
+    set_flags = ",".join(sorted(name for name, value in flags.items() if value))
+    return f"{location_id}|h{health_bucket(health)}|i:{items}|f:{set_flags}"
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "little")
+
+
+def write_scene_store(path: str, scenes: Dict[str, List[str]], story_digest: str) -> int:
+    """
+    Writes `scenes` (key -> narrative variants) as a store file, atomically: readers keep the
+    old file mapped until they reopen. Returns the file size in bytes.
+    """
+    entries = []
+    blobs = []
+    offset = 0
+    for key, variants in scenes.items():
+        if not variants:
+            continue
+        encoded_key = key.encode("utf-8")
+        parts = [U16.pack(len(encoded_key)), encoded_key, U16.pack(len(variants))]
+        for text in variants:
+            encoded = text.encode("utf-8")
+            parts += [U32.pack(len(encoded)), encoded]
+        blob = b"".join(parts)
+        entries.append((_key_hash(key), offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    data_start = HEADER.size + INDEX_ENTRY.size * len(entries)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), story_digest.encode("ascii")))
+        for key_hash, data_offset, length in sorted(entries):
+            f.write(INDEX_ENTRY.pack(key_hash, data_start + data_offset, length))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return data_start + offset
+
+
+class SceneStore:
+    """
+    Read side of the pre-generated scene store: the file is memory-mapped, and a lookup is a
+    binary search over the fixed-size index followed by one slice of the data section, so
+    nothing is loaded up front and the OS page cache is shared by every worker process.
+    """
+
+    def __init__(self, path: str = SCENE_STORE_PATH):
+        self.path = path
+        self.story_digest = ""
+        self._count = 0
+        self._map: Optional[mmap.mmap] = None
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self._count, digest = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError(f"not a scene store (magic {magic!r})")
+            self.story_digest = digest.decode("ascii")
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("Ignoring scene store %s: %s", path, e)
+            self._map, self._count = None, 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _find(self, key_hash: int) -> Optional[Tuple[int, int]]:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_hash, offset, length = INDEX_ENTRY.unpack_from(self._map, HEADER.size + mid * INDEX_ENTRY.size)
+            if entry_hash < key_hash:
+                lo = mid + 1
+            elif entry_hash > key_hash:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def lookup(self, key: str) -> List[str]:
+        """All variants stored for `key` (empty if the store doesn't cover it)."""
+        found = self._find(_key_hash(key)) if self._map is not None else None
+        if found is None:
+            return []
+        offset, _ = found
+        (key_length,) = U16.unpack_from(self._map, offset)
+        offset += U16.size
+        if self._map[offset:offset + key_length].decode("utf-8") != key:
+            return [] # Hash collision with a different key
+        offset += key_length
+        (count,) = U16.unpack_from(self._map, offset)
+        offset += U16.size
+        variants = []
+        for _ in range(count):
+            (length,) = U32.unpack_from(self._map, offset)
+            offset += U32.size
+            variants.append(self._map[offset:offset + length].decode("utf-8"))
+            offset += length
+        return variants
+
+    def pick(self, key: str, story_digest: str) -> Optional[str]:
+        """
+        A random variant for `key`, or None if the store doesn't cover it or was generated from
+        a different story definition than the one running now.
+        """
+        variants = self.lookup(key) if story_digest == self.story_digest else []
+        self.stats["hits" if variants else "misses"] += 1
+        return random.choice(variants) if variants else None
+
+    def report(self) -> Dict[str, int]:
+        return {**self.stats, "entries": self._count}
+
+
+_store: Optional[SceneStore] = None
+_store_lock = threading.Lock()
+
+def get_scene_store() -> SceneStore:
+    """The process-wide scene store, opened on first use (empty if the file doesn't exist)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SceneStore()
+                if len(_store):
+                    logger.info("Loaded %d pre-generated scenes from %s", len(_store), _store.path)
+    return _store
+
+def set_scene_store(store: SceneStore) -> None:
+    """Swaps the store used by describe_scene, e.g. after re-running the pre-generation job."""
+    global _store
+    _store = store
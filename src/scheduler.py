@@ -0,0 +1,416 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from src.telemetry import tracer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Provider rate budgets per model tier (see src/router.py); 0 means unlimited. The defaults are
+# Gemini's pay-as-you-go limits; free-tier keys need e.g. LLM_RPM=15 LLM_FAST_RPM=15.
+LLM_RPM = float(os.getenv("LLM_RPM", "2000"))
+LLM_TPM = float(os.getenv("LLM_TPM", "4000000"))
+LLM_FAST_RPM = float(os.getenv("LLM_FAST_RPM", "4000"))
+LLM_FAST_TPM = float(os.getenv("LLM_FAST_TPM", "4000000"))
+# How much of a minute's budget may be spent in one burst
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "10"))
+
+# Priority classes, most urgent first. Requests are served strictly in this order; within a class,
+# sessions take turns, so one session's burst can't starve the others.
+INTERACTIVE = "interactive" # A player waiting on their turn
+INITIAL = "initial" # The opening scene of a new game
+BACKGROUND = "background" # Speculative turns, summaries, pre-generation
+PRIORITIES = (INTERACTIVE, INITIAL, BACKGROUND)
+# Prompt kinds that are never more urgent than background, whoever makes them
+BACKGROUND_KINDS = ("summary", "pregenerated_scene")
+# Longest a request may queue for budget before it is turned away (the caller serves a canned
+# response instead). A request whose estimated wait is already longer is turned away at once.
+MAX_QUEUE_SECONDS = {
+    INTERACTIVE: float(os.getenv("LLM_QUEUE_MAX_SECONDS_INTERACTIVE", "3")),
+    INITIAL: float(os.getenv("LLM_QUEUE_MAX_SECONDS_INITIAL", "5")),
+    BACKGROUND: float(os.getenv("LLM_QUEUE_MAX_SECONDS_BACKGROUND", "60")),
+}
+CHARS_PER_TOKEN = 4 # Prompt size estimate before sending; corrected from the response's usage metadata
+RECENT_WAITS = 1000 # Queue waits kept per class for /stats percentiles
+
+
+class AdmissionRejected(RuntimeError):
+    """The request would have waited longer for rate budget than its class allows."""
+
+
+# --- Request class (priority and session) of the current call ---
+
+class RequestClass(NamedTuple):
+    priority: str
+    session: str # Fair-queuing key; "" for requests not made on behalf of a session
+
+_request_class: contextvars.ContextVar[Optional[RequestClass]] = contextvars.ContextVar("llm_request_class", default=None)
+
+@contextmanager
+def request_class(priority: str, session: str = "") -> Iterator[RequestClass]:
+    """Marks the LLM calls made inside the block (including graph nodes and their threads) as `priority`."""
+    value = RequestClass(priority, session)
+    token = _request_class.set(value)
+    try:
+        yield value
+    finally:
+        try:
+            _request_class.reset(token)
+        except ValueError:
+            # A generator finished in a different context than it started in; nothing to restore
+            pass
+
+def current_request_class(kind: str = "") -> RequestClass:
+    """The class of an LLM call of `kind` made here; calls outside any request_class are interactive."""
+    value = _request_class.get() or RequestClass(INTERACTIVE, "")
+    if kind in BACKGROUND_KINDS and value.priority != BACKGROUND:
+        value = value._replace(priority=BACKGROUND)
+    return value
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Prompt tokens (from its length) plus the most the response may use."""
+    return sum(len(str(m.content)) for m in messages) // CHARS_PER_TOKEN + max_tokens
+
+
+# --- Token buckets ---
+
+class TokenBucket:
+    """
+    Refills at `per_minute` / 60 per second up to `burst_seconds` worth. May go negative when
+    a request turns out to cost more than estimated. `per_minute <= 0` means unlimited.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_RATE_BURST_SECONDS):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (anything larger than the bucket needs a full one)."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= amount
+
+
+# --- Scheduler ---
+
+class Ticket:
+    """One request's place in the queue."""
+
+    __slots__ = ("priority", "session", "tokens", "enqueued", "deadline", "waiter", "state")
+
+    def __init__(self, priority: str, session: str, tokens: int, enqueued: float, deadline: float, waiter: Any):
+        self.priority = priority
+        self.session = session
+        self.tokens = tokens
+        self.enqueued = enqueued
+        self.deadline = deadline
+        self.waiter = waiter # threading.Event (sync caller) or (event loop, asyncio.Future) (async caller)
+        self.state = "queued" # -> "granted" or "rejected"
+
+
+class RequestScheduler:
+    """
+    Admission control for one model tier's requests: a requests-per-minute and a tokens-per-minute
+    token bucket, with waiting requests served by priority class and, within a class, round-robin
+    across sessions.
+
+    A request that fits the budget (and has nobody of the same or higher class ahead of it) goes
+    straight through. Otherwise it queues until a dispatcher thread grants it, or is rejected with
+    AdmissionRejected once it has waited its class's MAX_QUEUE_SECONDS (or its call's deadline),
+    or at once if its estimated wait is already longer. Like ConcurrencyLimiter, it serves
+    threads and event loops from the same queues.
+    """
+
+    def __init__(self, rpm: float, tpm: float, name: str, max_queue_seconds: Dict[str, float] = MAX_QUEUE_SECONDS):
+        self.name = name
+        self.max_queue_seconds = dict(max_queue_seconds)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        # priority -> session -> that session's waiting tickets; sessions rotate to the back when served
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._queued = {p: 0 for p in PRIORITIES}
+        self._queued_tokens = {p: 0 for p in PRIORITIES}
+        self._dispatcher: Optional[threading.Thread] = None
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=RECENT_WAITS) for p in PRIORITIES}
+        self.stats: Dict[str, Dict[str, int]] = {p: {"admitted": 0, "queued": 0, "rejected": 0} for p in PRIORITIES}
+
+    def set_limits(self, rpm: float, tpm: float) -> None:
+        """Replaces both budgets (e.g. from a benchmark); takes effect for the next request."""
+        with self._cond:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+            self._cond.notify()
+
+    # --- Bookkeeping (all called with the condition's lock held) ---
+
+    def _ready_in(self, tokens: int, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _estimated_wait(self, priority: str, tokens: int, now: float) -> float:
+        """Time until a new request would be served, if everything queued ahead of it goes first."""
+        ahead = PRIORITIES[:PRIORITIES.index(priority) + 1]
+        requests = sum(self._queued[p] for p in ahead) + 1
+        needed_tokens = sum(self._queued_tokens[p] for p in ahead) + tokens
+        waits = [0.0]
+        if not self.requests.unlimited:
+            waits.append((requests - self.requests.level) / self.requests.rate)
+        if not self.tokens.unlimited:
+            waits.append((needed_tokens - self.tokens.level) / self.tokens.rate)
+        return max(waits)
+
+    def _admit(self, ticket: Ticket, now: float) -> None:
+        self.requests.take(1, now)
+        self.tokens.take(ticket.tokens, now)
+        wait = now - ticket.enqueued
+        self.stats[ticket.priority]["admitted"] += 1
+        self._waits[ticket.priority].append(wait)
+        tracer.metrics.observe("llm_queue_wait_seconds", (self.name, ticket.priority), wait)
+
+    def _reject(self, priority: str, reason: str) -> AdmissionRejected:
+        self.stats[priority]["rejected"] += 1
+        tracer.metrics.inc("llm_admission_rejections_total", (self.name, priority, reason))
+        return AdmissionRejected(f"{priority} request to the {self.name} tier rejected ({reason})")
+
+    def _enqueue(self, ticket: Ticket) -> None:
+        self._queues[ticket.priority].setdefault(ticket.session, deque()).append(ticket)
+        self._queued[ticket.priority] += 1
+        self._queued_tokens[ticket.priority] += ticket.tokens
+        self.stats[ticket.priority]["queued"] += 1
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._run, name=f"llm-scheduler-{self.name}", daemon=True)
+            self._dispatcher.start()
+        self._cond.notify()
+
+    def _unqueue(self, ticket: Ticket) -> None:
+        sessions = self._queues[ticket.priority]
+        tickets = sessions.get(ticket.session)
+        if tickets is None or ticket not in tickets:
+            return
+        tickets.remove(ticket)
+        if not tickets:
+            del sessions[ticket.session]
+        self._queued[ticket.priority] -= 1
+        self._queued_tokens[ticket.priority] -= ticket.tokens
+
+    def _resolve(self, ticket: Ticket, state: str) -> None:
+        ticket.state = state
+        waiter = ticket.waiter
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+            return
+        loop, future = waiter
+        if loop.is_closed():
+            if state == "granted":
+                self._refund(ticket)
+            return
+        loop.call_soon_threadsafe(self._wake, ticket, future)
+
+    def _wake(self, ticket: Ticket, future: asyncio.Future) -> None:
+        # Runs on the waiter's loop. If it was cancelled after being granted, hand the budget back.
+        if future.cancelled():
+            if ticket.state == "granted":
+                with self._cond:
+                    self._refund(ticket)
+        elif not future.done():
+            future.set_result(None)
+
+    def _refund(self, ticket: Ticket) -> None:
+        now = time.monotonic()
+        self.requests.take(-1, now)
+        self.tokens.take(-ticket.tokens, now)
+        self._cond.notify()
+
+    # --- Dispatcher thread ---
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """Grants what the budget allows, in priority order. Returns seconds until the next grant is possible."""
+        for priority in PRIORITIES:
+            sessions = self._queues[priority]
+            while sessions:
+                session, tickets = next(iter(sessions.items()))
+                ticket = tickets[0]
+                ready_in = self._ready_in(ticket.tokens, now)
+                if ready_in > 0:
+                    return ready_in # Strict priority: nothing below this class goes first
+                self._unqueue(ticket)
+                if session in sessions:
+                    sessions.move_to_end(session)
+                self._admit(ticket, now)
+                self._resolve(ticket, "granted")
+        return None
+
+    def _expire(self, now: float) -> Optional[float]:
+        """Rejects tickets past their deadline. Returns the nearest remaining deadline."""
+        nearest = None
+        for priority in PRIORITIES:
+            for tickets in list(self._queues[priority].values()):
+                for ticket in list(tickets):
+                    if ticket.deadline <= now:
+                        self._unqueue(ticket)
+                        self._reject(priority, "timeout")
+                        self._resolve(ticket, "rejected")
+                    elif nearest is None or ticket.deadline < nearest:
+                        nearest = ticket.deadline
+        return nearest
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                nearest_deadline = self._expire(now)
+                ready_in = self._dispatch(now)
+                # Sleep until budget frees up or a ticket expires, or until something new is queued
+                waits = [t for t in (ready_in, nearest_deadline - now if nearest_deadline is not None else None) if t is not None]
+                self._cond.wait(max(0.001, min(waits)) if waits else None)
+
+    # --- Acquiring ---
+
+    def _start(self, kind: str, tokens: int, until: Optional[float], waiter: Any) -> Optional[Ticket]:
+        """
+        Admits at once (returns None), queues (returns the ticket) or raises AdmissionRejected.
+        Without a waiter the request is only admitted if it can go at once (e.g. a hedged duplicate).
+        """
+        priority, session = current_request_class(kind)
+        now = time.monotonic()
+        with self._cond:
+            ahead = any(self._queued[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+            if not ahead and self._ready_in(tokens, now) <= 0:
+                self._admit(Ticket(priority, session, tokens, now, now, None), now)
+                return None
+            if waiter is None:
+                raise AdmissionRejected(f"no {self.name} tier budget free right now")
+            max_wait = self.max_queue_seconds[priority]
+            if until is not None:
+                max_wait = min(max_wait, until - now)
+            if self._estimated_wait(priority, tokens, now) > max_wait:
+                raise self._reject(priority, "over_budget")
+            ticket = Ticket(priority, session, tokens, now, now + max_wait, waiter)
+            self._enqueue(ticket)
+            return ticket
+
+    def acquire(self, kind: str, tokens: int, until: Optional[float] = None, wait: bool = True) -> int:
+        """
+        Waits for budget for one request of about `tokens` tokens, sent on behalf of the current
+        request_class. `until` (time.monotonic()) caps the wait; `wait=False` never queues.
+        Returns the tokens charged, for `settle`.
+        """
+        ticket = self._start(kind, tokens, until, threading.Event() if wait else None)
+        if ticket is not None:
+            ticket.waiter.wait()
+            if ticket.state != "granted":
+                raise AdmissionRejected(f"{ticket.priority} request to the {self.name} tier rejected (timeout)")
+        return tokens
+
+    async def aacquire(self, kind: str, tokens: int, until: Optional[float] = None, wait: bool = True) -> int:
+        """Async version of `acquire`; cancelling the caller leaves the queue (or returns the budget)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket = self._start(kind, tokens, until, (loop, future) if wait else None)
+        if ticket is not None:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._cond:
+                    if ticket.state == "queued":
+                        self._unqueue(ticket)
+                        ticket.state = "rejected"
+                    elif ticket.state == "granted" and not future.cancelled():
+                        self._refund(ticket) # Granted and woken just before the cancellation (else _wake refunds)
+                raise
+            if ticket.state != "granted":
+                raise AdmissionRejected(f"{ticket.priority} request to the {self.name} tier rejected (timeout)")
+        return tokens
+
+    def settle(self, charged: int, response: Any = None, cached: bool = False) -> None:
+        """
+        Corrects the token budget once a request is done: to the response's actual usage, or
+        back in full if it was answered from the response cache without reaching the provider.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if cached:
+                self.requests.take(-1, now)
+                self.tokens.take(-charged, now)
+            else:
+                usage = getattr(response, "usage_metadata", None) or {}
+                actual = usage.get("total_tokens")
+                if actual is None:
+                    return
+                self.tokens.take(actual - charged, now)
+            self._cond.notify()
+
+    def promote(self, session: str, priority: str = INTERACTIVE) -> int:
+        """Moves a session's queued requests up to `priority` (e.g. a player now waits on a speculative turn)."""
+        moved = 0
+        with self._cond:
+            for lower in PRIORITIES[PRIORITIES.index(priority) + 1:]:
+                for ticket in list(self._queues[lower].get(session, ())):
+                    self._unqueue(ticket)
+                    ticket.priority = priority
+                    self._queues[priority].setdefault(session, deque()).append(ticket)
+                    self._queued[priority] += 1
+                    self._queued_tokens[priority] += ticket.tokens
+                    moved += 1
+            if moved:
+                self._cond.notify()
+        return moved
+
+    # --- Reporting ---
+
+    def report(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            classes: Dict[str, Any] = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    **self.stats[priority],
+                    "queue_depth": self._queued[priority],
+                    "sessions_waiting": len(self._queues[priority]),
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    "wait_p95_ms": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))] * 1000, 1) if waits else None,
+                }
+            budget: Dict[str, Any] = {}
+            for label, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                if bucket.unlimited:
+                    budget[label] = None
+                else:
+                    bucket.wait_time(0, now) # Refills
+                    budget[label] = {"per_minute": bucket.per_minute, "available": round(bucket.level, 1)}
+        return {"classes": classes, "budget": budget}
+
+
+# Every LLM request is admitted by its model tier's scheduler (see src/router.py and src/resilience.py)
+llm_scheduler = RequestScheduler(LLM_RPM, LLM_TPM, name="quality")
+fast_llm_scheduler = RequestScheduler(LLM_FAST_RPM, LLM_FAST_TPM, name="fast")
+SCHEDULERS: List[RequestScheduler] = [llm_scheduler, fast_llm_scheduler]
+
+def promote_session(session: str, priority: str = INTERACTIVE) -> int:
+    """`RequestScheduler.promote` on every tier."""
+    return sum(scheduler.promote(session, priority) for scheduler in SCHEDULERS)
@@ -0,0 +1,180 @@
+import uuid
+import asyncio
+import logging
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from src.state import GameState, StorySegment, SYSTEM
+from src.session_store import SessionStore, create_session_store
+from src.scheduler import INITIAL, INTERACTIVE, request_class
+
+logger = logging.getLogger(__name__)
+
+INITIAL_RUN = "__INITIAL_RUN__" # Marker telling the graph to describe the opening scene
+GAME_OVER_TEXT = "**Your health has dropped to zero! The adventure ends here.**"
+
+TurnEvent = Tuple[str, Union[str, GameState]]
+
+
+class SessionNotFound(KeyError):
+    """Raised for unknown (or evicted) session ids."""
+
+
+class GameService:
+    """
+    Session-oriented game API on top of the compiled graph: create a session, play a turn
+    (streamed or not), read its state. Both the HTTP server (server.py) and the Streamlit app's
+    in-process client use it, so the turn logic exists in one place.
+
+    Store calls can block (SQLite busy waits, checkpoint compaction), so the async methods make
+    them on a worker thread and never on the event loop; async callers of the plain methods
+    (server.py) do the same.
+    """
+
+    def __init__(self, store: Optional[SessionStore] = None):
+        self.store = store or create_session_store()
+        # One turn at a time per session within this process
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock_for(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    def create_session(self) -> Tuple[str, GameState]:
+        """Creates a new game. Its opening scene is generated by the first `play_turn(session_id)`."""
+        session_id = uuid.uuid4().hex
+        state = GameState(user_input=INITIAL_RUN)
+        self.store.put(session_id, state)
+        return session_id, state
+
+    def get_state(self, session_id: str) -> GameState:
+        state = self.store.get(session_id)
+        if state is None:
+            raise SessionNotFound(session_id)
+        return state
+
+    def get_segments(self, session_id: str, after: int = -1) -> List[StorySegment]:
+        """The transcript segments appended after segment id `after`, for clients that already have the rest."""
+        return self.get_state(session_id).segments_after(after)
+
+    def delete_session(self, session_id: str) -> None:
+        self.store.delete(session_id)
+
+    async def play_turn(self, session_id: str, choice: Optional[str] = None) -> AsyncIterator[TurnEvent]:
+        """
+        Plays one turn and yields ("token", text) events while the scene streams (and ("reset", "")
+        when the text streamed so far is to be discarded; see stream_game_turn), then one
+        ("state", GameState). With `choice=None` the pending opening scene is generated; if
+        there is nothing to do (game over, or no pending scene) the current state is returned as is.
+        """
+        # Imported here so that creating sessions or reading state doesn't need the LLM stack
+        from src.agent import astream_game_turn, speculative_turns
+
+        async with self._lock_for(session_id):
+            stored = await asyncio.to_thread(self.get_state, session_id)
+            if stored.game_over or (choice is None and stored.user_input != INITIAL_RUN):
+                yield "state", stored
+                return
+
+            # The graph never modifies its input, but the error path below does; work on a copy
+            # so a failed turn leaves the stored state intact
+            state = stored.copy_for_turn()
+            new_state = None
+            if choice is not None:
+                # If this choice was speculatively played out in the background, use that result directly
+                new_state = await asyncio.to_thread(speculative_turns.take, stored, choice)
+                state.user_input = choice
+
+            if new_state is None:
+                try:
+                    # The opening scene can wait a little longer for rate budget than a player's turn
+                    with request_class(INTERACTIVE if choice is not None else INITIAL, session_id):
+                        async for kind, payload in astream_game_turn(state, config={"recursion_limit": 50}):
+                            if kind == "state":
+                                new_state = payload
+                            else:
+                                yield kind, payload
+                except Exception as e:
+                    logger.exception("Error processing turn for session %s: %s", session_id, e)
+                    new_state = state
+                    new_state.add_segment(SYSTEM, "An error occurred while processing your choice.")
+                    new_state.available_choices = ["Restart"] # Offer restart
+
+            # Check for game over condition
+            if new_state.player.health <= 0 and not new_state.game_over:
+                new_state.game_over = True
+                new_state.add_segment(SYSTEM, GAME_OVER_TEXT)
+                new_state.available_choices = ["Restart Game"]
+            new_state.user_input = "" # The next request carries the next choice
+
+            await asyncio.to_thread(self.store.put, session_id, new_state)
+            if not new_state.game_over:
+                # Start generating the next scene for each choice while the player reads this one
+                speculative_turns.prefetch(new_state)
+            yield "state", new_state
+
+    # --- Rewind ---
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        """The turns the session can be rewound to (empty if the store doesn't keep them)."""
+        self.get_state(session_id)
+        return self.store.history(session_id)
+
+    async def rewind(self, session_id: str, turn: int) -> Optional[GameState]:
+        """
+        Returns the session to the state it had after `turn`, dropping later turns.
+        Returns None if the store can't rewind or the turn is no longer available.
+        """
+        if not self.store.supports_rewind:
+            return None
+        from src.agent import speculative_turns
+
+        async with self._lock_for(session_id):
+            current = await asyncio.to_thread(self.get_state, session_id)
+            state = await asyncio.to_thread(self.store.rewind, session_id, turn)
+            if state is None:
+                return None
+            speculative_turns.discard(current)
+            if not state.game_over and state.user_input != INITIAL_RUN:
+                speculative_turns.prefetch(state)
+            return state
+
+    async def undo(self, session_id: str) -> Optional[GameState]:
+        """Takes back the last choice (e.g. a fatal one). The opening scene (turn 1) can't be undone."""
+        await asyncio.to_thread(self.get_state, session_id)
+        turn = await asyncio.to_thread(self.store.current_turn, session_id)
+        if turn is None or turn <= 1:
+            return None
+        return await self.rewind(session_id, turn - 1)
+
+    async def run_turn(self, session_id: str, choice: Optional[str] = None) -> GameState:
+        """Non-streaming version of `play_turn`: returns the state after the turn."""
+        final_state = None
+        async for kind, payload in self.play_turn(session_id, choice):
+            if kind == "state":
+                final_state = payload
+        return final_state
+
+    def report(self) -> Dict[str, Dict]:
+        """Operational counters from the pieces behind the service."""
+        from src.agent import response_cache, choice_interpreter, speculative_turns, resilient_llm, router
+        from src.runtime import llm_limiter, fast_llm_limiter
+        from src.scheduler import SCHEDULERS
+        from src.scene_store import get_scene_store
+        from src.telemetry import tracer
+        return {
+            "sessions": self.store.report(),
+            "llm_limiter": llm_limiter.report(),
+            "fast_llm_limiter": fast_llm_limiter.report(),
+            "llm_router": router.report(),
+            "llm_scheduler": {scheduler.name: scheduler.report() for scheduler in SCHEDULERS},
+            "llm_resilience": resilient_llm.report(),
+            "scene_store": get_scene_store().report(),
+            "response_cache": response_cache.report(),
+            "choice_interpreter": choice_interpreter.report(),
+            "speculation": dict(speculative_turns.stats),
+            "nodes": tracer.report(),
+        }
@@ -0,0 +1,328 @@
+"""
+Compact in-memory form of sessions, and the per-worker memory that holds them.
+
+A resident GameState is a tree of Pydantic models: an object (with its own dict and field set)
+per transcript segment, a dict of plot flags, lists of items and choices. CompactSession keeps
+the same data in slots and flat arrays instead: segment kinds and scene numbers in `array`s
+next to a tuple of texts, the story's plot flags as bitsets over a process-wide flag table
+(any other flags in a small dict), and location ids, item names and choice labels interned, so
+every session standing in the same clearing shares one copy of each string.
+
+SessionMemory is what the session stores (src/session_store.py, src/checkpoints.py) keep in
+process memory: compact sessions within a byte budget, plus the decoded GameState of the few
+sessions being played right now. Sessions idle for `spill_after` seconds, and the least
+recently used ones while over budget, are handed to a spill callback (e.g. written to disk)
+and dropped.
+"""
+import os
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.state import GameState, Player, StorySegment, SCENE, OUTCOME, SYSTEM
+
+# --- Configuration ---
+# Bytes of session data one worker keeps in memory; least recently used sessions leave beyond it
+SESSION_MEMORY_BUDGET_BYTES = int(os.getenv("SESSION_MEMORY_BUDGET_BYTES", str(256 * 1024 * 1024)))
+# Sessions untouched for this long leave memory (spilled to disk where the store has a spill file)
+SESSION_SPILL_AFTER_SECONDS = float(os.getenv("SESSION_SPILL_AFTER_SECONDS", "600"))
+# Sessions kept decoded as well, so a player's consecutive turns don't decode the transcript each time
+SESSION_HOT_SESSIONS = int(os.getenv("SESSION_HOT_SESSIONS", "64"))
+SWEEP_SECONDS = 60.0 # How often (at most) idle sessions are looked for
+
+SEGMENT_KINDS = (SCENE, OUTCOME, SYSTEM) # Segment kind <-> code in CompactSession.kinds
+_KIND_CODES = {kind: code for code, kind in enumerate(SEGMENT_KINDS)}
+
+
+# --- Plot flags ---
+
+class FlagTable:
+    """
+    Gives each of a fixed set of plot flag names (the story's) a bit. Other names, such as the
+    flags generated scenes invent, get no bit: they'd each hold one for the life of the process.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._names: List[str] = [sys.intern(name) for name in dict.fromkeys(names)]
+        self._bits: Dict[str, int] = {name: 1 << index for index, name in enumerate(self._names)}
+
+    def encode(self, flags: Dict[str, bool]) -> Tuple[int, int, Optional[Dict[str, bool]]]:
+        """(flags present, flags set to True) as bitsets, plus the flags without a bit (None if there are none)."""
+        present = true = 0
+        other: Optional[Dict[str, bool]] = None
+        for name, value in flags.items():
+            bit = self._bits.get(name)
+            if bit is None:
+                if other is None:
+                    other = {}
+                other[name] = value
+                continue
+            present |= bit
+            if value:
+                true |= bit
+        return present, true, other
+
+    def decode(self, present: int, true: int, other: Optional[Dict[str, bool]] = None) -> Dict[str, bool]:
+        flags: Dict[str, bool] = {}
+        index = 0
+        while present:
+            if present & 1:
+                flags[self._names[index]] = bool(true >> index & 1)
+            present >>= 1
+            index += 1
+        if other:
+            flags.update(other)
+        return flags
+
+_flag_table: Optional[FlagTable] = None
+
+def get_flag_table() -> FlagTable:
+    """The process-wide flag table, seeded with the active story's flags on first use."""
+    global _flag_table
+    if _flag_table is None:
+        from src.story import get_story
+        _flag_table = FlagTable(sorted(get_story().flag_names))
+    return _flag_table
+
+
+# --- Compact sessions ---
+
+class CompactSession:
+    """A GameState packed into slots and arrays; `to_state()` rebuilds it."""
+
+    __slots__ = (
+        "name", "health", "inventory", "location_id", "location_name",
+        "texts", "kinds", "scenes", "story_summary", "summarized_scene_count",
+        "choices", "generated_choices", "user_input", "flags_present", "flags_true", "other_flags", "game_over", "nbytes",
+    )
+
+    @classmethod
+    def from_state(cls, state: GameState) -> "CompactSession":
+        flags = get_flag_table()
+        player = state.player
+        compact = cls()
+        compact.name = sys.intern(player.name)
+        compact.health = player.health
+        compact.inventory = tuple(sys.intern(item) for item in player.inventory)
+        compact.location_id = sys.intern(player.current_location_id)
+        compact.location_name = sys.intern(player.current_location_name)
+        # Segment ids are positions in the transcript, so they aren't stored
+        compact.texts = tuple(segment.text for segment in state.segments)
+        compact.kinds = array("b", [_KIND_CODES[segment.kind] for segment in state.segments])
+        compact.scenes = array("i", [segment.scene for segment in state.segments])
+        compact.story_summary = state.story_summary
+        compact.summarized_scene_count = state.summarized_scene_count
+        compact.choices = tuple(sys.intern(choice) for choice in state.available_choices)
+        compact.generated_choices = state.generated_choices # Immutable transitions, replaced (never modified) each scene
+        compact.user_input = state.user_input
+        compact.flags_present, compact.flags_true, compact.other_flags = flags.encode(state.plot_flags)
+        compact.game_over = state.game_over
+        compact.nbytes = compact._measure()
+        return compact
+
+    def _measure(self) -> int:
+        # Interned strings are shared between sessions, so only the references to them count
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.texts) + sum(sys.getsizeof(text) for text in self.texts)
+            + sys.getsizeof(self.kinds) + sys.getsizeof(self.scenes)
+            + sys.getsizeof(self.inventory) + sys.getsizeof(self.choices)
+            + (sys.getsizeof(self.generated_choices) + sum(sys.getsizeof(t.text) for t in self.generated_choices.values()) if self.generated_choices else 0)
+            + sys.getsizeof(self.story_summary) + sys.getsizeof(self.user_input)
+            + sys.getsizeof(self.flags_present) + sys.getsizeof(self.flags_true)
+            + (sys.getsizeof(self.other_flags) + sum(sys.getsizeof(name) for name in self.other_flags) if self.other_flags else 0)
+        )
+
+    def to_state(self) -> GameState:
+        """The GameState this was packed from, built without revalidating (it was valid when packed)."""
+        player = Player.model_construct(
+            name=self.name,
+            health=self.health,
+            inventory=list(self.inventory),
+            current_location_id=self.location_id,
+            current_location_name=self.location_name,
+        )
+        segments = [
+            StorySegment.model_construct(id=i, kind=SEGMENT_KINDS[kind], text=text, scene=scene)
+            for i, (text, kind, scene) in enumerate(zip(self.texts, self.kinds, self.scenes))
+        ]
+        return GameState.model_construct(
+            player=player,
+            segments=segments,
+            story_summary=self.story_summary,
+            summarized_scene_count=self.summarized_scene_count,
+            available_choices=list(self.choices),
+            generated_choices=self.generated_choices,
+            user_input=self.user_input,
+            plot_flags=get_flag_table().decode(self.flags_present, self.flags_true, self.other_flags),
+            game_over=self.game_over,
+        )
+
+
+def decoded_bytes(state: GameState) -> int:
+    """Approximate memory of a GameState as Pydantic objects (what a hot session costs on top of its compact form)."""
+    size = sys.getsizeof(state) + sys.getsizeof(state.__dict__) + sys.getsizeof(state.segments)
+    for segment in state.segments:
+        # The texts are shared with the compact form; the per-segment objects are not
+        size += sys.getsizeof(segment) + sys.getsizeof(segment.__dict__) + sys.getsizeof(segment.__pydantic_fields_set__)
+    return size
+
+
+# --- Per-worker session memory ---
+
+class _Entry:
+    __slots__ = ("accessed_at", "meta", "compact", "state", "hot_bytes")
+
+    def __init__(self, accessed_at: float, meta: Any, compact: CompactSession):
+        self.accessed_at = accessed_at
+        self.meta = meta
+        self.compact = compact
+        self.state: Optional[GameState] = None # Decoded as well, while the session is hot
+        self.hot_bytes = 0
+
+
+class SessionMemory:
+    """
+    Compact sessions of one worker in least-recently-used order, within `budget_bytes` and
+    `max_sessions`. The `hot_sessions` most recently used also keep their GameState, so a
+    player's next turn doesn't decode the transcript. `get` and `put` copy that state
+    (`copy_for_turn`: segments are immutable and shared), so callers modifying what they put or
+    got never change the stored session.
+
+    Sessions that leave (idle for `spill_after` seconds, or pushed out by the limits) are passed
+    to `spill(session_id, state)` if given, otherwise dropped. Each entry carries the store's
+    `meta` (e.g. the checkpoint turn it holds). Not thread-safe: stores call it under their lock.
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES,
+        max_sessions: Optional[int] = None,
+        spill_after: float = SESSION_SPILL_AFTER_SECONDS,
+        hot_sessions: int = SESSION_HOT_SESSIONS,
+        spill: Optional[Callable[[str, GameState], None]] = None,
+    ):
+        self.budget_bytes = budget_bytes
+        self.max_sessions = max_sessions
+        self.spill_after = spill_after
+        self.hot_sessions = hot_sessions
+        self.spill = spill
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._hot: "OrderedDict[str, None]" = OrderedDict() # Hot session ids, least recently used first
+        self.bytes = 0
+        self._last_sweep = time.monotonic()
+        self.stats: Dict[str, int] = {"spills": 0, "evictions": 0, "decodes": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- Hot set ---
+
+    def _heat(self, session_id: str, entry: _Entry, state: GameState) -> None:
+        if self.hot_sessions <= 0:
+            return
+        if entry.state is None:
+            entry.hot_bytes = decoded_bytes(state)
+            self.bytes += entry.hot_bytes
+        entry.state = state
+        self._hot[session_id] = None
+        self._hot.move_to_end(session_id)
+        while len(self._hot) > self.hot_sessions:
+            self._cool(next(iter(self._hot)))
+
+    def _cool(self, session_id: str) -> None:
+        self._hot.pop(session_id, None)
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.state is not None:
+            self.bytes -= entry.hot_bytes
+            entry.state, entry.hot_bytes = None, 0
+
+    # --- Access ---
+
+    def meta(self, session_id: str) -> Any:
+        """The meta stored with a session, or None if it isn't in memory (doesn't count as a use)."""
+        entry = self._entries.get(session_id)
+        return entry.meta if entry is not None else None
+
+    def last_access(self, session_id: str) -> Optional[float]:
+        entry = self._entries.get(session_id)
+        return entry.accessed_at if entry is not None else None
+
+    def get(self, session_id: str) -> Optional[GameState]:
+        now = time.monotonic()
+        self.sweep(now)
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        entry.accessed_at = now
+        self._entries.move_to_end(session_id)
+        state = entry.state
+        if state is None:
+            state = entry.compact.to_state()
+            self.stats["decodes"] += 1
+        self._heat(session_id, entry, state)
+        return state.copy_for_turn()
+
+    def put(self, session_id: str, state: GameState, meta: Any = None) -> None:
+        now = time.monotonic()
+        self._remove(session_id)
+        entry = _Entry(now, meta, CompactSession.from_state(state))
+        self._entries[session_id] = entry
+        self.bytes += entry.compact.nbytes
+        self._heat(session_id, entry, state.copy_for_turn())
+        self._enforce_limits()
+        self.sweep(now)
+
+    def discard(self, session_id: str) -> None:
+        """Removes a session from memory without spilling it."""
+        self._remove(session_id)
+
+    def _remove(self, session_id: str) -> Optional[_Entry]:
+        self._cool(session_id)
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry.compact.nbytes
+        return entry
+
+    # --- Leaving memory ---
+
+    def _evict(self, session_id: str) -> None:
+        entry = self._remove(session_id)
+        if self.spill is not None and entry is not None:
+            self.spill(session_id, entry.compact.to_state())
+            self.stats["spills"] += 1
+        else:
+            self.stats["evictions"] += 1
+
+    def _enforce_limits(self) -> None:
+        # The session just put is the most recent one; it stays even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            self.bytes > self.budget_bytes or (self.max_sessions is not None and len(self._entries) > self.max_sessions)
+        ):
+            self._evict(next(iter(self._entries)))
+
+    def sweep(self, now: Optional[float] = None) -> None:
+        """Moves sessions idle for `spill_after` out of memory (at most every SWEEP_SECONDS)."""
+        now = time.monotonic() if now is None else now
+        if now - self._last_sweep < SWEEP_SECONDS:
+            return
+        self._last_sweep = now
+        # Entries are in access order, so stop at the first fresh one
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if now - entry.accessed_at <= self.spill_after:
+                break
+            self._evict(session_id)
+
+    def report(self) -> Dict[str, Any]:
+        sessions = len(self._entries)
+        return {
+            "resident_sessions": sessions,
+            "hot_sessions": len(self._hot),
+            "resident_bytes": self.bytes,
+            "budget_bytes": self.budget_bytes,
+            "bytes_per_session": round(self.bytes / sessions) if sessions else 0,
+            **self.stats,
+        }
@@ -0,0 +1,182 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from src.state import GameState
+from src.session_memory import SessionMemory, SESSION_MEMORY_BUDGET_BYTES, SESSION_SPILL_AFTER_SECONDS
+
+# --- Configuration ---
+# "checkpoint" (per-turn checkpoints in SQLite, with rewind), "sqlite" (latest state only) or "memory"
+SESSION_STORE = os.getenv("SESSION_STORE", "checkpoint")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", ".cache/sessions.sqlite")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+# Sessions untouched for this long are evicted.
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", str(6 * 3600)))
+# How often (at most) the idle sweep runs.
+SESSION_SWEEP_SECONDS = 60.0
+# Where the in-memory store writes sessions that leave memory (idle or over budget) until they
+# are played again; empty drops them instead.
+SESSION_SPILL_PATH = os.getenv("SESSION_SPILL_PATH", ".cache/spilled_sessions.sqlite")
+
+
+class SessionStore:
+    """Where per-session GameStates live between turns. Implementations must be thread-safe."""
+
+    supports_rewind = False # Whether the store keeps earlier turns (see src/checkpoints.py)
+
+    def get(self, session_id: str) -> Optional[GameState]:
+        raise NotImplementedError
+
+    def put(self, session_id: str, state: GameState) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        """The turns a session can be rewound to; empty if the store only keeps the latest state."""
+        return []
+
+    def current_turn(self, session_id: str) -> Optional[int]:
+        return None
+
+    def rewind(self, session_id: str, turn: int) -> Optional[GameState]:
+        raise NotImplementedError("This session store doesn't keep earlier turns.")
+
+    def report(self) -> Dict[str, int]:
+        return {}
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local store: sessions are kept compact (src/session_memory.py) within a memory
+    budget and capped at `max_sessions`. Sessions idle for `spill_after` seconds, or pushed out
+    by the limits, are spilled to a SQLite file and reloaded when played again; sessions idle
+    for longer than `idle_seconds` are gone. Fast, but sessions aren't shared between workers.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        memory_budget: int = SESSION_MEMORY_BUDGET_BYTES,
+        spill_after: float = SESSION_SPILL_AFTER_SECONDS,
+        spill_path: str = SESSION_SPILL_PATH,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._spill = SQLiteSessionStore(spill_path, idle_seconds) if spill_path else None
+        self._memory = SessionMemory(
+            budget_bytes=memory_budget,
+            max_sessions=max_sessions,
+            spill_after=min(spill_after, idle_seconds),
+            spill=self._spill.put if self._spill is not None else None,
+        )
+        self.reloads = 0
+
+    def get(self, session_id: str) -> Optional[GameState]:
+        now = time.monotonic()
+        with self._lock:
+            accessed_at = self._memory.last_access(session_id)
+            if accessed_at is not None and now - accessed_at > self.idle_seconds:
+                self._memory.discard(session_id)
+                return None
+            state = self._memory.get(session_id)
+            if state is None and self._spill is not None:
+                # Transparent reload: the session moves back into memory
+                state = self._spill.get(session_id)
+                if state is not None:
+                    self._spill.delete(session_id)
+                    self._memory.put(session_id, state)
+                    self.reloads += 1
+            return state
+
+    def put(self, session_id: str, state: GameState) -> None:
+        with self._lock:
+            self._memory.put(session_id, state)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._memory.discard(session_id)
+            if self._spill is not None:
+                self._spill.delete(session_id)
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            memory = self._memory.report()
+            spilled = self._spill.report()["sessions"] if self._spill is not None else 0
+        return {
+            "sessions": memory["resident_sessions"] + spilled,
+            "spilled_sessions": spilled,
+            "reloads": self.reloads,
+            **memory,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Durable store in a SQLite file. Sessions survive restarts, and any number of worker
+    processes on the same host can share the file (WAL mode), so a player can land on a
+    different worker every turn.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+        self._last_sweep = 0.0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[GameState]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.idle_seconds),
+            ).fetchone()
+        return GameState.model_validate_json(row[0]) if row else None
+
+    def put(self, session_id: str, state: GameState) -> None:
+        payload = state.model_dump_json()
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, payload, now),
+            )
+            if now - self._last_sweep >= SESSION_SWEEP_SECONDS:
+                self._last_sweep = now
+                self.evictions += self._db.execute(
+                    "DELETE FROM sessions WHERE updated_at < ?", (now - self.idle_seconds,)
+                ).rowcount
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"sessions": count, "evictions": self.evictions}
+
+
+def create_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    """Builds the store selected by the SESSION_STORE environment variable."""
+    if kind == "checkpoint":
+        from src.checkpoints import CheckpointSessionStore
+        return CheckpointSessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind == "memory":
+        return InMemorySessionStore()
+    raise ValueError(f"Unknown SESSION_STORE '{kind}'. Use 'checkpoint', 'sqlite' or 'memory'.")
@@ -0,0 +1,411 @@
+"""
+Monte Carlo balancing simulator for the health mechanics: plays millions of games at once over
+the story's transitions and effects, with no graph and no LLM, to see how long players survive
+with the current numbers (HEALTH_DECREASE_PER_TURN, the health effects in data/story.json and
+the starting Player.health).
+
+Every run is one row of a few NumPy arrays (location, health, plot flags and inventory as
+bitsets) and a turn is a handful of vectorized gathers over the compiled story tables, so the
+cost is per turn, not per game. A policy picks each run's choice per turn:
+
+    python -m src.simulate --runs 1000000 --policy random
+    python -m src.simulate --policy greedy --drain 8 --start-health 60
+    python -m src.simulate --policy scripted --script "Go deeper into the forest" "Rest and recover health"
+    python -m src.simulate --check 200          # replay sampled paths through handle_user_choice
+
+Reports survival curves, turns-to-death distributions and how often each location is visited.
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from src.story import CompiledStory, get_story, load_story, normalize_choice
+from src.telemetry import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Games are simulated in batches of this many runs, so memory stays flat however many are asked for
+BATCH_SIZE = 1_000_000
+# Path used by the scripted policy when none is given (the same one as benchmarks/run_benchmark.py)
+DEFAULT_SCRIPT = (
+    "Go deeper into the forest", "Try to climb a tall tree", "Rest and recover health",
+    "Follow the sound of running water", "Continue forward", "Turn back",
+)
+# What a run "types" on a turn drawn as invalid input: matches no choice, so only the drain applies
+INVALID_INPUT = "xyzzy"
+NO_CHOICE = -1 # Choice index for invalid input
+
+
+# --- Story tables ---
+
+class StoryTables(NamedTuple):
+    """The compiled story as dense arrays: row = location, column = choice index at that location."""
+    location_ids: Tuple[str, ...]
+    labels: Tuple[Tuple[str, ...], ...] # Choice labels per location, in the order they are offered
+    flag_names: Tuple[str, ...] # Bit i of a flags bitset is flag_names[i]
+    item_names: Tuple[str, ...] # Bit i of an inventory bitset is item_names[i]
+    start: int
+    n_choices: np.ndarray # [L] number of choices offered
+    next_location: np.ndarray # [L, C] location index after the choice (its own row for "stay")
+    health: np.ndarray # [L, C] health effect
+    flags_set: np.ndarray # [L, C] bitset of plot flags set to True
+    flags_cleared: np.ndarray # [L, C] bitset of plot flags set to False
+    items_added: np.ndarray # [L, C] bitset
+    items_removed: np.ndarray # [L, C] bitset
+
+
+def _bits(names: Sequence[str], index: Dict[str, int]) -> int:
+    value = 0
+    for name in names:
+        value |= 1 << index[name]
+    return value
+
+
+def build_tables(story: CompiledStory) -> StoryTables:
+    """Compiles a story's transitions into StoryTables. Flags and items are limited to 64 each (one uint64)."""
+    location_ids = tuple(story.locations)
+    row = {location_id: i for i, location_id in enumerate(location_ids)}
+    transitions = [
+        [story.transition(location_id, label) for label in story.choices(location_id)]
+        for location_id in location_ids
+    ]
+    flag_names = tuple(sorted({name for ts in transitions for t in ts for name, _ in t.flags}))
+    item_names = tuple(sorted({item for ts in transitions for t in ts for item in (*t.add_items, *t.remove_items)}))
+    if len(flag_names) > 64 or len(item_names) > 64:
+        raise ValueError("The simulator supports at most 64 plot flags and 64 items.")
+    flag_bit = {name: i for i, name in enumerate(flag_names)}
+    item_bit = {name: i for i, name in enumerate(item_names)}
+
+    shape = (len(location_ids), max(1, max(len(ts) for ts in transitions)))
+    next_location = np.tile(np.arange(shape[0], dtype=np.int32)[:, None], (1, shape[1]))
+    health = np.zeros(shape, dtype=np.int32)
+    flags_set, flags_cleared, items_added, items_removed = (np.zeros(shape, dtype=np.uint64) for _ in range(4))
+    for i, ts in enumerate(transitions):
+        for c, t in enumerate(ts):
+            if t.next_location is not None:
+                next_location[i, c] = row[t.next_location]
+            health[i, c] = t.health
+            flags_set[i, c] = _bits([name for name, value in t.flags if value], flag_bit)
+            flags_cleared[i, c] = _bits([name for name, value in t.flags if not value], flag_bit)
+            items_added[i, c] = _bits(t.add_items, item_bit)
+            items_removed[i, c] = _bits(t.remove_items, item_bit)
+
+    return StoryTables(
+        location_ids=location_ids,
+        labels=tuple(story.choices(location_id) for location_id in location_ids),
+        flag_names=flag_names,
+        item_names=item_names,
+        start=row[story.start_location],
+        n_choices=np.array([len(ts) for ts in transitions], dtype=np.int32),
+        next_location=next_location,
+        health=health,
+        flags_set=flags_set,
+        flags_cleared=flags_cleared,
+        items_added=items_added,
+        items_removed=items_removed,
+    )
+
+
+# --- Policies ---
+
+# policy(tables, location, health, turn, rng) -> choice index per run (NO_CHOICE for invalid input),
+# for the runs still alive. `location` and `health` are that turn's values before the drain.
+Policy = Callable[[StoryTables, np.ndarray, np.ndarray, int, np.random.Generator], np.ndarray]
+
+def random_policy(tables: StoryTables, location: np.ndarray, health: np.ndarray, turn: int, rng: np.random.Generator) -> np.ndarray:
+    """Any offered choice, uniformly."""
+    n = tables.n_choices[location]
+    choice = (rng.random(len(location)) * n).astype(np.int32)
+    return np.where(n > 0, choice, NO_CHOICE)
+
+def greedy_policy(tables: StoryTables, location: np.ndarray, health: np.ndarray, turn: int, rng: np.random.Generator) -> np.ndarray:
+    """The offered choice with the best immediate health effect (ties broken at random)."""
+    score = tables.health[location].astype(np.float32) + rng.random((len(location), tables.health.shape[1]), dtype=np.float32) * 0.5
+    score[np.arange(tables.health.shape[1])[None, :] >= tables.n_choices[location][:, None]] = -np.inf
+    return np.where(tables.n_choices[location] > 0, score.argmax(axis=1).astype(np.int32), NO_CHOICE)
+
+def scripted_policy(script: Sequence[str] = DEFAULT_SCRIPT) -> Policy:
+    """
+    Follows `script` like the benchmark's scripted player: on turn t, the first label from
+    script[t % len(script)] onwards (wrapping around) that is offered, else the first choice.
+    """
+    def build(tables: StoryTables) -> np.ndarray:
+        # [len(script), L] choice index for every (script position, location)
+        table = np.zeros((len(script), len(tables.location_ids)), dtype=np.int32)
+        for start in range(len(script)):
+            for row, labels in enumerate(tables.labels):
+                offered = [normalize_choice(label) for label in labels]
+                for label in [*script[start:], *script[:start]]:
+                    if normalize_choice(label) in offered:
+                        table[start, row] = offered.index(normalize_choice(label))
+                        break
+        return table
+
+    built: List[Any] = [None, None] # (tables, table) of the last story it was used with
+
+    def policy(tables: StoryTables, location: np.ndarray, health: np.ndarray, turn: int, rng: np.random.Generator) -> np.ndarray:
+        if built[0] is not tables:
+            built[:] = [tables, build(tables)]
+        choice = built[1][turn % len(script), location]
+        return np.where(tables.n_choices[location] > 0, choice, NO_CHOICE)
+    return policy
+
+POLICIES: Dict[str, Callable[..., Policy]] = {
+    "random": lambda script=None: random_policy,
+    "greedy": lambda script=None: greedy_policy,
+    "scripted": lambda script=None: scripted_policy(script or DEFAULT_SCRIPT),
+}
+
+
+# --- Simulation ---
+
+class Mechanics(NamedTuple):
+    """The tunable numbers; defaults come from src/agent.py and src/state.py (see default_mechanics)."""
+    start_health: int
+    drain: int # Health lost every turn, before the choice's own effect
+
+
+def default_mechanics() -> Mechanics:
+    from src.agent import HEALTH_DECREASE_PER_TURN
+    from src.state import Player
+    return Mechanics(start_health=Player.model_fields["health"].default, drain=HEALTH_DECREASE_PER_TURN)
+
+
+class Batch(NamedTuple):
+    """Per-turn state of a set of runs, one row per run."""
+    location: np.ndarray
+    health: np.ndarray
+    flags: np.ndarray
+    items: np.ndarray
+
+
+def step(tables: StoryTables, mechanics: Mechanics, batch: Batch, choice: np.ndarray) -> Batch:
+    """
+    One turn of handle_user_choice for every live run: drain, the chosen transition (invalid
+    input keeps the player in place), then the clamp at zero.
+    """
+    valid = (choice >= 0) & (choice < tables.n_choices[batch.location])
+    c = np.where(valid, choice, 0)
+    loc = batch.location
+    health = batch.health - mechanics.drain + np.where(valid, tables.health[loc, c], 0)
+    zero = np.uint64(0)
+    flags = (batch.flags & ~np.where(valid, tables.flags_cleared[loc, c], zero)) | np.where(valid, tables.flags_set[loc, c], zero)
+    items = (batch.items & ~np.where(valid, tables.items_removed[loc, c], zero)) | np.where(valid, tables.items_added[loc, c], zero)
+    return Batch(
+        location=np.where(valid, tables.next_location[loc, c], loc).astype(np.int32),
+        health=np.maximum(health, 0),
+        flags=flags,
+        items=items,
+    )
+
+
+class SimulationResult(NamedTuple):
+    runs: int
+    max_turns: int
+    alive: np.ndarray # [max_turns + 1] runs still playing after each turn (alive[0] = runs)
+    deaths: np.ndarray # [max_turns + 1] runs whose health reached zero on each turn
+    visits: np.ndarray # [L] choices made at each location, over all runs and turns
+    final_flags: np.ndarray # [F] runs ending with each plot flag set
+    final_items: np.ndarray # [I] runs ending with each item
+    seconds: float
+
+
+def simulate(tables: StoryTables, policy: Policy, runs: int, max_turns: int, mechanics: Mechanics,
+             invalid_rate: float = 0.0, seed: int = 0, batch_size: int = BATCH_SIZE) -> SimulationResult:
+    """Plays `runs` games of at most `max_turns` turns each. Deterministic for a given seed."""
+    rng = np.random.default_rng(seed)
+    alive = np.zeros(max_turns + 1, dtype=np.int64)
+    deaths = np.zeros(max_turns + 1, dtype=np.int64)
+    visits = np.zeros(len(tables.location_ids), dtype=np.int64)
+    final_flags = np.zeros(len(tables.flag_names), dtype=np.int64)
+    final_items = np.zeros(len(tables.item_names), dtype=np.int64)
+    started = time.perf_counter()
+
+    for offset in range(0, runs, batch_size):
+        n = min(batch_size, runs - offset)
+        batch = Batch(
+            location=np.full(n, tables.start, dtype=np.int32),
+            health=np.full(n, mechanics.start_health, dtype=np.int32),
+            flags=np.zeros(n, dtype=np.uint64),
+            items=np.zeros(n, dtype=np.uint64),
+        )
+        ended: List[Batch] = []
+        alive[0] += n
+        for turn in range(max_turns):
+            if not len(batch.health):
+                break
+            visits += np.bincount(batch.location, minlength=len(visits))
+            choice = policy(tables, batch.location, batch.health, turn, rng)
+            if invalid_rate > 0:
+                choice = np.where(rng.random(len(choice)) < invalid_rate, NO_CHOICE, choice)
+            batch = step(tables, mechanics, batch, choice)
+            dead = batch.health <= 0
+            deaths[turn + 1] += int(dead.sum())
+            alive[turn + 1] += int(len(dead) - dead.sum())
+            if dead.any():
+                ended.append(Batch(*(column[dead] for column in batch)))
+                batch = Batch(*(column[~dead] for column in batch))
+        ended.append(batch) # Still alive at the turn cap
+
+        for part in ended:
+            for bit in range(len(tables.flag_names)):
+                final_flags[bit] += int(((part.flags >> np.uint64(bit)) & np.uint64(1)).sum())
+            for bit in range(len(tables.item_names)):
+                final_items[bit] += int(((part.items >> np.uint64(bit)) & np.uint64(1)).sum())
+
+    return SimulationResult(runs, max_turns, alive, deaths, visits, final_flags, final_items, time.perf_counter() - started)
+
+
+def summarize(tables: StoryTables, result: SimulationResult, curve_points: int = 20) -> Dict[str, Any]:
+    """Survival, turns-to-death and visit statistics of a simulation, as plain JSON-able values."""
+    runs = max(result.runs, 1)
+    dead = int(result.deaths.sum())
+    summary: Dict[str, Any] = {
+        "runs": result.runs,
+        "seconds": round(result.seconds, 2),
+        "runs_per_second": round(result.runs / result.seconds) if result.seconds else None,
+        "died": round(dead / runs, 4),
+        "survived_max_turns": round(int(result.alive[-1]) / runs, 4),
+    }
+    if dead:
+        turns = np.repeat(np.arange(len(result.deaths)), result.deaths)
+        summary["turns_to_death"] = {
+            "mean": round(float(turns.mean()), 2),
+            **{f"p{q}": int(np.percentile(turns, q)) for q in (10, 50, 90)},
+            "min": int(turns.min()),
+            "max": int(turns.max()),
+        }
+    every = max(1, result.max_turns // curve_points)
+    summary["survival"] = {str(t): round(int(result.alive[t]) / runs, 4) for t in range(0, result.max_turns + 1, every)}
+    total_visits = max(int(result.visits.sum()), 1)
+    summary["visits"] = {
+        location_id: round(int(count) / total_visits, 4)
+        for location_id, count in sorted(zip(tables.location_ids, result.visits), key=lambda pair: -pair[1])
+    }
+    summary["final_flags"] = {name: round(int(count) / runs, 4) for name, count in zip(tables.flag_names, result.final_flags)}
+    summary["final_items"] = {name: round(int(count) / runs, 4) for name, count in zip(tables.item_names, result.final_items)}
+    return summary
+
+
+# --- Consistency check against the real game logic ---
+
+def check_against_game(tables: StoryTables, policy: Policy, paths: int, max_turns: int,
+                       invalid_rate: float = 0.1, seed: int = 0) -> List[str]:
+    """
+    Samples `paths` games with the simulator and replays each choice through the real
+    handle_user_choice node, comparing location, health, plot flags, inventory and game over
+    after every turn. Uses the game's current mechanics and story. Returns the mismatches
+    (empty when the two agree).
+
+    Invalid input goes through the choice interpreter's LLM tier like in play, so the node's
+    chat model is swapped for an instant FakeChatModel first.
+    """
+    from src import agent
+    from src.fake_llm import FakeChatModel
+    from src.state import GameState, Player, to_graph_input
+
+    agent.set_llm(FakeChatModel(latency_ms=0.0, latency_sigma=0.0, response_words=5))
+    mechanics = default_mechanics()
+    rng = np.random.default_rng(seed)
+    story = get_story()
+    batch = Batch(
+        location=np.full(paths, tables.start, dtype=np.int32),
+        health=np.full(paths, mechanics.start_health, dtype=np.int32),
+        flags=np.zeros(paths, dtype=np.uint64),
+        items=np.zeros(paths, dtype=np.uint64),
+    )
+    # Sample every path's choices and states up front: history[t] = (choice, state after turn t)
+    history: List[Tuple[np.ndarray, Batch]] = []
+    for turn in range(max_turns):
+        choice = policy(tables, batch.location, batch.health, turn, rng)
+        choice = np.where(rng.random(paths) < invalid_rate, NO_CHOICE, choice)
+        batch = step(tables, mechanics, batch, choice)
+        history.append((choice, batch))
+
+    def names(bits: int, all_names: Sequence[str]) -> List[str]:
+        return sorted(name for i, name in enumerate(all_names) if bits >> i & 1)
+
+    mismatches: List[str] = []
+    for path in range(paths):
+        location_id = tables.location_ids[tables.start]
+        state = GameState(player=Player(current_location_id=location_id, current_location_name=story.location_name(location_id)))
+        for turn, (choice, expected) in enumerate(history):
+            c = int(choice[path])
+            labels = tables.labels[tables.location_ids.index(state.player.current_location_id)]
+            state.available_choices = list(labels)
+            state.user_input = labels[c] if 0 <= c < len(labels) else INVALID_INPUT
+            update = agent.handle_user_choice(to_graph_input(state))
+            state = state.model_copy(update={
+                "player": update["player"],
+                "plot_flags": {**state.plot_flags, **update["plot_flags"]},
+                "game_over": update.get("game_over", False),
+            })
+
+            got = (
+                state.player.current_location_id, state.player.health,
+                sorted(name for name, value in state.plot_flags.items() if value),
+                sorted(set(state.player.inventory)), state.game_over,
+            )
+            want = (
+                tables.location_ids[expected.location[path]], int(expected.health[path]),
+                names(int(expected.flags[path]), tables.flag_names),
+                names(int(expected.items[path]), tables.item_names), bool(expected.health[path] <= 0),
+            )
+            if got != want:
+                mismatches.append(f"path {path}, turn {turn + 1} ({state.user_input!r}): game {got} != simulator {want}")
+                break
+            if state.game_over:
+                break
+    return mismatches
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Monte Carlo simulation of the game's health mechanics.")
+    parser.add_argument("--runs", type=int, default=1_000_000, help="Games to simulate.")
+    parser.add_argument("--max-turns", type=int, default=100, help="Games still going after this many turns count as survivors.")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random", help="How simulated players choose.")
+    parser.add_argument("--script", nargs="+", help="Choice labels for the scripted policy, in order.")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Share of turns with input that matches no choice.")
+    parser.add_argument("--drain", type=int, help="Health lost per turn (default: HEALTH_DECREASE_PER_TURN).")
+    parser.add_argument("--start-health", type=int, help="Starting health (default: Player.health).")
+    parser.add_argument("--story", help="Story file to simulate (default: the game's story).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", type=int, metavar="PATHS", help="Instead of simulating, replay this many sampled paths through handle_user_choice and compare.")
+    parser.add_argument("--output", help="Also write the JSON report (with the full survival curve) here.")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    story = load_story(args.story) if args.story else get_story()
+    tables = build_tables(story)
+    policy = POLICIES[args.policy](args.script)
+
+    if args.check:
+        if args.story or args.drain is not None or args.start_health is not None:
+            parser.error("--check compares against the game as configured; drop --story, --drain and --start-health.")
+        mismatches = check_against_game(tables, policy, args.check, args.max_turns, invalid_rate=args.invalid_rate or 0.1, seed=args.seed)
+        print(json.dumps({"paths": args.check, "mismatches": len(mismatches), "examples": mismatches[:10]}, indent=2))
+        return 1 if mismatches else 0
+
+    defaults = default_mechanics()
+    mechanics = Mechanics(
+        start_health=args.start_health if args.start_health is not None else defaults.start_health,
+        drain=args.drain if args.drain is not None else defaults.drain,
+    )
+    result = simulate(tables, policy, args.runs, args.max_turns, mechanics, invalid_rate=args.invalid_rate, seed=args.seed)
+    report = {"policy": args.policy, "mechanics": mechanics._asdict(), **summarize(tables, result)}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        report["survival_curve"] = [round(int(a) / max(result.runs, 1), 6) for a in result.alive]
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional, Tuple
+
+from src.state import GameState, SYSTEM
+from src.scheduler import BACKGROUND, promote_session, request_class
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Upper bound on speculative turns (and so speculative LLM calls) running at the same time.
+# Set to 0 to turn speculation off entirely.
+SPECULATION_MAX_CONCURRENT = int(os.getenv("SPECULATION_MAX_CONCURRENT", "3"))
+# How many (state, choice) results we keep around before evicting the oldest.
+SPECULATION_MAX_ENTRIES = int(os.getenv("SPECULATION_MAX_ENTRIES", "64"))
+# Transcript segments hashed into the fingerprint; more than the scene prompt's verbatim context uses.
+FINGERPRINT_SEGMENTS = 8
+
+
+def state_fingerprint(state: GameState) -> str:
+    """
+    Identifies the state a choice is made from. `user_input` is excluded since the UI sets it on
+    click. Of the append-only transcript only its length and newest segments are hashed, so the
+    cost doesn't grow with the length of the story.
+    """
+    digest = hashlib.sha1(state.model_dump_json(exclude={"user_input", "segments"}).encode("utf-8"))
+    digest.update(str(len(state.segments)).encode("utf-8"))
+    for segment in state.segments[-FINGERPRINT_SEGMENTS:]:
+        digest.update(b"\x00" + segment.text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SpeculativeTurnError(RuntimeError):
+    """A speculative turn ended in an error notice; it is never served in place of a real turn."""
+
+
+def _session(key: Tuple[str, str]) -> str:
+    """Fair-queuing key of one speculative turn's LLM requests (see src/scheduler.py)."""
+    return f"speculation:{key[0][:12]}:{key[1]}"
+
+
+class SpeculativeTurnCache:
+    """
+    Pre-computes the next turn for every available choice while the player is still reading.
+
+    `prefetch` starts one background turn per choice; `take` hands back the finished (or still
+    running) turn for the choice that was actually clicked and cancels its siblings.
+    Results are keyed by (state fingerprint, choice), so a result is only ever reused for
+    exactly the state it was computed from.
+    """
+
+    def __init__(
+        self,
+        run_turn: Callable[[GameState], GameState],
+        max_concurrent: int = SPECULATION_MAX_CONCURRENT,
+        max_entries: int = SPECULATION_MAX_ENTRIES,
+    ):
+        self.run_turn = run_turn
+        self.enabled = max_concurrent > 0
+        self.max_entries = max_entries
+        # The pool size is the cap on concurrent speculative turns; extra work simply queues.
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent), thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Future]" = OrderedDict()
+        self.stats: Dict[str, int] = {"started": 0, "hits": 0, "misses": 0, "cancelled": 0, "discarded": 0, "failed": 0}
+
+    def _run(self, state: GameState, choice: str, session: str) -> GameState:
+        # Nobody is waiting yet, so its LLM calls queue behind players' (until `take` promotes them)
+        with request_class(BACKGROUND, session):
+            # The graph leaves its input untouched, so a shallow copy with the choice set is enough
+            result = self.run_turn(state.model_copy(update={"user_input": choice}))
+        # Nodes report errors as a system notice without ending the game (e.g. "An error occurred
+        # while generating the scene"); the player's own turn may well succeed, so run that instead
+        if not result.game_over and any(segment.kind == SYSTEM for segment in result.segments_after(state.last_segment_id)):
+            raise SpeculativeTurnError(f"The turn ended in an error: {result.segments[-1].text}")
+        return result
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        # Must be called with the lock held
+        future = self._entries.pop(key, None)
+        if future is None:
+            return
+        if future.cancel():
+            self.stats["cancelled"] += 1
+        else:
+            self.stats["discarded"] += 1 # Already running or done; its result is just thrown away
+
+    def prefetch(self, state: GameState) -> None:
+        """Starts speculative turns for each of the state's available choices."""
+        if not self.enabled or state.game_over or not state.available_choices:
+            return
+        fingerprint = state_fingerprint(state)
+        snapshot = state.copy_for_turn()
+        with self._lock:
+            for choice in snapshot.available_choices:
+                key = (fingerprint, choice)
+                if key in self._entries:
+                    continue
+                self._entries[key] = self._executor.submit(self._run, snapshot, choice, _session(key))
+                self.stats["started"] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def take(self, state: GameState, choice: str, timeout: Optional[float] = None) -> Optional[GameState]:
+        """
+        Returns the speculated next state for `choice`, or None if there is none (the caller then
+        runs the turn normally). A turn that is still running is waited on, since it is already
+        further along than a fresh one would be. Sibling branches for the same state are dropped.
+        """
+        if not self.enabled:
+            return None
+        fingerprint = state_fingerprint(state)
+        with self._lock:
+            future = self._entries.pop((fingerprint, choice), None)
+            for key in [k for k in self._entries if k[0] == fingerprint]:
+                self._drop(key)
+            if future is None:
+                self.stats["misses"] += 1
+                return None
+
+        if not future.done():
+            promote_session(_session((fingerprint, choice))) # A player is waiting on it now
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            result = None
+        except Exception as e:
+            logger.warning("Speculative turn for %r failed: %s", choice, e)
+            result = None
+            with self._lock:
+                self.stats["failed"] += 1
+
+        with self._lock:
+            self.stats["hits" if result is not None else "misses"] += 1
+        return result
+
+    def discard(self, state: GameState) -> None:
+        """Drops every speculation made from `state` (e.g. when the game is restarted)."""
+        fingerprint = state_fingerprint(state)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == fingerprint]:
+                self._drop(key)
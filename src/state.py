@@ -1,5 +1,16 @@
-from typing import List, Dict, Optional
-from pydantic import BaseModel 
+from bisect import bisect_left
+from typing import Any, List, Dict, Literal, Optional, Tuple
+from typing_extensions import Annotated, TypedDict
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from src.story import Transition
+
+# Kinds of transcript segments
+SCENE = "scene" # Narrative generated by describe_scene
+OUTCOME = "outcome" # What came of the player's choice (handle_user_choice)
+SYSTEM = "system" # Notices that aren't part of the story (errors, game over)
+
+SEGMENT_SEPARATOR = "\n\n"
 
 class Player(BaseModel):
     name: str = "Adventurer"
@@ -9,11 +20,147 @@ class Player(BaseModel):
     current_location_name: str = "" # Human-readable name, updated by agent
     # Add more player stats if needed (e.g., strength, charisma, gold)
 
+class StorySegment(BaseModel):
+    """One immutable piece of the transcript. Segments are only ever appended, never edited."""
+    model_config = ConfigDict(frozen=True)
+
+    id: int # Position in the transcript; stable, so clients can ask for "everything after id N"
+    kind: Literal["scene", "outcome", "system"]
+    text: str
+    scene: int # Index of the scene this segment belongs to (-1 before the first scene)
+
 class GameState(BaseModel):
     player: Player = Player()
-    current_story_text: str = "" # The narrative text generated by Gemini
+    segments: List[StorySegment] = [] # Append-only transcript: scenes, choice outcomes and system notices
+    story_summary: str = "" # Rolling summary of scenes that left the verbatim context window
+    summarized_scene_count: int = 0 # How many scenes story_summary already covers
     available_choices: List[str] = [] # Options presented to the user
+    # Choices a structured scene made up (normalized label -> proposed transition); their effects
+    # are checked against the game rules when taken (see src/structured_scene.py)
+    generated_choices: Dict[str, Transition] = {}
     user_input: str = "" # The raw input from the user (e.g., button text)
     plot_flags: Dict[str, bool] = {} # A dictionary for tracking story progression flags (e.g., {"dragon_defeated": False})
     game_over: bool = False # Flag to indicate if the game has ended
-    # Add any other global game state variables here
\ No newline at end of file
+    # Add any other global game state variables here.
+
+    # (segment count, joined text): the full transcript is only built when something displays it
+    _story_text_cache: Optional[tuple] = PrivateAttr(default=None)
+
+    # --- Transcript ---
+
+    def new_segments(self, *entries: Tuple[str, str]) -> List[StorySegment]:
+        """The segments that appending `entries` ((kind, text) pairs) would create, without appending them."""
+        segments = []
+        next_id = len(self.segments)
+        scene_count = self.scene_count
+        for kind, text in entries:
+            if kind == SCENE:
+                scene_count += 1
+            segments.append(StorySegment(id=next_id, kind=kind, text=text.strip(), scene=scene_count - 1))
+            next_id += 1
+        return segments
+
+    def add_segment(self, kind: str, text: str) -> StorySegment:
+        """Appends a segment to the transcript (in place; nothing already stored is copied)."""
+        segment = self.new_segments((kind, text))[0]
+        self.segments.append(segment)
+        return segment
+
+    @property
+    def scene_count(self) -> int:
+        """Number of scenes generated so far."""
+        return self.segments[-1].scene + 1 if self.segments else 0
+
+    @property
+    def last_segment_id(self) -> int:
+        """Id of the newest segment, or -1 for an empty transcript."""
+        return self.segments[-1].id if self.segments else -1
+
+    def segments_after(self, segment_id: int) -> List[StorySegment]:
+        """The segments appended after `segment_id` (ids are positions, so this is a slice)."""
+        return self.segments[max(0, segment_id + 1):]
+
+    def scene_texts(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """
+        Text of scenes `start` to `end` (exclusive), each with the outcomes of the choice made
+        in it. Only the segments of those scenes are visited, so the recent tail is cheap.
+        """
+        end = self.scene_count if end is None else end
+        first = bisect_left(self.segments, start, key=lambda segment: segment.scene)
+        texts: Dict[int, List[str]] = {}
+        for segment in self.segments[first:]:
+            if segment.scene >= end:
+                break
+            if segment.kind != SYSTEM:
+                texts.setdefault(segment.scene, []).append(segment.text)
+        return ["\n".join(texts.get(scene, [])) for scene in range(start, end)]
+
+    @property
+    def current_story_text(self) -> str:
+        """The whole transcript as one markdown string, built on demand (and cached until it grows)."""
+        cached = self._story_text_cache
+        if cached is not None and cached[0] == len(self.segments):
+            return cached[1]
+        text = SEGMENT_SEPARATOR.join(segment.text for segment in self.segments)
+        self._story_text_cache = (len(self.segments), text)
+        return text
+
+    def copy_for_turn(self) -> "GameState":
+        """
+        A copy that a turn can modify without touching this state. Segments are immutable, so
+        the transcript list is copied shallowly instead of duplicating every segment.
+        """
+        return self.model_copy(update={
+            "player": self.player.model_copy(deep=True),
+            "segments": list(self.segments),
+            "available_choices": list(self.available_choices),
+            "plot_flags": dict(self.plot_flags),
+        })
+
+
+# --- Graph state ---
+# Inside the LangGraph graph the state is a plain dict. Nodes return only the fields they change,
+# and LangGraph folds those updates in with the reducers declared here, so a turn never rebuilds
+# (or revalidates) the whole GameState. Conversion happens once at each end of the graph run.
+
+def append_segments(current: List[StorySegment], new: List[StorySegment]) -> List[StorySegment]:
+    """Reducer for `segments`: appends in place. The graph owns this list (see `to_graph_input`)."""
+    current.extend(new)
+    return current
+
+def merge_flags(current: Dict[str, bool], new: Dict[str, bool]) -> Dict[str, bool]:
+    """Reducer for `plot_flags`: a node's flags are added to (or override) the existing ones."""
+    return {**current, **new} if new else current
+
+class GameGraphState(TypedDict, total=False):
+    # Same fields as GameState; keep the two in sync.
+    player: Player
+    segments: Annotated[List[StorySegment], append_segments]
+    story_summary: str
+    summarized_scene_count: int
+    available_choices: List[str]
+    generated_choices: Dict[str, Transition]
+    user_input: str
+    plot_flags: Annotated[Dict[str, bool], merge_flags]
+    game_over: bool
+
+def to_graph_input(state: GameState) -> Dict[str, Any]:
+    """
+    The graph's input for a GameState. Field values are shared, not copied, except the transcript
+    list, which the segment reducer appends to; so running the graph never modifies `state`.
+    """
+    values = {name: getattr(state, name) for name in GameState.model_fields}
+    values["segments"] = list(state.segments)
+    return values
+
+def as_game_state(values: Dict[str, Any]) -> GameState:
+    """
+    A typed GameState over graph values, without revalidating them: each value either came
+    from a validated GameState or was validated by `validate_update` when a node returned it.
+    """
+    return GameState.model_construct(**values)
+
+def validate_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """Validates just the fields a node changed (model instances it built are taken as they are)."""
+    validated = GameState.model_validate(update)
+    return {name: getattr(validated, name) for name in update}
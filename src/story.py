@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+STORY_PATH = os.getenv("STORY_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "story.json"))
+# When enabled, the story file's modification time is checked (at most once per interval) and a
+# changed file is recompiled and swapped in without restarting the app.
+STORY_HOT_RELOAD = os.getenv("STORY_HOT_RELOAD", "0") == "1"
+STORY_RELOAD_CHECK_SECONDS = 1.0
+
+
+# --- Story definition format (what data/story.json contains) ---
+
+class EffectsDefinition(BaseModel):
+    health: int = 0 # Added to the player's health (negative values hurt)
+    flags: Dict[str, bool] = {} # Plot flags to set
+    add_items: List[str] = []
+    remove_items: List[str] = []
+
+class ChoiceDefinition(BaseModel):
+    label: str # Button text shown to the player
+    next: Optional[str] = None # Location to move to; None means stay where you are
+    text: str = "" # Outcome narration appended to the story
+    effects: EffectsDefinition = EffectsDefinition()
+
+class LocationDefinition(BaseModel):
+    name: str
+    choices: List[ChoiceDefinition] = [] # Empty means "use the default choices"
+
+class DefaultsDefinition(BaseModel):
+    name: str = "An Unknown Place"
+    choices: List[ChoiceDefinition] = []
+
+class StoryDefinition(BaseModel):
+    start_location: str
+    defaults: DefaultsDefinition = DefaultsDefinition()
+    locations: Dict[str, LocationDefinition]
+
+
+class StoryValidationError(ValueError):
+    """Raised when a story definition can't be compiled (e.g. a choice leads to an undefined location)."""
+
+
+# --- Compiled form used at runtime ---
+
+class Transition(NamedTuple):
+    label: str
+    next_location: Optional[str]
+    text: str
+    health: int
+    flags: Tuple[Tuple[str, bool], ...]
+    add_items: Tuple[str, ...]
+    remove_items: Tuple[str, ...]
+
+class CompiledLocation(NamedTuple):
+    location_id: str
+    name: str
+    choices: Tuple[str, ...]
+    transitions: Dict[str, Transition] # normalized choice label -> transition
+
+
+def normalize_choice(choice: str) -> str:
+    return choice.strip().lower()
+
+
+def _compile_choices(choices: List[ChoiceDefinition]) -> Tuple[Tuple[str, ...], Dict[str, Transition]]:
+    transitions: Dict[str, Transition] = {}
+    for choice in choices:
+        key = normalize_choice(choice.label)
+        if key in transitions:
+            raise StoryValidationError(f"Duplicate choice '{choice.label}'.")
+        transitions[key] = Transition(
+            label=choice.label,
+            next_location=choice.next,
+            text=choice.text,
+            health=choice.effects.health,
+            flags=tuple(choice.effects.flags.items()),
+            add_items=tuple(choice.effects.add_items),
+            remove_items=tuple(choice.effects.remove_items),
+        )
+    return tuple(c.label for c in choices), transitions
+
+
+class CompiledStory:
+    """
+    Immutable, indexed form of a story definition. Every lookup the game loop needs per turn
+    (choices, names, and (location, choice) -> transition) is a dict lookup, regardless of
+    how many locations the world has.
+    """
+
+    def __init__(self, definition: StoryDefinition, source: str = "<memory>"):
+        self.definition = definition
+        self.source = source
+        # Identifies this exact world, e.g. so data generated from it (src/scene_store.py) isn't used with another
+        self.digest = hashlib.sha1(definition.model_dump_json().encode("utf-8")).hexdigest()
+        self.start_location = definition.start_location
+        self.default_name = definition.defaults.name
+        default_choices, default_transitions = _compile_choices(definition.defaults.choices)
+        self.default_location = CompiledLocation("", self.default_name, default_choices, default_transitions)
+
+        self.locations: Dict[str, CompiledLocation] = {}
+        for location_id, location in definition.locations.items():
+            try:
+                choices, transitions = _compile_choices(location.choices)
+            except StoryValidationError as e:
+                raise StoryValidationError(f"Location '{location_id}': {e}") from None
+            if not choices:
+                # Locations without authored choices share the default ones
+                choices, transitions = default_choices, default_transitions
+            self.locations[location_id] = CompiledLocation(location_id, location.name, choices, transitions)
+
+        # Every plot flag and item the story's own transitions use
+        transitions = [t for location in [self.default_location, *self.locations.values()] for t in location.transitions.values()]
+        self.flag_names = frozenset(name for t in transitions for name, _ in t.flags)
+        self.item_names = frozenset(item for t in transitions for item in (*t.add_items, *t.remove_items))
+
+        self.warnings = self._validate()
+
+    def _validate(self) -> List[str]:
+        """Raises on dangling references; returns warnings (e.g. unreachable locations)."""
+        if self.start_location not in self.locations:
+            raise StoryValidationError(f"Start location '{self.start_location}' is not defined.")
+
+        for location in [self.default_location, *self.locations.values()]:
+            for transition in location.transitions.values():
+                if transition.next_location is not None and transition.next_location not in self.locations:
+                    where = location.location_id or "defaults"
+                    raise StoryValidationError(
+                        f"Choice '{transition.label}' in '{where}' leads to undefined location '{transition.next_location}'."
+                    )
+
+        # Breadth-first search from the start to find locations no player can ever reach
+        reachable = {self.start_location}
+        queue = deque([self.start_location])
+        while queue:
+            for transition in self.locations[queue.popleft()].transitions.values():
+                target = transition.next_location
+                if target is not None and target not in reachable:
+                    reachable.add(target)
+                    queue.append(target)
+        return [f"Location '{location_id}' is unreachable from '{self.start_location}'."
+                for location_id in self.locations if location_id not in reachable]
+
+    # --- Lookups ---
+
+    def location(self, location_id: str) -> CompiledLocation:
+        return self.locations.get(location_id, self.default_location)
+
+    def location_name(self, location_id: str) -> str:
+        return self.location(location_id).name
+
+    def choices(self, location_id: str) -> Tuple[str, ...]:
+        return self.location(location_id).choices
+
+    def authored_choices(self, location_id: str) -> Tuple[str, ...]:
+        """The choices the story writes for a location itself; empty where it falls back to the default ones."""
+        location = self.locations.get(location_id)
+        if location is None or location.transitions is self.default_location.transitions:
+            return ()
+        return location.choices
+
+    def transition(self, location_id: str, choice: str) -> Optional[Transition]:
+        """The transition for a choice made at a location, or None if the location doesn't offer it."""
+        return self.location(location_id).transitions.get(normalize_choice(choice))
+
+
+def load_story(path: str = STORY_PATH) -> CompiledStory:
+    """Reads, validates and compiles a story definition file."""
+    with open(path, "r", encoding="utf-8") as f:
+        definition = StoryDefinition(**json.load(f))
+    story = CompiledStory(definition, source=path)
+    for warning in story.warnings:
+        logger.warning("Story warning (%s): %s", path, warning)
+    return story
+
+
+# --- Process-wide story with atomic hot reload ---
+
+_story: Optional[CompiledStory] = None
+_story_mtime = 0.0
+_last_reload_check = 0.0
+_reload_lock = threading.Lock()
+
+def reload_story(path: str = STORY_PATH) -> CompiledStory:
+    """
+    Compiles the story file and swaps it in. The new story is fully built and validated before
+    the swap, so a turn sees either the old or the new world, never a mix. On error the
+    current story stays active.
+    """
+    global _story, _story_mtime
+    with _reload_lock:
+        mtime = os.path.getmtime(path)
+        story = load_story(path)
+        _story, _story_mtime = story, mtime # Single reference swap
+    return story
+
+def get_story() -> CompiledStory:
+    """The active compiled story, loaded on first use."""
+    global _last_reload_check
+    story = _story
+    if story is None:
+        return reload_story()
+    if STORY_HOT_RELOAD:
+        now = time.monotonic()
+        if now - _last_reload_check >= STORY_RELOAD_CHECK_SECONDS:
+            _last_reload_check = now
+            try:
+                if os.path.getmtime(story.source) != _story_mtime:
+                    story = reload_story(story.source)
+            except (OSError, ValueError) as e:
+                logger.error("Story reload failed, keeping the current story: %s", e)
+    return story
@@ -0,0 +1,272 @@
+"""
+Structured scene output: one LLM call returns the narrative, the choices and what each choice
+does, as a JSON object validated against `StructuredScene`:
+
+    {"narrative": "...",
+     "choices": [{"label": "Search the reeds", "text": "You find ...",
+                  "effects": {"health": -5, "add_items": ["Reed Flute"], "remove_items": [], "flags": {}}}]}
+
+While the response streams, `NarrativeStreamParser` decodes the narrative string out of the
+partial JSON, so the player reads the scene as it is written; the choices are only taken once
+the object is complete. Made-up choices never move the player, and their effects are proposals:
+`check_effects` holds them to the game rules when the player takes one (handle_user_choice).
+"""
+import os
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from src.story import CompiledStory, EffectsDefinition, Transition, normalize_choice
+from src.telemetry import tracer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration (the game rules for generated choices) ---
+MAX_GENERATED_CHOICES = int(os.getenv("MAX_GENERATED_CHOICES", "3")) # Offered next to the story's own choices
+MAX_CHOICE_LABEL_CHARS = 80
+GENERATED_HEALTH_MIN = -15 # A made-up choice can hurt, but not end the game on its own (see check_effects)
+GENERATED_HEALTH_MAX = 10
+MAX_ITEMS_GAINED = 1 # Per choice
+MAX_ITEM_NAME_CHARS = 40
+MAX_FLAGS_SET = 2 # Per choice
+FLAG_NAME = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+
+
+class SceneFormatError(ValueError):
+    """Raised when a structured scene response isn't a valid scene object."""
+
+
+# --- Schema ---
+
+class SceneChoice(BaseModel):
+    label: str # Button text
+    text: str = "" # Outcome narration when the choice is taken
+    effects: EffectsDefinition = EffectsDefinition() # Same shape as the effects in data/story.json
+
+class StructuredScene(BaseModel):
+    narrative: str
+    choices: List[SceneChoice] = []
+
+
+def _json_object(text: str) -> str:
+    # Models sometimes wrap the object in a ```json fence or a sentence; keep the outermost braces
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise SceneFormatError("The scene response contains no JSON object.")
+    return text[start:end + 1]
+
+def parse_scene(text: str) -> StructuredScene:
+    """Parses and validates a complete structured scene response."""
+    try:
+        scene = StructuredScene.model_validate(json.loads(_json_object(text)))
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise SceneFormatError(f"Invalid structured scene: {e}") from None
+    if not scene.narrative.strip():
+        raise SceneFormatError("The structured scene has an empty narrative.")
+    return scene
+
+
+# --- Streaming ---
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class NarrativeStreamParser:
+    """
+    Incrementally extracts the top-level "narrative" string from a JSON object arriving in
+    chunks. `feed(chunk)` returns the narrative text decoded from that chunk (possibly empty);
+    escapes split across chunks are held back until complete. Everything else is skipped.
+    """
+
+    def __init__(self):
+        self.narrative = "" # Decoded so far
+        self.done = False # The closing quote of the narrative was seen
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._token = [] # Characters of the top-level string being read (a candidate key)
+        self._last_key: Optional[str] = None
+        self._awaiting_value = False # Just read `"narrative":`
+        self._in_narrative = False
+        self._pending = "" # An incomplete escape sequence inside the narrative
+
+    def feed(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        out: List[str] = []
+        for char in chunk:
+            if self._in_narrative:
+                if self._pending or char == "\\":
+                    self._pending += char
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        out.append(decoded)
+                elif char == '"':
+                    self._in_narrative = False
+                    self.done = True
+                    break
+                else:
+                    out.append(char)
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = "".join(self._token)
+                    continue
+                if self._depth == 1:
+                    self._token.append(char)
+            elif char == '"':
+                if self._awaiting_value:
+                    self._awaiting_value = False
+                    self._in_narrative = True
+                else:
+                    self._in_string = True
+                    self._token = []
+            elif char in "{[":
+                self._depth += 1
+                self._awaiting_value = False
+            elif char in "}]":
+                self._depth -= 1
+            elif char == ":" and self._depth == 1:
+                self._awaiting_value = self._last_key == "narrative"
+            elif char == ",":
+                self._last_key = None
+                self._awaiting_value = False
+        text = "".join(out)
+        self.narrative += text
+        return text
+
+    def _decode_escape(self) -> Optional[str]:
+        pending = self._pending
+        if len(pending) < 2:
+            return None
+        if pending[1] != "u":
+            self._pending = ""
+            return _ESCAPES.get(pending[1], pending[1])
+        if len(pending) < 6:
+            return None
+        code = int(pending[2:6], 16) if all(c in "0123456789abcdefABCDEF" for c in pending[2:6]) else ord("?")
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate: wait for the low half (\uDC00-\uDFFF) that must follow
+            if len(pending) < 12:
+                return None
+            low = int(pending[8:12], 16) if pending[6:8] == "\\u" else 0
+            self._pending = ""
+            if 0xDC00 <= low < 0xE000:
+                return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+            return "�"
+        self._pending = ""
+        return chr(code)
+
+
+def salvage_narrative(text: str) -> str:
+    """The narrative of a response that isn't a valid scene object (e.g. cut off), or the text itself if it isn't JSON."""
+    if "{" not in text:
+        return text.strip()
+    parser = NarrativeStreamParser()
+    parser.feed(text)
+    return parser.narrative.strip()
+
+
+# --- Choices ---
+
+def offered_choices(story: CompiledStory, location_id: str, scene: StructuredScene) -> Tuple[List[str], Dict[str, Transition]]:
+    """
+    The story's own choices for the location followed by up to MAX_GENERATED_CHOICES made-up
+    ones, and the proposed transitions of the latter (by normalized label). Where the story
+    has no choices of its own, made-up ones replace the default choices; if none are usable
+    the defaults stay.
+    """
+    authored = list(story.authored_choices(location_id))
+    taken = {normalize_choice(label) for label in authored}
+    generated: Dict[str, Transition] = {}
+    for choice in scene.choices:
+        label = " ".join(choice.label.split())
+        key = normalize_choice(label)
+        if not label or len(label) > MAX_CHOICE_LABEL_CHARS or key in taken:
+            continue
+        taken.add(key)
+        effects = choice.effects
+        generated[key] = Transition(
+            label=label,
+            next_location=None, # Made-up choices never move the player; only the story connects places
+            text=choice.text.strip(),
+            health=effects.health,
+            flags=tuple(effects.flags.items()),
+            add_items=tuple(effects.add_items),
+            remove_items=tuple(effects.remove_items),
+        )
+        if len(generated) >= MAX_GENERATED_CHOICES:
+            break
+    choices = authored + [t.label for t in generated.values()]
+    if not choices:
+        return list(story.choices(location_id)), {}
+    return choices, generated
+
+
+# --- Game rules ---
+
+def check_effects(transition: Transition, health: int, inventory: List[str], story: CompiledStory) -> Transition:
+    """
+    Holds a made-up choice's proposed effects to the game rules before they apply: health
+    changes are bounded and can't take the player's `health` (after the turn's drain) below 1,
+    the story's own items and plot flags can only be gained or lost through the story, only
+    carried items can be lost, and a choice gains at most MAX_ITEMS_GAINED items and sets at
+    most MAX_FLAGS_SET flags. What breaks a rule is dropped
+    (or clamped) and counted in generated_effects_rejected_total{rule}.
+    """
+    rejected: List[str] = []
+
+    # If the drain alone ends the game, a made-up choice can't make that any worse
+    floor = min(max(GENERATED_HEALTH_MIN, 1 - health), 0)
+    health_change = min(max(transition.health, floor), GENERATED_HEALTH_MAX)
+    if health_change != transition.health:
+        rejected.append("health_range")
+
+    add_items: List[str] = []
+    for item in transition.add_items:
+        item = " ".join(item.split())
+        if item in story.item_names:
+            rejected.append("story_item")
+        elif not item or len(item) > MAX_ITEM_NAME_CHARS:
+            rejected.append("item_name")
+        elif item in inventory or item in add_items:
+            continue # Already carried; nothing to gain
+        elif len(add_items) >= MAX_ITEMS_GAINED:
+            rejected.append("items_gained")
+        else:
+            add_items.append(item)
+
+    remove_items: List[str] = []
+    for item in transition.remove_items:
+        if item in story.item_names:
+            rejected.append("story_item")
+        elif item not in inventory:
+            rejected.append("item_not_carried")
+        else:
+            remove_items.append(item)
+
+    flags: List[Tuple[str, bool]] = []
+    for name, value in transition.flags:
+        if name in story.flag_names:
+            rejected.append("story_flag")
+        elif not FLAG_NAME.match(name):
+            rejected.append("flag_name")
+        elif len(flags) >= MAX_FLAGS_SET:
+            rejected.append("flags_set")
+        else:
+            flags.append((name, bool(value)))
+
+    for rule in rejected:
+        tracer.metrics.inc("generated_effects_rejected_total", (rule,))
+    if rejected:
+        logger.info("Effects of generated choice %r broke game rules: %s", transition.label, ", ".join(sorted(set(rejected))))
+    return transition._replace(
+        next_location=None, health=health_change, add_items=tuple(add_items), remove_items=tuple(remove_items), flags=tuple(flags)
+    )
@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pydantic_core
+
+# --- Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Share of turns whose spans are exported (and whose state size is measured). Metrics cover every turn.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# OpenTelemetry-style JSON spans, one per line. Empty disables span export.
+TRACE_SPANS_PATH = os.getenv("TRACE_SPANS_PATH", "")
+SERVICE_NAME = "whispering-wilds"
+
+# Histogram buckets in seconds, from a local node (sub-millisecond) to a slow scene generation
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    """Sets up root logging for the app and server entry points (library modules only get loggers)."""
+    logging.basicConfig(level=level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+# --- Metrics ---
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by label values, rendered in the Prometheus text format.
+    Thread-safe; kept dependency-free so it can run on the hot path of every node.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help text, label names)
+        self._meta: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {}
+        self._counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        # (name, label values) -> [bucket counts..., sum, count]
+        self._histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self._meta[name] = ("counter", help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._meta[name] = ("histogram", help_text, labels)
+        self._buckets[name] = buckets
+
+    def inc(self, name: str, labels: Tuple[str, ...] = (), value: float = 1.0) -> None:
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Tuple[str, ...], value: float) -> None:
+        buckets = self._buckets[name]
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0.0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def series(self, name: str) -> Dict[Tuple[str, ...], List[float]]:
+        """Histogram series of one metric: label values -> [bucket counts..., sum, count]."""
+        with self._lock:
+            return {labels: list(values) for (metric, labels), values in self._histograms.items() if metric == name}
+
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """The registry in the Prometheus text exposition format (for a /metrics endpoint)."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names) in sorted(self._meta.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, values), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{self._labels(label_names, values)} {value:g}")
+                    continue
+                buckets = self._buckets[name]
+                for (metric, values), series in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(buckets, series):
+                        le = 'le="%g"' % bound
+                        lines.append(f"{name}_bucket{self._labels(label_names, values, le)} {count:g}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{self._labels(label_names, values, le)} {series[-1]:g}")
+                    lines.append(f"{name}_sum{self._labels(label_names, values)} {series[-2]:.6f}")
+                    lines.append(f"{name}_count{self._labels(label_names, values)} {series[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Spans ---
+
+class Span:
+    """One timed unit of work: a turn, a graph node or an LLM call."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled", "start", "start_ns",
+                 "end_ns", "attributes", "llm_seconds", "error")
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"], sampled: bool):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = {}
+        self.llm_seconds = 0.0 # Time spent inside LLM calls made while this span was current
+        self.error: Optional[str] = None
+
+    def to_otel(self) -> Dict[str, Any]:
+        """The span as an OpenTelemetry-style JSON object (OTLP field names)."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_CLIENT" if self.kind == "llm" else "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_OK"},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class LLMCall:
+    """What one LLM request cost; filled in by `Tracer.llm_call` and, for the cache outcome, by the response cache."""
+
+    __slots__ = ("kind", "started", "queue_seconds", "attempts", "cache", "response")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.queue_seconds = 0.0
+        self.attempts = 0 # Requests sent for this call: retries and hedges included (see src/resilience.py)
+        self.cache = "none" # "memory_hit", "disk_hit" or "miss" once a cache has been consulted
+        self.response = None
+
+    def slot_acquired(self) -> None:
+        """Marks the end of the wait for a concurrency slot (the first request's, if there are several)."""
+        if self.attempts == 0:
+            self.queue_seconds = time.perf_counter() - self.started
+        self.attempts += 1
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("telemetry_span", default=None)
+_current_llm_call: contextvars.ContextVar = contextvars.ContextVar("telemetry_llm_call", default=None)
+
+
+def record_cache_outcome(outcome: str) -> None:
+    """Called by the response cache during a lookup, so the enclosing LLM call knows if it was served from cache."""
+    call = _current_llm_call.get()
+    if call is not None:
+        call.cache = outcome
+
+
+def _update_bytes(update: Any) -> Optional[int]:
+    # Nodes return partial state updates (dicts that may hold Pydantic models)
+    try:
+        return len(pydantic_core.to_json(update))
+    except pydantic_core.PydanticSerializationError:
+        return None
+
+
+class JsonlWriter:
+    """
+    Appends records (sampled spans, routing decisions) to a JSONL file from a background thread,
+    off the turn's critical path.
+    """
+
+    def __init__(self, path: str, name: str = "span-writer"):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(record) + "\n" for record in batch)
+            except OSError as e:
+                logger.warning("Could not write %d records to %s: %s", len(batch), self.path, e)
+
+
+class Tracer:
+    """
+    Per-node instrumentation for the game graph.
+
+    `trace_node` wraps each node registered in `create_game_agent`, `llm_call` wraps every LLM
+    request and `turn` groups one graph run into a trace. Every node run and LLM call updates the
+    Prometheus metrics (wall time, LLM vs local time, prompt/response size, cache outcome); only
+    a `sample_rate` share of turns also measure the size of node updates and export their spans to `spans_path`.
+    """
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, spans_path: str = TRACE_SPANS_PATH):
+        self.sample_rate = sample_rate
+        self._writer = JsonlWriter(spans_path) if spans_path else None
+
+        self.metrics = MetricsRegistry()
+        m = self.metrics
+        m.histogram("game_turn_duration_seconds", "Wall time of one graph run.")
+        m.histogram("game_node_duration_seconds", "Wall time of a graph node.", ("node",))
+        m.histogram("game_node_llm_seconds", "Time a graph node spent waiting on LLM calls.", ("node",))
+        m.histogram("game_node_local_seconds", "Time a graph node spent outside LLM calls.", ("node",))
+        m.counter("game_node_errors_total", "Graph node runs that raised.", ("node",))
+        m.histogram("game_node_update_bytes", "Serialized size of the state update a node returned (sampled turns only).", ("node",), SIZE_BUCKETS)
+        m.histogram("llm_request_duration_seconds", "LLM call time, including the concurrency queue.", ("kind", "cache"))
+        m.histogram("llm_queue_seconds", "Time an LLM call waited for a concurrency slot.", ("kind",))
+        m.counter("llm_requests_total", "LLM calls by prompt type and cache outcome.", ("kind", "cache"))
+        m.counter("llm_errors_total", "LLM calls that raised.", ("kind",))
+        m.counter("llm_prompt_chars_total", "Characters sent to the LLM.", ("kind",))
+        m.counter("llm_prompt_tokens_total", "Prompt tokens (reported by the provider, or estimated).", ("kind",))
+        m.counter("llm_response_chars_total", "Characters received from the LLM.", ("kind",))
+        m.counter("llm_response_tokens_total", "Response tokens (reported by the provider, or estimated).", ("kind",))
+        m.counter("pregenerated_scene_lookups_total", "describe_scene lookups in the pre-generated scene store.", ("outcome",))
+        # Structured scenes (src/structured_scene.py)
+        m.counter("structured_scenes_total", "Structured scene responses, by whether they parsed, were salvaged or failed.", ("outcome",))
+        m.counter("generated_effects_rejected_total", "Proposed effects of made-up choices dropped or clamped by the game rules.", ("rule",))
+        # Resilience policy (src/resilience.py)
+        m.counter("llm_timeouts_total", "LLM requests abandoned at their deadline.", ("kind",))
+        m.counter("llm_retries_total", "LLM requests retried after a transient error.", ("kind",))
+        m.counter("llm_hedges_total", "Duplicate requests fired because the first outlived the recent p95.", ("kind",))
+        m.counter("llm_hedge_wins_total", "Hedged duplicates that answered before the original.", ("kind",))
+        m.counter("llm_fallbacks_total", "LLM calls answered by the fallback tier or a canned response.", ("kind", "target"))
+        # Model routing (src/router.py)
+        m.counter("llm_route_decisions_total", "LLM calls routed to a model tier, by why that tier was picked.", ("kind", "tier", "reason"))
+        # Rate budgets and admission control (src/scheduler.py)
+        m.histogram("llm_queue_wait_seconds", "Time LLM requests waited for rate budget, by priority class.", ("tier", "class"))
+        m.counter("llm_admission_rejections_total", "LLM requests turned away instead of queuing for rate budget.", ("tier", "class", "reason"))
+
+    # --- Span plumbing ---
+
+    def _start(self, name: str, kind: str) -> Tuple[Span, contextvars.Token]:
+        parent = _current_span.get()
+        sampled = parent.sampled if parent is not None else random.random() < self.sample_rate
+        span = Span(name, kind, parent, sampled)
+        return span, _current_span.set(span)
+
+    def _end(self, span: Span, token: contextvars.Token) -> float:
+        duration = time.perf_counter() - span.start
+        span.end_ns = span.start_ns + int(duration * 1e9)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # A generator finished in a different context than it started in; nothing to restore
+            pass
+        if span.sampled and self._writer is not None:
+            self._writer.write(span.to_otel())
+        return duration
+
+    @contextmanager
+    def turn(self, **attributes: Any) -> Iterator[Span]:
+        """Groups the nodes and LLM calls of one graph run into a single trace."""
+        span, token = self._start("game_turn", "turn")
+        span.attributes.update(attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            self.metrics.observe("game_turn_duration_seconds", (), self._end(span, token))
+
+    # --- Nodes ---
+
+    def _finish_node(self, name: str, span: Span, token: contextvars.Token, result: Any) -> None:
+        if span.sampled and result is not None:
+            size = _update_bytes(result)
+            if size is not None:
+                span.attributes["game.update_bytes"] = size
+                self.metrics.observe("game_node_update_bytes", (name,), size)
+        duration = self._end(span, token)
+        labels = (name,)
+        self.metrics.observe("game_node_duration_seconds", labels, duration)
+        self.metrics.observe("game_node_llm_seconds", labels, span.llm_seconds)
+        self.metrics.observe("game_node_local_seconds", labels, max(0.0, duration - span.llm_seconds))
+        if span.error:
+            self.metrics.inc("game_node_errors_total", labels)
+        logger.debug("node %s took %.1f ms (llm %.1f ms)", name, duration * 1000, span.llm_seconds * 1000)
+
+    def trace_node(self, name: str, func: Callable) -> Callable:
+        """Wraps a (sync or async) graph node so each run is timed and recorded under `name`."""
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def atraced(state, *args, **kwargs):
+                span, token = self._start(f"node.{name}", "node")
+                result = None
+                try:
+                    result = await func(state, *args, **kwargs)
+                    return result
+                except BaseException as e:
+                    span.error = repr(e)
+                    raise
+                finally:
+                    self._finish_node(name, span, token, result)
+            return atraced
+
+        @functools.wraps(func)
+        def traced(state, *args, **kwargs):
+            span, token = self._start(f"node.{name}", "node")
+            result = None
+            try:
+                result = func(state, *args, **kwargs)
+                return result
+            except BaseException as e:
+                span.error = repr(e)
+                raise
+            finally:
+                self._finish_node(name, span, token, result)
+        return traced
+
+    # --- LLM calls ---
+
+    @contextmanager
+    def llm_call(self, kind: str, messages: list) -> Iterator[LLMCall]:
+        """
+        Wraps one LLM request: `with tracer.llm_call("scene", messages) as call:`, then call
+        `call.slot_acquired()` once a concurrency slot is held and set `call.response`.
+        The time is charged to the enclosing node as LLM time.
+        """
+        from src.context import estimate_tokens
+
+        node = _current_span.get()
+        span, span_token = self._start(f"llm.{kind}", "llm")
+        call = LLMCall(kind)
+        call_token = _current_llm_call.set(call)
+        try:
+            yield call
+        except BaseException as e:
+            span.error = repr(e)
+            self.metrics.inc("llm_errors_total", (kind,))
+            raise
+        finally:
+            _current_llm_call.reset(call_token)
+            prompt = "".join(str(m.content) for m in messages)
+            response_text = str(call.response.content) if call.response is not None else ""
+            usage = getattr(call.response, "usage_metadata", None) or {}
+            prompt_tokens = usage.get("input_tokens") or estimate_tokens(prompt)
+            response_tokens = usage.get("output_tokens") or estimate_tokens(response_text)
+            span.attributes.update({
+                "llm.kind": kind,
+                "llm.cache": call.cache,
+                "llm.queue_ms": round(call.queue_seconds * 1000, 2),
+                "llm.attempts": call.attempts,
+                "llm.prompt_chars": len(prompt),
+                "llm.prompt_tokens": prompt_tokens,
+                "llm.response_chars": len(response_text),
+                "llm.response_tokens": response_tokens,
+            })
+            duration = self._end(span, span_token)
+            if node is not None:
+                node.llm_seconds += duration
+
+            m = self.metrics
+            m.observe("llm_request_duration_seconds", (kind, call.cache), duration)
+            m.observe("llm_queue_seconds", (kind,), call.queue_seconds)
+            m.inc("llm_requests_total", (kind, call.cache))
+            m.inc("llm_prompt_chars_total", (kind,), len(prompt))
+            m.inc("llm_prompt_tokens_total", (kind,), prompt_tokens)
+            m.inc("llm_response_chars_total", (kind,), len(response_text))
+            m.inc("llm_response_tokens_total", (kind,), response_tokens)
+
+    # --- Reporting ---
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Where turn time goes: per node, run count and mean wall / LLM / local milliseconds."""
+        wall = self.metrics.series("game_node_duration_seconds")
+        llm = self.metrics.series("game_node_llm_seconds")
+        report = {}
+        for (node,), series in sorted(wall.items()):
+            runs = series[-1]
+            llm_total = llm.get((node,), [0.0, 0.0])[-2]
+            report[node] = {
+                "runs": int(runs),
+                "mean_ms": round(series[-2] / runs * 1000, 2) if runs else 0.0,
+                "mean_llm_ms": round(llm_total / runs * 1000, 2) if runs else 0.0,
+                "mean_local_ms": round((series[-2] - llm_total) / runs * 1000, 2) if runs else 0.0,
+            }
+        return report
+
+
+# Process-wide tracer used by src/agent.py (nodes and LLM calls) and exposed by server.py at /metrics
+tracer = Tracer()
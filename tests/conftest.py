@@ -0,0 +1,32 @@
+import os
+import itertools
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+# Keep the suite off the real response cache file; src.agent builds its cache on import
+os.environ["LLM_CACHE_PATH"] = ""
+
+from src import agent
+
+
+def fixed_model(text: str) -> GenericFakeChatModel:
+    """A chat model that answers every prompt with `text`."""
+    return GenericFakeChatModel(messages=itertools.repeat(AIMessage(content=text)))
+
+
+@pytest.fixture
+def use_llm():
+    """agent.set_llm, undone after the test."""
+    overrides = dict(agent.router._overrides)
+    yield agent.set_llm
+    agent.router.set_models(overrides)
+
+
+@pytest.fixture(autouse=True)
+def isolated_response_cache():
+    """The (memory-only) response cache, emptied after every test so no answer leaks into the next."""
+    assert agent.response_cache._db is None
+    yield
+    agent.response_cache.clear()
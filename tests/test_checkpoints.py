@@ -0,0 +1,74 @@
+from src.checkpoints import CheckpointSessionStore
+from src.state import GameState, Player, SCENE, OUTCOME
+
+
+def play(state: GameState, location_id: str, flags=None) -> GameState:
+    """The state after one more turn ending at `location_id`."""
+    state = state.model_copy(deep=True)
+    state.add_segment(OUTCOME, f"You head for {location_id}.")
+    state.add_segment(SCENE, f"You arrive at {location_id}.")
+    state.player = Player(current_location_id=location_id, health=state.player.health - 1)
+    state.plot_flags = {**state.plot_flags, **(flags or {})}
+    return state
+
+
+def test_rewind_and_replay_by_another_store_is_not_hidden_by_the_cache(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    a = CheckpointSessionStore(path=path)
+    b = CheckpointSessionStore(path=path)
+
+    state = GameState()
+    state.add_segment(SCENE, "The forest is quiet.")
+    a.put("s", state)
+    for location_id in ("forest_path", "forest_clearing", "forest_stream"):
+        state = play(state, location_id)
+        a.put("s", state)
+    assert a.current_turn("s") == 3
+    assert a.get("s").player.current_location_id == "forest_stream"
+
+    # B takes back the last turn and plays a different one: turn 3 again, on another branch
+    rewound = b.rewind("s", 2)
+    assert rewound.player.current_location_id == "forest_clearing"
+    b.put("s", play(rewound, "deep_forest", {"tower_seen": True}))
+
+    current = a.get("s")
+    assert current.player.current_location_id == "deep_forest"
+    assert current.plot_flags == {"tower_seen": True}
+
+    # A's next turn continues B's branch instead of writing over it
+    a.put("s", play(current, "old_tower"))
+    history = b.get("s")
+    assert history.player.current_location_id == "old_tower"
+    assert history.plot_flags == {"tower_seen": True}
+    assert [s.text for s in history.segments if s.kind == SCENE][-2:] == ["You arrive at deep_forest.", "You arrive at old_tower."]
+
+
+def test_rewind_by_another_store_without_replay(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    a = CheckpointSessionStore(path=path)
+    b = CheckpointSessionStore(path=path)
+
+    state = GameState()
+    state.add_segment(SCENE, "The forest is quiet.")
+    a.put("s", state)
+    a.put("s", play(state, "forest_path"))
+    assert b.rewind("s", 0).player.current_location_id == "start_forest"
+    assert a.get("s").player.current_location_id == "start_forest"
+    assert len(a.get("s").segments) == 1
+
+
+def test_a_stale_writer_does_not_splice_its_turns_onto_another_branch(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    a = CheckpointSessionStore(path=path)
+    b = CheckpointSessionStore(path=path)
+
+    state = GameState()
+    state.add_segment(SCENE, "The forest is quiet.")
+    a.put("s", state)
+    stale = b.get("s")
+    a.put("s", play(state, "forest_path"))
+
+    # B still holds the opening scene and plays two turns from it
+    written = play(play(stale, "forest_clearing"), "forest_stream")
+    b.put("s", written)
+    assert [s.text for s in a.get("s").segments] == [s.text for s in written.segments]
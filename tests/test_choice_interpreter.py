@@ -0,0 +1,49 @@
+import asyncio
+
+from src import agent
+from src.choice_interpreter import ChoiceInterpreter
+from src.fake_llm import FakeChatModel
+from src.state import GameState, Player, SCENE, to_graph_input
+from src.story import get_story
+
+CHOICES = ["Go deeper into the forest", "Look for a path to the village", "Examine the strange glowing mushroom"]
+
+
+def test_llm_verdict_of_invalid_input_carries_its_nudge():
+    interpreter = ChoiceInterpreter(llm_resolver=lambda choices, text: "INVALID_CHOICE: You can't fly. Try another path.")
+    match = interpreter.interpret("fly over the trees", CHOICES)
+    assert (match.choice, match.tier, match.reply) == (None, "llm", "You can't fly. Try another path.")
+
+
+def test_only_locally_resolved_input_counts_as_avoided_calls():
+    interpreter = ChoiceInterpreter(llm_resolver=lambda choices, text: "INVALID_CHOICE")
+    interpreter.interpret("Go deeper into the forest", CHOICES) # exact
+    interpreter.interpret("go deeper in the forrest", CHOICES) # fuzzy
+    interpreter.interpret("sing a song", CHOICES) # llm
+    interpreter.interpret("", CHOICES) # unresolved
+    report = interpreter.report()
+    assert report["total"] == 4
+    assert report["llm_calls_avoided"] == 1
+
+
+def test_invalid_input_costs_one_llm_call(use_llm):
+    model = FakeChatModel(latency_ms=0.0, latency_sigma=0.0)
+    use_llm(model)
+    story = get_story()
+    state = GameState(player=Player(current_location_id="start_forest", current_location_name=story.location_name("start_forest")))
+    state.add_segment(SCENE, "The forest is quiet.")
+    state.available_choices = list(story.choices("start_forest"))
+
+    for run in (agent.handle_user_choice, lambda values: asyncio.run(agent.ahandle_user_choice(values))):
+        model.calls.clear()
+        update = run(to_graph_input(state.model_copy(update={"user_input": "sing to the owls"})))
+        assert [call["kind"] for call in model.calls] == ["choice_interpretation"]
+        assert update["segments"][0].text == "That action isn't possible here. Please choose one of the available paths."
+        assert update["player"].current_location_id == "start_forest"
+
+
+def test_words_contained_in_other_words_are_not_typos():
+    interpreter = ChoiceInterpreter()
+    choices = ["Go deeper into the forest", "Rest and recover health"]
+    assert interpreter.interpret("rest", choices).choice == "Rest and recover health"
+    assert interpreter.interpret("go deeper into the forrest", choices).choice == "Go deeper into the forest"
@@ -0,0 +1,30 @@
+from src.context import StoryContextManager, trim_to_sentences
+from src.state import GameState, SCENE
+
+SUMMARY = "You woke in the forest. You found a rusty key by the stream! A crow watched you leave."
+
+
+def test_trimming_keeps_whole_sentences_from_the_end():
+    assert trim_to_sentences(SUMMARY, 60) == "A crow watched you leave."
+    assert trim_to_sentences("one long sentence without an end", 12) == "an end"
+    assert trim_to_sentences(SUMMARY, len(SUMMARY)) == SUMMARY
+
+
+def test_an_over_budget_summary_is_cut_at_a_sentence_and_rewritten():
+    calls = []
+
+    def summarizer(summary, scenes):
+        calls.append((summary, scenes))
+        return "A crow saw you leave the forest with a key."
+
+    context = StoryContextManager(summarizer=summarizer, recent_scenes=1, token_budget=25)
+    state = GameState(story_summary=SUMMARY, summarized_scene_count=0)
+    state.add_segment(SCENE, "The old tower looms over the trees ahead.") # 11 tokens
+    assert "Summary of earlier events: ... A crow watched you leave.\n\n" in context.build_context(state)
+
+    context._executor.shutdown(wait=True)
+    assert calls == [(SUMMARY, [])]
+    assert context.apply_ready_summary(state)
+    assert state.story_summary == "A crow saw you leave the forest with a key."
+    assert state.summarized_scene_count == 0
+    assert "Summary of earlier events: A crow saw you leave the forest with a key." in context.build_context(state)
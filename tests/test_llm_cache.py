@@ -0,0 +1,42 @@
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from src.llm_cache import TieredResponseCache
+
+
+def response(text: str) -> list:
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def test_lookups_collecting_variants_are_misses(tmp_path):
+    cache = TieredResponseCache(path=str(tmp_path / "responses.sqlite"), variants=3)
+    for i in range(3):
+        assert cache.lookup("prompt", "model") is None
+        cache.update("prompt", "model", response(f"variant {i}"))
+    report = cache.report()
+    assert (report["misses"], report["memory_hits"], report["disk_hits"], report["writes"]) == (3, 0, 0, 3)
+    assert report["hit_ratio"] == 0.0
+
+    assert cache.lookup("prompt", "model")[0].text in {"variant 0", "variant 1", "variant 2"}
+    assert cache.report()["memory_hits"] == 1
+    assert cache.report()["hit_ratio"] == 0.25
+
+
+def test_disk_hits_are_counted_once(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    TieredResponseCache(path=path).update("prompt", "model", response("stored"))
+    cache = TieredResponseCache(path=path)
+    assert cache.lookup("prompt", "model")[0].text == "stored"
+    assert cache.lookup("prompt", "model")[0].text == "stored"
+    assert {k: cache.stats[k] for k in ("disk_hits", "memory_hits", "misses")} == {"disk_hits": 1, "memory_hits": 1, "misses": 0}
+
+
+def test_expired_entries_make_room_before_live_ones_are_evicted(tmp_path):
+    cache = TieredResponseCache(path=str(tmp_path / "responses.sqlite"), max_bytes=1000, ttl_seconds=3600)
+    cache.update("old", "model", response("x" * 896)) # 900 bytes as JSON
+    cache._db.execute("UPDATE responses SET stored_at = stored_at - 7200") # Now expired
+    for i in range(3):
+        cache.update(f"prompt {i}", "model", response(f"{i}" * 40)) # 44 bytes each
+    assert [cache.lookup(f"prompt {i}", "model") is not None for i in range(3)] == [True, True, True]
+    assert cache.stats["evictions"] == 1
+    assert cache.report()["disk_bytes"] == 3 * 44
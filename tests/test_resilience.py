@@ -0,0 +1,124 @@
+import time
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from src import agent
+from src.fake_llm import FakeChatModel, FakeLLMError
+from src.resilience import LLMUnavailableError, ResilientLLM
+from src.router import FAST, QUALITY, TIER_LIMITERS, TIER_SCHEDULERS, Target
+from src.state import GameState
+from src.telemetry import tracer
+
+MESSAGES = [HumanMessage(content="Please describe the current scene.")]
+STALL_MS = 1000 # Far beyond the deadlines below
+
+
+class FirstCallStalls(FakeChatModel):
+    """Answers instantly, except that its first request hangs (a stuck connection)."""
+
+    def _plan(self, messages):
+        plan = super()._plan(messages)
+        if len(self.calls) == 1:
+            plan["delay"] += STALL_MS / 1000.0
+        return plan
+
+
+def instant(**kwargs) -> FakeChatModel:
+    return FakeChatModel(latency_ms=5.0, latency_sigma=0.0, **kwargs)
+
+
+def target(model, tier: str = QUALITY) -> Target:
+    return Target(tier, model, TIER_LIMITERS[tier], TIER_SCHEDULERS[tier], 100)
+
+
+def invoke(llm: ResilientLLM, primary: Target, fallback=None, run_async: bool = False):
+    with tracer.llm_call("scene", MESSAGES) as call:
+        if run_async:
+            return asyncio.run(llm.ainvoke(MESSAGES, call, primary, fallback))
+        return llm.invoke(MESSAGES, call, primary, fallback)
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_deadline_gives_up_on_a_stalled_model(run_async):
+    llm = ResilientLLM(deadline=0.3, max_retries=1, hedge_percentile=0)
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError):
+        invoke(llm, target(instant(stall_rate=1.0, stall_ms=STALL_MS)), run_async=run_async)
+    assert time.monotonic() - started < 0.3 + 0.2
+    assert llm.stats["timeouts"] >= 1
+    assert llm.stats["unavailable"] == 1
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_stalled_primary_falls_back_within_the_deadline(run_async):
+    llm = ResilientLLM(deadline=0.4, hedge_percentile=0)
+    fallback_model = instant(model="fake-lite")
+    started = time.monotonic()
+    response = invoke(llm, target(instant(stall_rate=1.0, stall_ms=STALL_MS)), target(fallback_model, FAST), run_async=run_async)
+    assert response.content
+    assert time.monotonic() - started < 0.4
+    assert len(fallback_model.calls) == 1
+    assert (llm.stats["fallbacks"], llm.stats["unavailable"]) == (1, 0)
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_failures_are_retried_then_fall_back(run_async):
+    llm = ResilientLLM(deadline=5, max_retries=2, retry_base=0.01, hedge_percentile=0)
+    primary_model, fallback_model = instant(failure_rate=1.0), instant(model="fake-lite")
+    response = invoke(llm, target(primary_model), target(fallback_model, FAST), run_async=run_async)
+    assert response.content
+    assert len(primary_model.calls) == 3 # The first attempt and two retries
+    assert llm.stats["retries"] == 2
+    assert len(fallback_model.calls) == 1
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_slow_request_is_hedged_and_the_duplicate_wins(run_async):
+    llm = ResilientLLM(deadline=5, hedge_percentile=0.95, hedge_min_samples=5)
+    for _ in range(5):
+        invoke(llm, target(instant()), run_async=run_async) # Recent latencies: a few ms
+    model = FirstCallStalls(latency_ms=5.0, latency_sigma=0.0)
+    started = time.monotonic()
+    assert invoke(llm, target(model), run_async=run_async).content
+    assert time.monotonic() - started < STALL_MS / 1000.0 / 2
+    assert len(model.calls) == 2
+    assert (llm.stats["hedges"], llm.stats["hedge_wins"]) == (1, 1)
+
+
+class FirstStreamBreaks(FakeChatModel):
+    """Streams the first few words of its first answer, then drops the connection."""
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        first = not self.calls
+        for n, chunk in enumerate(super()._stream(messages, stop, run_manager, **kwargs)):
+            if first and n == 3:
+                raise FakeLLMError("Connection dropped mid-stream.")
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        first = not self.calls
+        n = 0
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            if first and n == 3:
+                raise FakeLLMError("Connection dropped mid-stream.")
+            n += 1
+            yield chunk
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_text_streamed_by_a_failed_attempt_is_taken_back(use_llm, run_async):
+    use_llm(FirstStreamBreaks(latency_ms=0.0, latency_sigma=0.0))
+    if run_async:
+        async def play():
+            return [event async for event in agent.astream_game_turn(GameState())]
+        events = asyncio.run(play())
+    else:
+        events = list(agent.stream_game_turn(GameState()))
+
+    kinds = [kind for kind, _ in events]
+    assert kinds.index("token") < kinds.index("reset")
+    streamed = "".join(text for kind, text in events[kinds.index("reset") + 1:] if kind == "token")
+    state = events[-1][1]
+    assert streamed.strip() and streamed.strip() in state.segments[-1].text
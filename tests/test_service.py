@@ -0,0 +1,46 @@
+import time
+import asyncio
+
+from src.agent import get_game_agent
+from src.fake_llm import FakeChatModel
+from src.service import GameService
+from src.session_store import InMemorySessionStore
+
+STORE_DELAY = 0.2
+
+
+class SlowStore(InMemorySessionStore):
+    """A store whose writes wait, like SQLite behind another worker's write lock."""
+
+    def put(self, session_id, state):
+        time.sleep(STORE_DELAY)
+        super().put(session_id, state)
+
+
+def test_store_writes_do_not_block_the_event_loop(use_llm):
+    use_llm(FakeChatModel(latency_ms=0.0, latency_sigma=0.0))
+    get_game_agent() # Compiled up front, as the server's lifespan does
+    service = GameService(SlowStore(spill_path=""))
+    session_id, _ = service.create_session()
+
+    async def play_while_ticking():
+        gaps = []
+        done = asyncio.Event()
+
+        async def tick():
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        ticker = asyncio.create_task(tick())
+        state = await service.run_turn(session_id)
+        done.set()
+        await ticker
+        return state, max(gaps)
+
+    state, longest_gap = asyncio.run(play_while_ticking())
+    assert state.available_choices
+    assert longest_gap < STORE_DELAY / 2
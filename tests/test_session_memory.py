@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from src.checkpoints import CheckpointSessionStore
+from src.session_memory import SessionMemory
+from src.session_store import InMemorySessionStore
+from src.state import GameState, SCENE, SYSTEM
+
+
+def opening_state() -> GameState:
+    state = GameState(available_choices=["Go deeper into the forest"], plot_flags={"tower_seen": False})
+    state.add_segment(SCENE, "The forest is quiet.")
+    return state
+
+
+def mutate(state: GameState) -> None:
+    """What app.py's error paths do to the state they hold."""
+    state.add_segment(SYSTEM, "An error occurred while processing your choice.")
+    state.available_choices = ["Restart"]
+    state.player.health = 0
+    state.plot_flags["tower_seen"] = True
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: InMemorySessionStore(spill_path=str(tmp_path / "spilled.sqlite")),
+    lambda tmp_path: CheckpointSessionStore(path=str(tmp_path / "checkpoints.sqlite")),
+])
+def test_modifying_a_state_put_or_got_does_not_change_the_store(tmp_path, make_store):
+    store = make_store(tmp_path)
+    put = opening_state()
+    store.put("s", put)
+    mutate(put)
+    mutate(store.get("s"))
+    assert store.get("s").model_dump() == opening_state().model_dump()
+
+
+def test_spilled_sessions_are_not_changed_through_a_returned_state():
+    spilled = {}
+    memory = SessionMemory(spill_after=60, spill=spilled.__setitem__)
+    memory.put("s", opening_state())
+    mutate(memory.get("s"))
+    memory.sweep(time.monotonic() + 3600)
+    assert spilled["s"].model_dump() == opening_state().model_dump()
+
+
+def test_flags_outside_the_story_round_trip_without_taking_a_bit():
+    from src.session_memory import CompactSession, get_flag_table
+    table = get_flag_table()
+    bits = dict(table._bits)
+    state = opening_state()
+    state.plot_flags["made_up_by_a_generated_scene"] = True
+    compact = CompactSession.from_state(state)
+    assert compact.other_flags == {"made_up_by_a_generated_scene": True}
+    assert compact.to_state().plot_flags == state.plot_flags
+    assert table._bits == bits
@@ -0,0 +1,11 @@
+import pytest
+
+from src.simulate import POLICIES, build_tables, check_against_game
+from src.story import get_story
+
+
+@pytest.mark.parametrize("policy", ["random", "greedy"])
+def test_simulator_agrees_with_handle_user_choice(use_llm, policy):
+    # use_llm restores the chat models check_against_game swaps for a FakeChatModel
+    mismatches = check_against_game(build_tables(get_story()), POLICIES[policy](None), paths=20, max_turns=15, invalid_rate=0.1)
+    assert mismatches == []
@@ -0,0 +1,53 @@
+import pytest
+
+from src import agent
+from src.scheduler import BACKGROUND, request_class
+from src.speculation import SpeculativeTurnCache
+from src.state import GameState, Player, SCENE, SYSTEM
+from src.story import get_story
+
+from tests.conftest import fixed_model
+
+
+def opening_state() -> GameState:
+    story = get_story()
+    state = GameState(player=Player(current_location_id="start_forest", current_location_name=story.location_name("start_forest")))
+    state.add_segment(SCENE, "The forest is quiet.")
+    state.available_choices = list(story.choices("start_forest"))
+    return state
+
+
+def test_unusable_structured_scene_fails_a_background_turn_but_not_the_players(use_llm, monkeypatch):
+    use_llm(fixed_model("{ not json }"))
+    monkeypatch.setattr(agent, "SCENE_OUTPUT", agent.STRUCTURED)
+    state = opening_state()
+    choice = state.available_choices[0]
+
+    speculation = SpeculativeTurnCache(run_turn=agent.run_game_turn, max_concurrent=1)
+    speculation.prefetch(state)
+    assert speculation.take(state, choice, timeout=10) is None
+    assert speculation.stats["failed"] == 1
+
+    turn = agent.run_game_turn(state.model_copy(update={"user_input": choice}))
+    assert not any(segment.kind == SYSTEM for segment in turn.segments)
+    assert turn.available_choices == list(get_story().choices(turn.player.current_location_id))
+
+
+def test_canned_response_raises_for_background_requests():
+    with request_class(BACKGROUND, "s"), pytest.raises(agent.LLMUnavailableError):
+        agent.canned_response("scene", "text")
+    assert agent.canned_response("scene", "text") == "text"
+
+
+def test_turns_ending_in_an_error_notice_are_not_served():
+    def failing_turn(state: GameState) -> GameState:
+        state = state.model_copy(deep=True)
+        state.add_segment(SYSTEM, "An error occurred while generating the scene: boom")
+        state.available_choices = ["Restart"]
+        return state
+
+    state = opening_state()
+    speculation = SpeculativeTurnCache(run_turn=failing_turn, max_concurrent=1)
+    speculation.prefetch(state)
+    assert speculation.take(state, state.available_choices[0], timeout=10) is None
+    assert speculation.stats == {**speculation.stats, "hits": 0, "failed": 1}
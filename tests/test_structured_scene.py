@@ -0,0 +1,13 @@
+import pytest
+
+from src.story import Transition, get_story
+from src.structured_scene import GENERATED_HEALTH_MIN, check_effects
+
+
+def hurts(amount: int) -> Transition:
+    return Transition("Wade into the bog", None, "The bog bites.", -amount, (), (), ())
+
+
+@pytest.mark.parametrize("health, change", [(100, GENERATED_HEALTH_MIN), (12, -11), (1, 0), (0, 0)])
+def test_a_generated_choice_does_not_end_the_game_on_its_own(health, change):
+    assert check_effects(hurts(20), health, [], get_story()).health == change